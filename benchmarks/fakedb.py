@@ -0,0 +1,87 @@
+# coding=utf-8
+"""
+Creates a fake MyVideos database with the tables and indexes that Kodi uses for bookmarks.
+
+Filler files with bookmarks can be added so that lookups hit a database of realistic size.
+"""
+
+import os
+import sqlite3
+
+DB_NAME = "MyVideos116.db"
+
+SCHEMA = [
+    "CREATE TABLE path (idPath INTEGER PRIMARY KEY, strPath TEXT, strContent TEXT, strScraper TEXT, strHash TEXT, scanRecursive INTEGER, useFolderNames BOOL, strSettings TEXT, noUpdate BOOL, exclude BOOL, dateAdded TEXT, idParentPath INTEGER);",
+    "CREATE UNIQUE INDEX ix_path ON path (strPath);",
+    "CREATE TABLE files (idFile INTEGER PRIMARY KEY, idPath INTEGER, strFilename TEXT, playCount INTEGER, lastPlayed TEXT, dateAdded TEXT);",
+    "CREATE INDEX ix_files ON files (idPath, strFilename);",
+    "CREATE TABLE bookmark (idBookmark INTEGER PRIMARY KEY, idFile INTEGER, timeInSeconds DOUBLE, totalTimeInSeconds DOUBLE, thumbNailImage TEXT, player TEXT, playerState TEXT, type INTEGER);",
+    "CREATE INDEX ix_bookmark ON bookmark (idFile, type);"
+]
+
+
+def create(database_dir, filler_files=0):
+    """
+    Creates empty database, any existing database is replaced
+
+    Returns filename of database
+    """
+
+    if not os.path.exists(database_dir):
+        os.makedirs(database_dir)
+
+    db_file = os.path.join(database_dir, DB_NAME)
+    if os.path.isfile(db_file):
+        os.remove(db_file)
+
+    conn = sqlite3.connect(db_file)
+    try:
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+            for i in range(filler_files):
+                _add_file(conn, "/media/recordings/filler%04i/" % (i // 100),
+                          "recording%06i.ts" % i, 3600, 6)
+    finally:
+        conn.close()
+
+    return db_file
+
+
+def _add_file(conn, strPath, strFilename, total, count):
+
+    row = conn.execute(
+        "SELECT idPath FROM path WHERE strPath = ?;", (strPath,)).fetchone()
+    if row != None:
+        idPath = row[0]
+    else:
+        idPath = conn.execute(
+            "INSERT INTO path (strPath) VALUES (?);", (strPath,)).lastrowid
+
+    idFile = conn.execute("INSERT INTO files (idPath, strFilename) VALUES (?, ?);",
+                          (idPath, strFilename)).lastrowid
+
+    for i in range(count):
+        # bookmarks of type 0 are user's bookmarks, Kodi stores them with a thumbnail
+        conn.execute("""
+            INSERT INTO bookmark (idFile, timeInSeconds, totalTimeInSeconds, thumbNailImage, player, type)
+            VALUES (?, ?, ?, ?, 'VideoPlayer', 0);
+            """, (idFile, total * (i + 1) / (count + 1), total,
+                  "special://profile/Thumbnails/Video/Bookmarks/%i_%i.jpg" % (idFile, i)))
+
+    return idFile
+
+
+def add_bookmarks(db_file, filename, total, count):
+    """
+    Adds file with count bookmarks in equal distances
+    """
+
+    strPath, strFilename = os.path.split(filename)
+    conn = sqlite3.connect(db_file)
+    try:
+        with conn:
+            _add_file(conn, strPath + os.sep, strFilename, total, count)
+    finally:
+        conn.close()
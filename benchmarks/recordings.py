@@ -0,0 +1,97 @@
+# coding=utf-8
+"""
+Synthesizes test recordings by ffmpeg's lavfi sources that look like DVB recordings, i.e. MPEG-TS
+with h264 or mpeg2 video, several audio tracks with language tags and optionally DVB subtitles.
+
+ffmpeg cannot render text to bitmap subtitles, so DVB subtitles are only added if a sample file
+with a dvb_subtitle stream is given. Its subtitle track is copied and looped over the recording.
+"""
+
+import os
+import subprocess
+
+# video variants of test recordings
+VARIANTS = {
+    "sd_mpeg2": {
+        "size": "720x576",
+        "rate": 25,
+        "codec": ["-c:v", "mpeg2video", "-b:v", "4M", "-maxrate", "6M", "-bufsize", "1835k",
+                  "-g", "12", "-bf", "2", "-flags", "+ilme+ildct", "-top", "1",
+                  "-aspect", "16:9"]
+    },
+    "hd_h264": {
+        "size": "1280x720",
+        "rate": 50,
+        "codec": ["-c:v", "libx264", "-preset", "veryfast", "-b:v", "6M", "-maxrate", "8M",
+                  "-bufsize", "8M", "-g", "50", "-pix_fmt", "yuv420p"]
+    },
+    "fhd_h264": {
+        "size": "1920x1080",
+        "rate": 25,
+        "codec": ["-c:v", "libx264", "-preset", "veryfast", "-b:v", "10M", "-maxrate", "12M",
+                  "-bufsize", "12M", "-g", "50", "-pix_fmt", "yuv420p", "-flags", "+ilme+ildct"]
+    }
+}
+
+# audio tracks like a German broadcaster sends them
+AUDIO_TRACKS = [
+    {"frequency": 440, "codec": ["mp2", "-ac", "2", "-b", "192k"],
+        "language": "deu", "disposition": "default"},
+    {"frequency": 660, "codec": ["ac3", "-ac", "6", "-b", "448k"],
+        "language": "deu", "disposition": "0"},
+    {"frequency": 880, "codec": ["mp2", "-ac", "2", "-b", "128k"],
+        "language": "mis", "disposition": "visual_impaired"}
+]
+
+
+def recording_name(variant, length, subtitles=False):
+
+    return "%s_%is%s.ts" % (variant, length, "_sub" if subtitles else "")
+
+
+def generate(ffmpeg, directory, variant, length, subtitle_source=None, force=False):
+    """
+    Generates recording of given variant and length (in seconds) if it doesn't exist yet
+
+    Returns full-qualified filename of recording
+    """
+
+    filename = os.path.join(directory, recording_name(
+        variant, length, subtitle_source != None))
+    if os.path.isfile(filename) and not force:
+        return filename
+
+    spec = VARIANTS[variant]
+    call = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", "testsrc2=size=%s:rate=%i:duration=%i" % (spec["size"], spec["rate"], length)]
+
+    for track in AUDIO_TRACKS:
+        call += ["-f", "lavfi", "-i", "sine=frequency=%i:sample_rate=48000:beep_factor=4:duration=%i" % (
+            track["frequency"], length)]
+
+    if subtitle_source != None:
+        call += ["-stream_loop", "-1", "-i", subtitle_source]
+
+    call += ["-map", "0:v"]
+    call += spec["codec"]
+
+    for i, track in enumerate(AUDIO_TRACKS):
+        call += ["-map", "%i:a" % (i + 1),
+                 "-c:a:%i" % i, track["codec"][0]]
+        call += ["%s:a:%i" % (option, i)
+                 if option.startswith("-") else option for option in track["codec"][1:]]
+        call += ["-metadata:s:a:%i" % i, "language=%s" % track["language"],
+                 "-disposition:a:%i" % i, track["disposition"]]
+
+    if subtitle_source != None:
+        call += ["-map", "%i:s:0" % (len(AUDIO_TRACKS) + 1), "-c:s", "copy",
+                 "-metadata:s:s:0", "language=deu"]
+
+    # DVB recordings rarely start at timestamp 0
+    call += ["-t", str(length), "-output_ts_offset", "10",
+             "-f", "mpegts", "%s.tmp" % filename]
+
+    subprocess.check_call(call)
+    os.rename("%s.tmp" % filename, filename)
+
+    return filename
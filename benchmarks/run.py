@@ -0,0 +1,434 @@
+# coding=utf-8
+"""
+Benchmarks the cut pipeline outside Kodi. Kodi's modules are replaced by the stand-ins in kodistubs,
+recordings are synthesized by ffmpeg and bookmarks are taken from a fake video database.
+
+Each scenario runs Cutter.process() end to end for each recording. Results are written as json so
+that runs can be compared, e.g. before and after a change:
+
+    python benchmarks/run.py --output baseline.json
+    ... change something ...
+    python benchmarks/run.py --compare baseline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.join(os.path.dirname(BENCH_DIR),
+                         "plugin.video.ffmpeg-cutter")
+KODISTUBS_DIR = os.path.join(os.path.dirname(BENCH_DIR), "kodistubs")
+sys.path[:0] = [KODISTUBS_DIR, ADDON_DIR]
+
+import xbmc
+import xbmcaddon
+from myutils import ffmpegutils, kodiutils
+
+import cutter
+import fakedb
+import recordings
+
+RESULTS_VERSION = 1
+
+# settings of each scenario, all other settings are defaults of settings.xml
+SCENARIOS = [
+    ("copy", {"video": "0", "cut_mode": "0"}),
+    ("copy_single_pass", {"video": "0", "cut_mode": "1"}),
+    ("encode", {"video": "2", "cut_mode": "0"}),
+    ("encode_single_pass", {"video": "2", "cut_mode": "1"}),
+    ("smart", {"video": "3"})
+]
+
+# settings that avoid dialogs and side effects on the recording
+BENCHMARK_SETTINGS = {
+    "streams": "1",
+    "dir_selection": "false",
+    "confirm": "false",
+    "delete": "false",
+    "background": "false",
+    "recording_rename": "false",
+    "metrics": "true",
+    "metrics_log": "false",
+    "priority": "0"
+}
+
+
+def _median(values):
+
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 == 1 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def _environment(ffmpeg):
+
+    try:
+        ffmpeg_version = subprocess.check_output(
+            [ffmpeg, "-version"], universal_newlines=True).splitlines()[0]
+    except (OSError, subprocess.CalledProcessError):
+        ffmpeg_version = None
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                         universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": ffmpegutils.cpu_count(),
+        "ffmpeg": ffmpeg_version,
+        "commit": commit
+    }
+
+
+def _setup_kodi(workdir, settings):
+
+    xbmc.SPECIAL_PATHS.clear()
+    xbmc.SPECIAL_PATHS.update({
+        "special://profile/addon_data/%s" % xbmcaddon.ADDON_ID: os.path.join(workdir, "addon_data"),
+        "special://profile": os.path.join(workdir, "userdata"),
+        "special://database": os.path.join(workdir, "database")
+    })
+    xbmcaddon.SETTINGS[xbmcaddon.ADDON_ID] = settings
+
+
+def _reset_profile(workdir):
+
+    profile = os.path.join(workdir, "addon_data")
+    if os.path.exists(profile):
+        shutil.rmtree(profile)
+
+
+def _output_duration(ffmpegUtils, filename):
+
+    try:
+        out = ffmpegUtils.exec_ffprobe(["-print_format", "json",
+                                        "-show_entries", "format=duration", filename])
+        return float(json.loads(out)["format"]["duration"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def run_scenario(args, workdir, recording, scenario, settings):
+    """
+    Runs Cutter.process() for recording with given settings. Profile is cleared before the first
+    repetition so that the first result is measured with cold caches.
+    """
+
+    _setup_kodi(workdir, settings)
+    _reset_profile(workdir)
+
+    results = []
+    for repeat in range(args.repeat):
+
+        # bookmarks are deleted by the job, so database is created again for each run
+        db_file = fakedb.create(os.path.join(workdir, "database"),
+                                filler_files=args.filler)
+
+        c = cutter.Cutter()
+        ffprobe_json = c.ffmpegUtils.inspect_media(
+            recording, entries=ffmpegutils.INSPECT_ENTRIES)
+        duration = float(ffprobe_json["format"]["duration"])
+        fakedb.add_bookmarks(db_file, recording, duration, args.bookmarks)
+
+        # same selection as cut() does with stream filter and every second part marked
+        streams = c._filter_streams(recording, ffprobe_json)
+        bookmarks = kodiutils.select_bookmarks(recording)
+        markers = list(range(0, len(bookmarks) + 1, 2))
+
+        target_directory = os.path.join(workdir, "out", scenario)
+        if os.path.exists(target_directory):
+            shutil.rmtree(target_directory)
+        os.makedirs(target_directory)
+
+        job = {
+            "filename": recording,
+            "recording": None,
+            "streams": streams,
+            "cuts": c._calculate_real_cuts(bookmarks, markers),
+            "bookmarks": bookmarks,
+            "target_directory": target_directory
+        }
+
+        started = time.time()
+        c.process(job)
+        wall = time.time() - started
+
+        outputs = [os.path.join(target_directory, f)
+                   for f in sorted(os.listdir(target_directory))]
+        processes = c.metrics.record["processes"]
+
+        results += [{
+            "kind": "scenario",
+            "name": scenario,
+            "recording": os.path.basename(recording),
+            "repeat": repeat,
+            "wall": wall,
+            "stages": dict([(s["name"], s["wall"]) for s in c.metrics.record["stages"]]),
+            "ffmpeg_processes": len(processes),
+            "ffmpeg_failed": len([p for p in processes if p.get("return_code") != 0]),
+            "cpu": sum([p.get("cpu") or 0 for p in processes]),
+            "max_rss": max([p.get("max_rss") or 0 for p in processes] or [0]),
+            "expected_duration": c._get_total_duration(ffprobe_json, job["cuts"]),
+            "outputs": [{"file": os.path.basename(o),
+                         "bytes": os.path.getsize(o),
+                         "duration": _output_duration(c.ffmpegUtils, o)} for o in outputs]
+        }]
+
+        logging.info("%s %s #%i: %.2fs", scenario,
+                     os.path.basename(recording), repeat, wall)
+        shutil.rmtree(target_directory)
+
+    return results
+
+
+def run_calculate_real_cuts(args):
+
+    c = cutter.Cutter()
+    bookmarks = [{"timeInSeconds": i * 60, "totalTimeInSeconds": 500 * 60}
+                 for i in range(1, 500)]
+    markers = list(range(0, len(bookmarks) + 1, 2))
+
+    results = []
+    for repeat in range(args.repeat):
+        started = time.time()
+        for i in range(100):
+            c._calculate_real_cuts(bookmarks, markers)
+
+        results += [{"kind": "micro", "name": "calculate_real_cuts", "recording": None,
+                     "repeat": repeat, "wall": (time.time() - started) / 100}]
+
+    return results
+
+
+def run_select_bookmarks(args, workdir):
+
+    db_file = fakedb.create(os.path.join(workdir, "database"),
+                            filler_files=max(args.filler, 1000))
+    filename = "/media/recordings/bench/recording.ts"
+    fakedb.add_bookmarks(db_file, filename, 3600, args.bookmarks)
+
+    results = []
+    for repeat in range(args.repeat):
+        started = time.time()
+        for i in range(100):
+            kodiutils.select_bookmarks(filename)
+
+        results += [{"kind": "micro", "name": "select_bookmarks", "recording": None,
+                     "repeat": repeat, "wall": (time.time() - started) / 100}]
+
+    return results
+
+
+def run_exec_ffmpeg(args):
+    """
+    Compares exec_ffmpeg with a plain subprocess call of the same command in order to measure the
+    overhead of reading progress and stderr
+    """
+
+    ffmpegUtils = ffmpegutils.FFMpegUtils(args.ffmpeg, args.ffprobe)
+    params = ["-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=50:duration=10",
+              "-f", "null", "-"]
+
+    results = []
+    for repeat in range(args.repeat):
+        started = time.time()
+        with open(os.devnull, "w") as devnull:
+            subprocess.call([args.ffmpeg, "-hide_banner", "-y", "-nostats"] + params,
+                            stdout=devnull, stderr=devnull)
+        plain = time.time() - started
+
+        started = time.time()
+        ffmpegUtils.exec_ffmpeg(list(params))
+        wall = time.time() - started
+
+        results += [{"kind": "micro", "name": "exec_ffmpeg", "recording": None, "repeat": repeat,
+                     "wall": wall, "plain_subprocess": plain, "overhead": wall - plain}]
+
+    return results
+
+
+# measures time from start of context menu script until cutter knows the source file, i.e. imports,
+# settings and platform detection, in a fresh interpreter like Kodi does for each invocation
+STARTUP_SCRIPT = """
+import sys
+import time
+started = time.time()
+sys.path[:0] = %(path)r
+
+import xbmc
+import xbmcaddon
+import xbmcgui
+xbmc.SPECIAL_PATHS.update(%(special_paths)r)
+xbmcaddon.SETTINGS.update(%(settings)r)
+
+import cutter
+c = cutter.Cutter()
+c._select_source(xbmcgui.ListItem(path=%(filename)r))
+sys.stdout.write("%%f" %% (time.time() - started))
+"""
+
+
+def run_startup(args, workdir, filename):
+
+    script = STARTUP_SCRIPT % {
+        "path": [KODISTUBS_DIR, ADDON_DIR],
+        "special_paths": dict(xbmc.SPECIAL_PATHS),
+        "settings": dict(xbmcaddon.SETTINGS),
+        "filename": filename
+    }
+
+    results = []
+    for repeat in range(args.repeat):
+        wall = float(subprocess.check_output([sys.executable, "-c", script], cwd=workdir,
+                                             universal_newlines=True))
+        results += [{"kind": "micro", "name": "startup", "recording": None,
+                     "repeat": repeat, "wall": wall}]
+
+    return results
+
+
+def compare(baseline, current, threshold):
+    """
+    Prints median wall times of both runs side by side
+
+    Returns True if no result has become slower than allowed by threshold
+    """
+
+    def _medians(doc):
+        walls = {}
+        for r in doc["results"]:
+            walls.setdefault((r["kind"], r["name"], r["recording"]), []).append(r["wall"])
+        return dict([(key, _median(values)) for key, values in walls.items()])
+
+    before = _medians(baseline)
+    after = _medians(current)
+
+    ok = True
+    print("%-10s %-20s %-24s %12s %12s %8s" %
+          ("kind", "name", "recording", "baseline", "current", "ratio"))
+    for key in sorted(after, key=lambda k: tuple(str(v) for v in k)):
+        if key not in before:
+            continue
+
+        ratio = after[key] / before[key] if before[key] > 0 else 1.0
+        regression = ratio > 1 + threshold
+        ok = ok and not regression
+        print("%-10s %-20s %-24s %12.4f %12.4f %8.2f%s" % (key[0], key[1], key[2] or "-", before[key],
+                                                           after[key], ratio, "  !" if regression else ""))
+
+    return ok
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of ffmpeg cutter outside Kodi")
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    parser.add_argument("--ffprobe", default="ffprobe")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "ffmpeg-cutter-bench"),
+                        help="directory for recordings, profile and outputs, recordings are kept for next runs")
+    parser.add_argument("--variants", default="sd_mpeg2,hd_h264",
+                        help="comma-separated variants of recordings: %s" % ", ".join(sorted(recordings.VARIANTS)))
+    parser.add_argument("--lengths", default="60,300",
+                        help="comma-separated lengths of recordings in seconds")
+    parser.add_argument("--subtitle-source",
+                        help="recording with DVB subtitles whose subtitle track is added to test recordings")
+    parser.add_argument("--scenarios", default=",".join([s[0] for s in SCENARIOS]),
+                        help="comma-separated scenarios: %s" % ", ".join([s[0] for s in SCENARIOS]))
+    parser.add_argument("--no-micro", action="store_true",
+                        help="skip micro benchmarks")
+    parser.add_argument("--bookmarks", type=int, default=8,
+                        help="bookmarks per recording")
+    parser.add_argument("--filler", type=int, default=0,
+                        help="additional files with bookmarks in video database")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="overrides addon setting, e.g. --set encoder_preset=0")
+    parser.add_argument("--output", default="bench_output.txt")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="compares results with results of a former run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="tolerated slowdown when comparing, e.g. 0.1 for 10%%")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    logging.getLogger("kodi").setLevel(
+        logging.DEBUG if args.verbose else logging.ERROR)
+
+    workdir = os.path.abspath(args.workdir)
+    recordings_dir = os.path.join(workdir, "recordings")
+    if not os.path.exists(recordings_dir):
+        os.makedirs(recordings_dir)
+
+    settings = dict(BENCHMARK_SETTINGS)
+    settings.update({"ffmpeg": args.ffmpeg, "ffprobe": args.ffprobe})
+    settings.update(dict([s.split("=", 1) for s in args.set]))
+    _setup_kodi(workdir, settings)
+
+    files = []
+    for variant in args.variants.split(","):
+        for length in args.lengths.split(","):
+            logging.info("generate %s with %ss", variant, length)
+            files += [recordings.generate(args.ffmpeg, recordings_dir, variant, int(length),
+                                          subtitle_source=args.subtitle_source)]
+
+    results = []
+    if not args.no_micro:
+        results += run_calculate_real_cuts(args)
+        results += run_select_bookmarks(args, workdir)
+        results += run_exec_ffmpeg(args)
+        results += run_startup(args, workdir, files[0])
+
+    wanted = args.scenarios.split(",")
+    for scenario, scenario_settings in SCENARIOS:
+        if scenario not in wanted:
+            continue
+
+        for filename in files:
+            s = dict(settings)
+            s.update(scenario_settings)
+            s.update(dict([o.split("=", 1) for o in args.set]))
+            results += run_scenario(args, workdir,
+                                    filename, scenario, s)
+
+    doc = {
+        "version": RESULTS_VERSION,
+        "created": time.time(),
+        "environment": _environment(args.ffmpeg),
+        "settings": settings,
+        "repeat": args.repeat,
+        "results": results
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+
+    failed = [r for r in results if r.get("ffmpeg_failed")]
+    for r in failed:
+        logging.error("%s on %s: %i ffmpeg processes failed",
+                      r["name"], r["recording"], r["ffmpeg_failed"])
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(baseline, doc, args.threshold):
+            return 1
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+# coding=utf-8
+"""
+Cuts a recording without Kodi, e.g. on the NAS or the tvheadend server where the recordings are
+stored so that they don't have to be transferred over the network.
+
+Kodi's modules are replaced by the stand-ins in kodistubs, i.e. settings are taken from a
+settings file of the addon's profile in Kodi and from the command line, log messages and progress
+are written to the console. Cuts are given as ranges that are kept:
+
+    python cli/run.py --settings settings.xml --cut 00:02:10-00:31:45 --cut 00:38:00-01:02:30 recording.ts
+
+The job is processed by Cutter.process() exactly as in Kodi, i.e. segments are checkpointed and
+an interrupted job continues with the next run of the same command.
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADDON_DIR = os.path.join(ROOT_DIR, "plugin.video.ffmpeg-cutter")
+sys.path[:0] = [os.path.join(ROOT_DIR, "kodistubs"), ADDON_DIR]
+
+import xbmc
+import xbmcaddon
+import xbmcgui
+from myutils import ffmpegutils
+
+import cutter
+
+# settings that avoid dialogs, all other settings are taken from settings file and command line
+CLI_SETTINGS = {
+    "dir_selection": "false",
+    "confirm": "false",
+    "background": "false",
+    "bookmark_previews": "false",
+    "pause_on_playback": "false"
+}
+
+# value of setting video that re-encodes the video stream
+VIDEO_ENCODE = "2"
+
+
+def parse_time(value):
+    """
+    Parses seconds or [HH:]MM:SS with optional fraction of seconds
+    """
+
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+
+    return seconds
+
+
+def parse_cut(value):
+
+    try:
+        start, end = [parse_time(v) for v in value.split("-", 1)]
+    except ValueError:
+        raise argparse.ArgumentTypeError("%s is not a range like 00:02:10-00:31:45" % value)
+
+    if end <= start:
+        raise argparse.ArgumentTypeError("%s ends before it starts" % value)
+
+    return start, end
+
+
+def read_settings(filename):
+    """
+    Reads settings.xml of addon profile in Kodi, i.e. both <setting id="x">value</setting> of
+    Kodi 18 and later and <setting id="x" value="value" /> of former versions
+    """
+
+    settings = {}
+    for setting in ET.parse(filename).getroot().iter("setting"):
+        value = setting.get("value")
+        if value == None:
+            value = setting.text or ""
+
+        settings[setting.get("id")] = value
+
+    return settings
+
+
+def to_bookmarks(cuts, duration):
+    """
+    Translates ranges to keep into bookmarks and markers of selected chapters, so that cuts are
+    calculated by the same code as in Kodi
+    """
+
+    times = sorted(set([t for cut in cuts for t in cut if 0 < t < duration]))
+    bookmarks = [{"timeInSeconds": t, "totalTimeInSeconds": duration}
+                 for t in times]
+
+    boundaries = [0] + times + [duration]
+    markers = [i for i in range(len(boundaries) - 1)
+               if len([c for c in cuts if c[0] <= boundaries[i] and boundaries[i + 1] <= c[1]]) > 0]
+
+    return bookmarks, markers
+
+
+def encoder_settings(settings, encoder=None, preset=None, crf=None):
+    """
+    Translates encoder options into addon settings. Choosing an encoder re-encodes the video unless
+    settings already encode it, e.g. by smart rendering.
+    """
+
+    result = {}
+    if encoder != None:
+        result["encoder"] = str(cutter.ENCODERS.index(encoder))
+        if settings.get("video", "0") == "0":
+            result["video"] = VIDEO_ENCODE
+
+    if preset != None:
+        result["encoder_preset"] = str(ffmpegutils.PRESETS.index(preset))
+
+    if crf != None:
+        result["rate_control"] = str(cutter.RATE_CONTROL_CRF)
+        result["crf"] = str(crf)
+
+    return result
+
+
+def _setup_kodi(profile_dir, settings):
+
+    xbmc.SPECIAL_PATHS.clear()
+    xbmc.SPECIAL_PATHS.update({
+        "special://profile/addon_data/%s" % xbmcaddon.ADDON_ID: profile_dir,
+        "special://profile": os.path.join(profile_dir, "userdata"),
+        "special://database": os.path.join(profile_dir, "database")
+    })
+    xbmcaddon.SETTINGS[xbmcaddon.ADDON_ID] = settings
+
+
+def _print_progress(percent, message):
+
+    sys.stderr.write("\r%3i%% %-60s" % (percent, (message or "")[:60]))
+    sys.stderr.flush()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Cuts a recording with ffmpeg cutter outside Kodi")
+    parser.add_argument("filename", help="recording to cut")
+    parser.add_argument("--cut", type=parse_cut, action="append", default=[], metavar="START-END",
+                        help="range to keep in seconds or [HH:]MM:SS, repeatable, whole file if omitted")
+    parser.add_argument("--settings", metavar="SETTINGS_XML",
+                        help="settings.xml of addon profile in Kodi, defaults of addon otherwise")
+    parser.add_argument("--encoder", choices=cutter.ENCODERS,
+                        help="re-encodes video with given encoder")
+    parser.add_argument("--preset", choices=ffmpegutils.PRESETS,
+                        help="preset of encoder")
+    parser.add_argument("--crf", type=int,
+                        help="constant rate factor of encoder, e.g. 23")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="overrides addon setting, e.g. --set video=2")
+    parser.add_argument("--data-dir", default=os.path.join(os.path.expanduser("~"), ".ffmpeg-cutter"),
+                        help="directory for caches, checkpoints and metrics")
+    parser.add_argument("--target-directory",
+                        help="directory of output, directory of recording otherwise")
+    parser.add_argument("--title",
+                        help="title of recording for renaming output (setting recording_rename)")
+    parser.add_argument("--subtitle", default="",
+                        help="subtitle of recording for renaming output")
+    parser.add_argument("--start", type=lambda v: time.mktime(time.strptime(v, "%Y-%m-%d %H:%M")),
+                        metavar="YYYY-MM-DD HH:MM", help="start of recording, modification time of file otherwise")
+    parser.add_argument("--directory", default="",
+                        help="subdirectory of recording for renaming output")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="doesn't print progress")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    filename = os.path.abspath(args.filename)
+    if not os.path.isfile(filename):
+        parser.error("%s not found" % filename)
+
+    profile_dir = os.path.abspath(args.data_dir)
+    if not os.path.exists(profile_dir):
+        os.makedirs(profile_dir)
+
+    settings = read_settings(args.settings) if args.settings else {}
+    settings.update(CLI_SETTINGS)
+    settings.update(encoder_settings(settings, args.encoder, args.preset, args.crf))
+    settings.update(dict([s.split("=", 1) for s in args.set]))
+    _setup_kodi(profile_dir, settings)
+
+    if not args.quiet:
+        xbmcgui.PROGRESS_LISTENER = _print_progress
+
+    c = cutter.Cutter()
+
+    # ffmpeg quits gracefully, checkpoints of finished segments are kept
+    def _cancel(signum, frame):
+        logging.warning("cancelled, finished segments are kept for next run")
+        c.ffmpegUtils.cancel()
+
+    signal.signal(signal.SIGINT, _cancel)
+    signal.signal(signal.SIGTERM, _cancel)
+
+    ffprobe_json = c.ffmpegUtils.inspect_media(
+        filename, entries=ffmpegutils.INSPECT_ENTRIES)
+    duration = float(ffprobe_json["format"]["duration"])
+    bookmarks, markers = to_bookmarks(args.cut, duration)
+
+    recording = None
+    if args.title:
+        recording = {
+            "filename": filename,
+            "disp_title": args.title,
+            "disp_subtitle": args.subtitle,
+            "start": args.start or os.path.getmtime(filename),
+            "directory": args.directory
+        }
+
+    job = {
+        "filename": filename,
+        "recording": recording,
+        "streams": c._filter_streams(filename, ffprobe_json,
+                                     audio_visual_impaired=False,
+                                     subtitle_hearing_impaired=False,
+                                     subtitle_teletext=False),
+        "cuts": c._calculate_real_cuts(bookmarks, markers),
+        "bookmarks": [],
+        "target_directory": os.path.abspath(args.target_directory or os.path.dirname(filename))
+    }
+
+    if not c._check_free_space(job, ffprobe_json):
+        logging.error("not enough free space for %s", filename)
+        return 1
+
+    try:
+        c.process(job)
+    except (IOError, OSError) as e:
+        logging.error("%s", e)
+        return 1
+    finally:
+        if not args.quiet:
+            sys.stderr.write("\n")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# coding=utf-8
+"""
+Stand-in for Kodi's xbmc module so that the addon can be run by the benchmarks and the command-line
+runner outside Kodi.
+
+Special paths are mapped to directories by SPECIAL_PATHS, log messages are passed to Python's logging.
+"""
+
+import json
+import logging
+import os
+import time
+
+LOGDEBUG = 0
+LOGINFO = 1
+LOGNOTICE = 2
+LOGWARNING = 3
+LOGERROR = 4
+LOGSEVERE = 5
+LOGFATAL = 6
+LOGNONE = 7
+
+_LEVELS = {
+    LOGDEBUG: logging.DEBUG,
+    LOGINFO: logging.INFO,
+    LOGNOTICE: logging.INFO,
+    LOGWARNING: logging.WARNING,
+    LOGERROR: logging.ERROR,
+    LOGSEVERE: logging.CRITICAL,
+    LOGFATAL: logging.CRITICAL
+}
+
+_logger = logging.getLogger("kodi")
+
+# e.g. {"special://profile": "/tmp/bench/profile"}
+SPECIAL_PATHS = {}
+
+# answers of executeJSONRPC by method
+JSON_RPC_RESULTS = {
+    "Files.GetSources": {"sources": [], "limits": {"start": 0, "end": 0, "total": 0}}
+}
+
+
+def log(msg, level=LOGDEBUG):
+
+    if level != LOGNONE:
+        _logger.log(_LEVELS.get(level, logging.DEBUG), msg)
+
+
+def translatePath(path):
+
+    for special in sorted(SPECIAL_PATHS, key=len, reverse=True):
+        if path.startswith(special):
+            rest = path[len(special):].lstrip("/")
+            return os.path.join(SPECIAL_PATHS[special], *rest.split("/")) if rest else SPECIAL_PATHS[special]
+
+    return path
+
+
+def getCondVisibility(condition):
+
+    return condition == "system.platform.linux"
+
+
+def getGlobalIdleTime():
+
+    return 0
+
+
+def makeLegalFilename(filename):
+
+    return filename
+
+
+def executeJSONRPC(request):
+
+    if isinstance(request, bytes):
+        request = request.decode("utf-8")
+
+    request = json.loads(request)
+    response = {"jsonrpc": "2.0", "id": request.get("id"),
+                "result": JSON_RPC_RESULTS.get(request["method"], {})}
+
+    return json.dumps(response).encode("utf-8")
+
+
+class Monitor:
+
+    def abortRequested(self):
+
+        return False
+
+    def waitForAbort(self, timeout=None):
+
+        time.sleep(timeout or 0)
+        return False
+
+
+class Player:
+
+    def isPlaying(self):
+
+        return False
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""
+Stand-in for Kodi's xbmcaddon module.
+
+Settings of the benchmarked addon are initialized by the defaults of its settings.xml and can be
+overridden per addon id by SETTINGS. Localized strings are read from its English strings.po.
+"""
+
+import os
+import re
+import xml.etree.ElementTree as ET
+
+ADDON_ID = "plugin.video.ffmpeg-cutter"
+ADDON_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          ADDON_ID)
+
+# overridden settings by addon id, e.g. {"plugin.video.ffmpeg-cutter": {"video": "2"}}
+SETTINGS = {}
+
+_defaults = None
+_strings = None
+
+
+def _load_defaults():
+
+    global _defaults
+    if _defaults == None:
+        root = ET.parse(os.path.join(ADDON_PATH, "resources", "settings.xml")).getroot()
+        _defaults = dict([(s.get("id"), s.get("default", ""))
+                          for s in root.iter("setting") if s.get("id")])
+
+    return _defaults
+
+
+def _load_strings():
+
+    global _strings
+    if _strings == None:
+        po = os.path.join(ADDON_PATH, "resources", "language",
+                          "resource.language.en_gb", "strings.po")
+        with open(po, "rb") as f:
+            content = f.read().decode("utf-8")
+
+        _strings = dict([(int(m.group(1)), m.group(2)) for m in re.finditer(
+            r'msgctxt "#([0-9]+)"\s+msgid "(.*)"', content)])
+
+    return _strings
+
+
+class Addon:
+
+    def __init__(self, id=None):
+
+        self._id = id or ADDON_ID
+
+    def getSetting(self, key):
+
+        value = SETTINGS.get(self._id, {}).get(key)
+        if value == None and self._id == ADDON_ID:
+            value = _load_defaults().get(key)
+
+        return value if value != None else ""
+
+    def setSetting(self, key, value):
+
+        SETTINGS.setdefault(self._id, {})[key] = value
+
+    def getLocalizedString(self, id):
+
+        return _load_strings().get(id, "")
+
+    def getAddonInfo(self, key):
+
+        if key == "id":
+            return self._id
+        elif key == "path":
+            return ADDON_PATH
+        elif key == "profile":
+            return "special://profile/addon_data/%s/" % self._id
+
+        return ""
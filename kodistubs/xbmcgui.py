@@ -0,0 +1,134 @@
+# coding=utf-8
+"""
+Stand-in for Kodi's xbmcgui module. Dialogs answer without user interaction, i.e. they confirm and
+select everything. Progress of background dialogs is kept so that benchmarks can look at it and
+passed to PROGRESS_LISTENER, e.g. in order to print it on the command line.
+"""
+
+import xbmc
+
+NOTIFICATION_INFO = "info"
+NOTIFICATION_WARNING = "warning"
+NOTIFICATION_ERROR = "error"
+
+_properties = {}
+
+# function that is called with percent and message of each update of a background dialog
+PROGRESS_LISTENER = None
+
+
+class Window:
+
+    def __init__(self, existingWindowId=-1):
+
+        self._id = existingWindowId
+
+    def getProperty(self, key):
+
+        return _properties.get((self._id, key), "")
+
+    def setProperty(self, key, value):
+
+        _properties[(self._id, key)] = value
+
+    def clearProperty(self, key):
+
+        _properties.pop((self._id, key), None)
+
+
+class Dialog:
+
+    def notification(self, heading, message, icon=NOTIFICATION_INFO, time=5000, sound=True):
+
+        xbmc.log("notification: %s - %s" % (heading, message), xbmc.LOGNOTICE)
+
+    def ok(self, heading, message):
+
+        return True
+
+    def yesno(self, heading, message, *args, **kwargs):
+
+        return True
+
+    def select(self, heading, items, *args, **kwargs):
+
+        return 0 if len(items) > 0 else -1
+
+    def multiselect(self, heading, options, *args, **kwargs):
+
+        return list(range(len(options)))
+
+    def browse(self, type, heading, shares, mask="", useThumbs=False, treatAsFolder=False, defaultt="", *args):
+
+        return defaultt
+
+
+class DialogProgressBG:
+
+    def __init__(self):
+
+        self.updates = []
+        self.closed = False
+
+    def create(self, heading, message=""):
+
+        self.updates += [(0, message)]
+        if PROGRESS_LISTENER != None:
+            PROGRESS_LISTENER(0, message)
+
+    def update(self, percent=0, heading=None, message=None):
+
+        self.updates += [(percent, message)]
+        if PROGRESS_LISTENER != None:
+            PROGRESS_LISTENER(percent, message)
+
+    def isFinished(self):
+
+        return self.closed
+
+    def close(self):
+
+        self.closed = True
+
+
+class ListItem:
+
+    def __init__(self, label="", label2="", path=""):
+
+        self._label = label
+        self._label2 = label2
+        self._path = path
+        self._art = {}
+        self._properties = {}
+
+    def getLabel(self):
+
+        return self._label
+
+    def getLabel2(self):
+
+        return self._label2
+
+    def getPath(self):
+
+        return self._path
+
+    def getfilename(self):
+
+        return self._path
+
+    def setArt(self, values):
+
+        self._art.update(values)
+
+    def getArt(self, key):
+
+        return self._art.get(key, "")
+
+    def setProperty(self, key, value):
+
+        self._properties[key] = value
+
+    def getProperty(self, key):
+
+        return self._properties.get(key, "")
@@ -0,0 +1,59 @@
+# coding=utf-8
+"""
+Stand-in for Kodi's xbmcvfs module that works on local files only
+"""
+
+import os
+import shutil
+
+from xbmc import translatePath
+
+
+def exists(path):
+
+    return os.path.exists(path)
+
+
+def mkdir(path):
+
+    try:
+        os.mkdir(path)
+        return True
+    except OSError:
+        return False
+
+
+def mkdirs(path):
+
+    try:
+        os.makedirs(path)
+        return True
+    except OSError:
+        return False
+
+
+def delete(path):
+
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+def rename(source, target):
+
+    try:
+        os.rename(source, target)
+        return True
+    except OSError:
+        return False
+
+
+def copy(source, target):
+
+    try:
+        shutil.copyfile(source, target)
+        return True
+    except (IOError, OSError):
+        return False
@@ -1,15 +1,15 @@
 # -*- coding: utf-8 -*-
 
-import json
 import os
-import sys
+import shutil
+import threading
 import time
 
 import xbmc
 import xbmcaddon
 import xbmcgui
-import xbmcvfs
-from myutils import ffmpegutils, kodiutils, tvheadend
+from myutils import (ffmpegutils, jobmanifest, jobqueue, kodiutils, metrics,
+                     throughput, workerpool)
 
 
 _TIMEFRAME = 300
@@ -17,80 +17,384 @@ __PLUGIN_ID__ = "plugin.video.ffmpeg-cutter"
 __PVR_HTS_ID__ = "pvr.hts"
 
 EXTENSIONS = [None, ".mkv", ".mp4", ".avi"]
+WORKERS = [None, 1, 2, 3, 4, 6, 8]
+ENCODERS = ["libx264", "libx265", "libsvtav1", "libaom-av1"]
+
+RATE_CONTROL_DEFAULT = 0
+RATE_CONTROL_CRF = 1
+RATE_CONTROL_BITRATE = 2
+
+# settings of SD channels apply to videos up to this height
+SD_MAX_HEIGHT = 576
+
+VIDEO_SMART_RENDERING = 3
+
+# smaller gaps between cut and keyframe are not worth to be encoded
+SMART_RENDERING_TOLERANCE = 0.05
+
+CUT_MODE_SEGMENTS = 0
+CUT_MODE_SINGLE_PASS = 1
+
+DETECT_BREAKS_OFF = 0
+DETECT_BREAKS_NO_BOOKMARKS = 1
+DETECT_BREAKS_ALWAYS = 2
+
+# tolerance in seconds when segments of bookmark selection are compared with detected breaks
+BREAK_TOLERANCE = 1.0
+
+# estimated output size is increased by this factor when free space is checked
+FREE_SPACE_MARGIN = 1.1
+
+# shorter jobs are not observed by throughput model since their overhead dominates
+MIN_OBSERVED_DURATION = 60
+
+# threads that run probe and lookups while dialogs of cut are open
+PREFETCH_WORKERS = 3
+
+# stream-copied segments start and end at keyframes, i.e. they may be shorter than the cut by up to a GOP
+SEGMENT_DURATION_SLACK = 10
 
 addon = xbmcaddon.Addon()
 getMsg = addon.getLocalizedString
 
 
+class _lazy(object):
+    """
+    Decorator for attributes of Cutter that are computed on first access, e.g. from settings, and
+    stored in the instance afterwards. It derives from object since Python 2 supports descriptors
+    for new-style classes only.
+
+    Attributes may be accessed by prefetching threads and the service's monitor at the same time, so
+    each attribute of each instance is computed under its own lock and unrelated attributes don't
+    wait for each other. Attributes that depend on each other, e.g. ffmpegUtils on fileCache, take
+    their locks in that order. The lock at class level only guards creating these locks.
+    """
+
+    _guard = threading.Lock()
+
+    def __init__(self, compute):
+
+        self._compute = compute
+        self.__doc__ = compute.__doc__
+
+    def __get__(self, instance, owner):
+
+        if instance == None:
+            return self
+
+        name = self._compute.__name__
+        with _lazy._guard:
+            lock = instance.__dict__.setdefault(
+                "_lazy_locks", {}).setdefault(name, threading.Lock())
+
+        with lock:
+            if name not in instance.__dict__:
+                instance.__dict__[name] = self._compute(instance)
+
+            return instance.__dict__[name]
+
+
 class Cutter:
 
     CONTAINER = [None, ".mkv"]
     VCODEC = [None, "h264"]
 
-    ffmpegUtils = None
-
-    setting_container = None
-    setting_streams = None
-    setting_video = None
-    setting_x264_preset = None
-    setting_x264_tune = None
-    setting_pvr_dir = None
-    setting_pvr_dirname = None
-    setting_dir_selection = None
-    setting_confirm = None
-    setting_delete = None
-    setting_backup = None
-    setting_recording_rename = None
-    setting_recording_rename_subtitle = None
-    setting_recording_rename_timestamp = None
-    setting_recording_rename_directory = None
-
-    setting_hts_host = None
-    setting_hts_http_port = None
-    setting_hts_username = None
-    setting_hts_password = None
+    metrics = None
+    _tvheadend = None
+
+    # preset that has been chosen for job in order to meet deadline
+    _preset = None
+
+    # encoder of settings that ffmpeg doesn't support, see setting_encoder_profile
+    _unsupported_encoder = None
 
     def __init__(self):
 
-        plugin_settings = xbmcaddon.Addon(id=__PLUGIN_ID__)
-        pvr_hts_settings = xbmcaddon.Addon(id=__PVR_HTS_ID__)
-
-        _ffmpeg_executable = plugin_settings.getSetting("ffmpeg")
-        _ffprobe_executable = plugin_settings.getSetting("ffprobe")
-        self.ffmpegUtils = ffmpegutils.FFMpegUtils(ffmpeg_executable=_ffmpeg_executable,
-                                                   ffprobe_executable=_ffprobe_executable)
-
-        self.setting_container = self.CONTAINER[int(
-            plugin_settings.getSetting("container"))]
-        self.setting_streams = int(plugin_settings.getSetting("streams"))
-        self.setting_video = int(plugin_settings.getSetting("video"))
-        self.setting_x264_preset = self.ffmpegUtils.X264_PRESETS[int(
-            plugin_settings.getSetting("x264_preset"))]
-        self.setting_x264_tune = self.ffmpegUtils.X264_TUNES[int(
-            plugin_settings.getSetting("x264_tune"))]
-        self.setting_pvr_dir = int(plugin_settings.getSetting("pvr_dir"))
-        self.setting_pvr_dirname = plugin_settings.getSetting("pvr_dirname")
-        self.setting_dir_selection = plugin_settings.getSetting(
-            "dir_selection") == "true"
-        self.setting_confirm = plugin_settings.getSetting("confirm") == "true"
-        self.setting_delete = plugin_settings.getSetting("delete") == "true"
-        self.setting_backup = plugin_settings.getSetting("backup") == "true"
-        self.setting_recording_rename = plugin_settings.getSetting(
-            "recording_rename") == "true"
-        self.setting_recording_rename_subtitle = plugin_settings.getSetting(
-            "recording_rename_subtitle") == "true"
-        self.setting_recording_rename_timestamp = plugin_settings.getSetting(
-            "recording_rename_timestamp") == "true"
-        self.setting_recording_rename_directory = plugin_settings.getSetting(
-            "recording_rename_directory") == "true"
-
-        self.setting_hts_host = pvr_hts_settings.getSetting("host")
-        self.setting_hts_http_port = pvr_hts_settings.getSetting("http_port")
-        self.setting_hts_username = pvr_hts_settings.getSetting("user")
-        self.setting_hts_password = pvr_hts_settings.getSetting("pass")
+        # settings are read when they are used for the first time, see _lazy
+        self._settings = kodiutils.AddonSettings(__PLUGIN_ID__)
+        self._hts_settings = kodiutils.AddonSettings(__PVR_HTS_ID__)
+
+        self._profile = kodiutils.get_addon_profile()
+        self._keyframe_indexes = {}
+        self._video_filters = {}
+        self.metrics = metrics.JobMetrics()
+
+    @_lazy
+    def ffmpegUtils(self):
+
+        return ffmpegutils.FFMpegUtils(ffmpeg_executable=self._settings.getSetting("ffmpeg"),
+                                       ffprobe_executable=self._settings.getSetting(
+                                           "ffprobe"),
+                                       cache=self.fileCache,
+                                       priority=int(
+                                           self._settings.getSetting("priority") or 0),
+                                       affinity=self._settings.getSetting(
+                                           "cpu_affinity").strip(),
+                                       pause_on_playback=self._settings.getSetting("pause_on_playback") == "true")
+
+    @_lazy
+    def fileCache(self):
+
+        # caches use sqlite which isn't needed before a recording has been chosen
+        from myutils import filecache
+        return filecache.FileCache(self._profile)
+
+    @_lazy
+    def keyframeIndexCache(self):
+
+        from myutils import mediaindex
+        return mediaindex.KeyframeIndexCache(self._profile)
+
+    @_lazy
+    def recordingsIndex(self):
+
+        from myutils import recordingsindex
+        return recordingsindex.RecordingsIndex(self._profile)
+
+    @_lazy
+    def setting_container(self):
+
+        return self.CONTAINER[int(self._settings.getSetting("container"))]
+
+    @_lazy
+    def setting_streams(self):
+
+        return int(self._settings.getSetting("streams"))
+
+    @_lazy
+    def setting_video(self):
+
+        return int(self._settings.getSetting("video"))
+
+    @_lazy
+    def setting_encoder_profile(self):
+        """
+        Encoder profile of settings. If ffmpeg doesn't support its encoder it falls back to libx264 here,
+        i.e. before any decision depends on the codec.
+        """
+
+        profile = self._read_encoder_profile(self._settings)
+        encoders = self.ffmpegUtils.list_encoders()
+        if len(encoders) > 0 and not profile.validate(encoders) and profile.encoder != ENCODERS[0]:
+            xbmc.log("encoder %s not supported by ffmpeg, use %s instead" % (profile.encoder, ENCODERS[0]),
+                     xbmc.LOGWARNING)
+            self._unsupported_encoder = profile.encoder
+            profile.encoder = ENCODERS[0]
+
+        return profile
+
+    @_lazy
+    def setting_content_analysis(self):
+
+        return self._settings.getSetting("content_analysis") == "true"
+
+    @_lazy
+    def setting_seek(self):
+
+        return int(self._settings.getSetting("seek"))
+
+    @_lazy
+    def setting_cut_mode(self):
+
+        return int(self._settings.getSetting("cut_mode"))
+
+    @_lazy
+    def setting_keyframe_index(self):
+
+        return self._settings.getSetting("keyframe_index") == "true"
+
+    @_lazy
+    def setting_detect_breaks(self):
+
+        return int(self._settings.getSetting("detect_breaks") or 0)
+
+    @_lazy
+    def setting_bookmark_previews(self):
+
+        return self._settings.getSetting("bookmark_previews") == "true"
+
+    @_lazy
+    def setting_deadline(self):
+
+        if self._settings.getSetting("deadline_preset") != "true":
+            return None
+
+        return self._settings.getSetting("deadline")
+
+    @_lazy
+    def setting_workers(self):
+
+        return WORKERS[int(self._settings.getSetting("workers"))]
+
+    @_lazy
+    def setting_pvr_dir(self):
+
+        return int(self._settings.getSetting("pvr_dir"))
+
+    @_lazy
+    def setting_pvr_dirname(self):
+
+        return self._settings.getSetting("pvr_dirname")
+
+    @_lazy
+    def setting_dir_selection(self):
+
+        return self._settings.getSetting("dir_selection") == "true"
+
+    @_lazy
+    def setting_scratch_dir(self):
+
+        if self._settings.getSetting("scratch") != "true":
+            return None
+
+        return self._settings.getSetting("scratch_dir")
+
+    @_lazy
+    def setting_confirm(self):
+
+        return self._settings.getSetting("confirm") == "true"
+
+    @_lazy
+    def setting_delete(self):
+
+        return self._settings.getSetting("delete") == "true"
+
+    @_lazy
+    def setting_backup(self):
+
+        return self._settings.getSetting("backup") == "true"
+
+    @_lazy
+    def setting_background(self):
+
+        return self._settings.getSetting("background") == "true"
+
+    @_lazy
+    def setting_metrics(self):
+
+        return self._settings.getSetting("metrics") == "true"
+
+    @_lazy
+    def setting_metrics_log(self):
+
+        return self._settings.getSetting("metrics_log") == "true"
+
+    @_lazy
+    def setting_recording_rename(self):
+
+        return self._settings.getSetting("recording_rename") == "true"
+
+    @_lazy
+    def setting_recording_rename_subtitle(self):
+
+        return self._settings.getSetting("recording_rename_subtitle") == "true"
+
+    @_lazy
+    def setting_recording_rename_timestamp(self):
+
+        return self._settings.getSetting("recording_rename_timestamp") == "true"
+
+    @_lazy
+    def setting_recording_rename_directory(self):
+
+        return self._settings.getSetting("recording_rename_directory") == "true"
+
+    @_lazy
+    def setting_hts_host(self):
+
+        return self._hts_settings.getSetting("host")
+
+    @_lazy
+    def setting_hts_http_port(self):
+
+        return self._hts_settings.getSetting("http_port")
+
+    @_lazy
+    def setting_hts_username(self):
+
+        return self._hts_settings.getSetting("user")
+
+    @_lazy
+    def setting_hts_password(self):
+
+        return self._hts_settings.getSetting("pass")
+
+    def _read_rate_control(self, plugin_settings, prefix=""):
+
+        rate_control = int(plugin_settings.getSetting(
+            "%srate_control" % prefix) or 0)
+        if rate_control == RATE_CONTROL_CRF:
+            return {"crf": int(float(plugin_settings.getSetting("%scrf" % prefix))), "bitrate": None}
+        elif rate_control == RATE_CONTROL_BITRATE:
+            return {"crf": None, "bitrate": int(plugin_settings.getSetting("%sbitrate" % prefix))}
+        else:
+            return {"crf": None, "bitrate": None}
+
+    def _read_encoder_profile(self, plugin_settings):
+
+        overrides = []
+        if plugin_settings.getSetting("sd_profile") == "true":
+            sd = {"preset": ffmpegutils.PRESETS[int(
+                plugin_settings.getSetting("sd_encoder_preset"))]}
+            sd.update(self._read_rate_control(plugin_settings, prefix="sd_"))
+            overrides += [(SD_MAX_HEIGHT, sd)]
+
+        lookahead = int(plugin_settings.getSetting("lookahead") or 0)
+
+        return ffmpegutils.EncoderProfile(encoder=ENCODERS[int(plugin_settings.getSetting("encoder"))],
+                                          preset=ffmpegutils.PRESETS[int(
+                                              plugin_settings.getSetting("encoder_preset"))],
+                                          tune=ffmpegutils.TUNES[int(
+                                              plugin_settings.getSetting("encoder_tune"))],
+                                          threads=WORKERS[int(
+                                              plugin_settings.getSetting("encoder_threads"))],
+                                          lookahead=lookahead if lookahead > 0 else None,
+                                          filter_threads=WORKERS[int(
+                                              plugin_settings.getSetting("filter_threads"))],
+                                          overrides=overrides,
+                                          **self._read_rate_control(plugin_settings))
+
+    def check_encoder(self):
+        """
+        Checks if encoder of profile is supported by ffmpeg and tells the user if it has fallen back to libx264.
+        Returns False if there is no supported encoder at all.
+        """
+
+        profile = self.setting_encoder_profile
+        if self._unsupported_encoder != None:
+            xbmcgui.Dialog().notification(getMsg(32001),
+                                          getMsg(32131) % self._unsupported_encoder,
+                                          xbmcgui.NOTIFICATION_WARNING)
+
+        return self._is_encoder_supported()
+
+    def _is_encoder_supported(self):
+
+        # nothing to check if ffmpeg doesn't tell its encoders
+        encoders = self.ffmpegUtils.list_encoders()
+        if len(encoders) == 0 or self.setting_encoder_profile.validate(encoders):
+            return True
+
+        xbmc.log("encoder %s not supported by ffmpeg" %
+                 self.setting_encoder_profile.encoder, xbmc.LOGERROR)
+        return False
 
     def cut(self, listitem):
 
+        # lookups that don't depend on user's choices run concurrently while dialogs are open
+        prefetch = workerpool.WorkerPool(PREFETCH_WORKERS)
+        try:
+            self._cut(listitem, prefetch)
+        finally:
+            prefetch.shutdown(wait=False)
+
+    def _cut(self, listitem, prefetch):
+
+        bookmarks_task = prefetch.submit(
+            self._query_bookmarks, listitem.getfilename())
+        sources_task = prefetch.submit(
+            self._query_sources) if self.setting_dir_selection else None
+
         # determine full-qualified filename
         filename, recording = self._select_source(listitem)
         if filename is None or not os.path.isfile(filename):
@@ -100,8 +404,29 @@ class Cutter:
                                           xbmcgui.NOTIFICATION_ERROR)
             return
 
+        probe_task = prefetch.submit(self._probe, filename)
+
+        # offer to cancel jobs of this file that are queued or running in background
+        queue = jobqueue.JobQueue(kodiutils.get_addon_profile())
+        pending = queue.find(filename)
+        if len(pending) > 0 and xbmcgui.Dialog().yesno(getMsg(32143), getMsg(32144)):
+            for job in pending:
+                queue.cancel(job)
+            return
+
         # inspect file
-        ffprobe_json = self.ffmpegUtils.inspect_media(filename)
+        ffprobe_json = probe_task.result()
+
+        # user is told once if encoder of settings isn't available, jobs fail if there isn't any
+        if self._is_encoding(ffprobe_json):
+            self.check_encoder()
+
+        # content analysis takes some seconds, it is done while streams and bookmarks are selected
+        if self._is_encoding(ffprobe_json) and self.setting_video != VIDEO_SMART_RENDERING:
+            filters_task = prefetch.submit(
+                self._get_video_filters, filename, ffprobe_json)
+        else:
+            filters_task = None
 
         # filter or select streams (depends on settings)
         if self.setting_streams == 0:
@@ -127,40 +452,180 @@ class Cutter:
             return
 
         # select bookmarks and markers
-        bookmarks, markers = self._select_bookmarks(listitem, ffprobe_json)
+        bookmarks, markers = self._select_bookmarks(
+            bookmarks_task.result(), filename, ffprobe_json)
         if len(bookmarks) > 0 and (markers == None or len(markers) == 0):
             return
 
         # determine target directory
         if self.setting_dir_selection:
-            target_directory = self._select_target_directory(filename)
+            target_directory = self._select_target_directory(
+                filename, sources_task.result())
             if target_directory == None:
                 return
         else:
             target_directory = os.path.dirname(filename)
 
+        cuts = self._calculate_real_cuts(bookmarks, markers)
+
+        if filters_task != None:
+            filters_task.result()
+
+        # estimate duration by speed of former jobs, maybe with a faster preset in order to meet deadline
+        throughput_model = throughput.ThroughputModel(self._profile)
+        self._preset = self._select_deadline_preset(
+            throughput_model, filename, ffprobe_json, cuts)
+        estimated = throughput_model.estimate(self._get_total_duration(ffprobe_json, cuts),
+                                              *self._throughput_params(filename, ffprobe_json))
+        self.metrics.set("estimated", estimated)
+
         # start processing
         if self.setting_confirm:
-            rv = xbmcgui.Dialog().yesno(getMsg(32109), getMsg(32119))
+            message = getMsg(32119)
+            if estimated != None:
+                message += "\n%s" % (getMsg(32154) % ("%i:%02i:%02i" % (
+                    estimated // 3600, estimated % 3600 // 60, estimated % 60)))
+            if self._preset != None:
+                message += "\n%s" % (getMsg(32155) % self._preset)
+
+            rv = xbmcgui.Dialog().yesno(getMsg(32109), message)
             if not rv:
                 return
 
+        job = {
+            "filename": filename,
+            "recording": recording,
+            "streams": streams,
+            "cuts": cuts,
+            "bookmarks": bookmarks,
+            "target_directory": target_directory,
+            "preset": self._preset
+        }
+
+        if not self._check_free_space(job, ffprobe_json):
+            return
+
+        if self.setting_background:
+            job = queue.add(job)
+            self._write_metrics(job)
+            xbmcgui.Dialog().notification(getMsg(32001), getMsg(32129),
+                                          xbmcgui.NOTIFICATION_INFO)
+            return
+
+        self.process(job)
+
+    def process(self, job):
+        """
+        Processes job that has been captured by cut(), i.e. encodes, joins and cleans up
+
+        job is an object with the following fields:
+        - filename : str, full-qualified source file
+        - recording : object of tvheadend's recording or None
+        - streams : array of stream indexes
+        - cuts : array of objects with fields start and end (in seconds)
+        - bookmarks : array of bookmarks that are deleted afterwards
+        - target_directory : str
+        - preset : str, preset that overrides encoder profile or None
+        """
+
+        filename = job["filename"]
+        recording = job["recording"]
+        streams = job["streams"]
+        cuts = job["cuts"]
+        target_directory = job["target_directory"]
+        self._preset = job.get("preset")
+
+        with self.metrics.stage("inspect_media"):
+            ffprobe_json = self.ffmpegUtils.inspect_media(
+                filename, entries=ffmpegutils.INSPECT_ENTRIES)
+
+        # segments that have been finished by an interrupted run of the same job are reused
+        manifest = jobmanifest.JobManifest(kodiutils.get_addon_profile(), job)
+        resumed = manifest.finished_size() > 0
+
+        if not self._check_free_space(job, ffprobe_json, manifest):
+            raise IOError("not enough free space for %s" % filename)
+
         progress = xbmcgui.DialogProgressBG()
         progress.create(getMsg(32001), getMsg(32110))
-        segments, duration = self._encode(filename=filename,
-                                          target_directory=target_directory,
-                                          ffprobe_json=ffprobe_json,
-                                          streams=streams,
-                                          bookmarks=bookmarks,
-                                          markers=markers,
-                                          progress=progress)
 
         if self.setting_recording_rename and recording != None:
-            filename, target_directory = self._name_recording(
+            output_filename, output_directory = self._name_recording(
                 filename, target_directory, recording)
+        else:
+            output_filename, output_directory = filename, target_directory
+
+        # segments and joined file are written to scratch directory and moved to output directory at last,
+        # the directory is named by job so that an interrupted job finds its segments again
+        if self.setting_scratch_dir:
+            work_directory = os.path.join(self.setting_scratch_dir,
+                                          "ffmpeg-cutter-%s" % manifest.key)
+            if not os.path.exists(work_directory):
+                os.makedirs(work_directory)
+            manifest.set_work_directory(work_directory)
+        else:
+            work_directory = None
 
-        self._join(filename, segments,
-                   target_directory, duration, progress)
+        # analysis of content isn't part of encode stage, usually it is cached by cut() anyway
+        if self._is_encoding(ffprobe_json) and self.setting_video != VIDEO_SMART_RENDERING:
+            self._get_video_filters(filename, ffprobe_json)
+
+        first_process = len(self.metrics.record["processes"])
+        try:
+            with self.metrics.stage("encode"):
+                if self.setting_video == VIDEO_SMART_RENDERING:
+                    segments, duration = self._encode_smart(filename=filename,
+                                                            target_directory=work_directory or target_directory,
+                                                            ffprobe_json=ffprobe_json,
+                                                            streams=streams,
+                                                            cuts=cuts,
+                                                            progress=progress,
+                                                            manifest=manifest)
+
+                elif self.setting_cut_mode == CUT_MODE_SINGLE_PASS and self._supports_single_pass(ffprobe_json, streams):
+                    segments = []
+                    joined_filename = self._get_joined_filename(output_filename,
+                                                                work_directory or output_directory)
+                    self._encode_single_pass(filename=filename,
+                                             joined_filename=joined_filename,
+                                             ffprobe_json=ffprobe_json,
+                                             streams=streams,
+                                             cuts=cuts,
+                                             progress=progress)
+
+                else:
+                    segments, duration = self._encode(filename=filename,
+                                                      target_directory=work_directory or target_directory,
+                                                      ffprobe_json=ffprobe_json,
+                                                      streams=streams,
+                                                      cuts=cuts,
+                                                      progress=progress,
+                                                      manifest=manifest)
+
+            # speed of resumed jobs is overestimated, smart rendering mostly copies
+            if not resumed and self.setting_video != VIDEO_SMART_RENDERING:
+                self._observe_throughput(filename, ffprobe_json, cuts,
+                                         self.metrics.record["processes"][first_process:])
+
+            # single pass doesn't leave any segments to join
+            if len(segments) > 0:
+                with self.metrics.stage("join"):
+                    joined_filename = self._join(output_filename, segments,
+                                                 work_directory or output_directory, duration, progress)
+
+            if work_directory != None:
+                with self.metrics.stage("move"):
+                    progress.update(97, getMsg(32140))
+                    shutil.move(joined_filename, self._get_joined_filename(
+                        output_filename, output_directory))
+
+        except:
+            # finished segments are kept so that the job can be continued
+            progress.close()
+            if work_directory != None:
+                self._clean_failed_work_directory(manifest, work_directory,
+                                                  self._get_joined_filename(output_filename, work_directory))
+            raise
 
         if self.setting_delete:
             if self.setting_backup:
@@ -169,13 +634,182 @@ class Cutter:
                 segments += [filename]
 
         progress.update(98, getMsg(32112))
-        self._clean(segments)
+        with self.metrics.stage("clean"):
+            self._clean(segments)
+            if work_directory != None:
+                shutil.rmtree(work_directory, ignore_errors=True)
+            manifest.remove()
 
         progress.update(99, getMsg(32113))
-        kodiutils.delete_bookmarks(bookmarks)
+        with self.metrics.stage("delete_bookmarks"):
+            kodiutils.delete_bookmarks(job["bookmarks"])
 
         progress.close()
 
+        self._write_metrics(job)
+
+    def _clean_failed_work_directory(self, manifest, work_directory, joined_filename):
+        """
+        Removes scratch directory of a failed job unless finished segments allow to continue it. A joined
+        file is removed anyway since it is created again from the segments.
+        """
+
+        if manifest.finished_size() == 0:
+            manifest.clear()
+            shutil.rmtree(work_directory, ignore_errors=True)
+        elif os.path.isfile(joined_filename):
+            os.remove(joined_filename)
+
+    def discard(self, job):
+        """
+        Removes segments that have been finished by a job that won't be continued, e.g. since it has been cancelled
+        """
+
+        jobmanifest.JobManifest(kodiutils.get_addon_profile(), job).clear()
+
+    def _estimate_output_size(self, filename, ffprobe_json, cuts):
+        """
+        Estimates size of output file by byte offsets of cuts in keyframe index if it has been built before,
+        otherwise by the kept fraction of the source file. A configured average bitrate takes precedence.
+        """
+
+        total_duration = float(ffprobe_json["format"]["duration"])
+        kept_duration = self._get_total_duration(ffprobe_json, cuts)
+
+        if self._is_encoding(ffprobe_json):
+            profile = self._get_encoder_profile(ffprobe_json)
+            if profile.bitrate != None:
+                audio_bitrate = sum([int(s.get("bit_rate", 0)) for s in ffprobe_json["streams"]
+                                     if s["codec_type"] == "audio"])
+                return int((profile.bitrate * 1000 + audio_bitrate) * kept_duration / 8)
+
+        size = os.path.getsize(filename)
+        if len(cuts) == 0:
+            return size
+
+        index = self._get_keyframe_index(filename, ffprobe_json)
+        if index != None:
+            return sum([index.offset_for(c["end"]) - index.offset_for(c["start"]) for c in cuts])
+
+        return int(size * kept_duration / max(total_duration, 1))
+
+    def _check_free_space(self, job, ffprobe_json, manifest=None):
+        """
+        Checks if there is enough free space for intermediate segments and output. If scratch directory
+        is on the same filesystem as the output directory required space is summed up. Segments that
+        have already been finished by an interrupted run of the job are taken into account.
+        """
+
+        estimated = self._estimate_output_size(
+            job["filename"], ffprobe_json, job["cuts"]) * FREE_SPACE_MARGIN
+
+        # segments and joined file exist at the same time unless file is created in a single pass
+        single_pass = self.setting_cut_mode == CUT_MODE_SINGLE_PASS and self.setting_video != VIDEO_SMART_RENDERING \
+            and self._supports_single_pass(ffprobe_json, job["streams"])
+        work_space = estimated if single_pass else 2 * estimated
+
+        if manifest == None:
+            manifest = jobmanifest.JobManifest(
+                kodiutils.get_addon_profile(), job)
+        work_space = max(0, work_space - manifest.finished_size())
+
+        # scratch directory may be the target directory itself
+        if self.setting_scratch_dir:
+            demands = [(self.setting_scratch_dir, work_space),
+                       (job["target_directory"], estimated)]
+        else:
+            demands = [(job["target_directory"], work_space)]
+
+        required = {}
+        for path, space in demands:
+            required[path] = required.get(path, 0) + space
+
+        by_device = {}
+        for path, space in required.items():
+            try:
+                device = os.stat(path).st_dev if os.path.exists(path) else path
+            except OSError:
+                device = path
+            paths, total = by_device.get(device, ([], 0))
+            by_device[device] = (paths + [path], total + space)
+
+        for paths, space in by_device.values():
+            free = kodiutils.get_free_space(paths[0])
+            if free != None and free < space:
+                xbmc.log("not enough free space in %s: %i MB required, %i MB free" % (
+                    ", ".join(paths), space // 1048576, free // 1048576), xbmc.LOGERROR)
+                xbmcgui.Dialog().notification(getMsg(32141), getMsg(32142) % paths[0],
+                                              xbmcgui.NOTIFICATION_ERROR)
+                return False
+
+        return True
+
+    def _write_metrics(self, job):
+
+        if not self.setting_metrics:
+            return
+
+        self.metrics.set("job", job.get("id"))
+        self.metrics.set("filename", job["filename"])
+        self.metrics.set("cuts", len(job["cuts"]))
+        self.metrics.set("video", self.setting_video)
+        self.metrics.set("cut_mode", self.setting_cut_mode)
+        self.metrics.write(kodiutils.get_addon_profile())
+
+        if self.setting_metrics_log:
+            xbmc.log("metrics of job:\n%s" %
+                     self.metrics.summary(), xbmc.LOGNOTICE)
+
+    def prefetch(self, job):
+        """
+        Runs probe, index and content analysis stages of a queued job in advance so that they overlap with encoding of another job
+        """
+
+        ffprobe_json = self.ffmpegUtils.inspect_media(
+            job["filename"], entries=ffmpegutils.INSPECT_ENTRIES)
+        self._get_keyframe_index(job["filename"], ffprobe_json,
+                                 build=self.setting_video == VIDEO_SMART_RENDERING)
+        if self._is_encoding(ffprobe_json) and self.setting_video != VIDEO_SMART_RENDERING:
+            self._get_video_filters(job["filename"], ffprobe_json)
+
+    def _probe(self, filename):
+        """
+        Inspects file and loads its keyframe index from cache so that both are at hand when dialogs
+        are closed. Index isn't built here since the user may still cancel.
+        """
+
+        with self.metrics.stage("inspect_media"):
+            ffprobe_json = self.ffmpegUtils.inspect_media(
+                filename, entries=ffmpegutils.INSPECT_ENTRIES)
+
+        with self.metrics.stage("keyframe_index_warmup"):
+            self._get_keyframe_index(filename, ffprobe_json)
+
+        return ffprobe_json
+
+    def _query_bookmarks(self, filename):
+
+        with self.metrics.stage("select_bookmarks"):
+            return kodiutils.select_bookmarks(filename)
+
+    def _query_sources(self):
+        """
+        Returns video sources of Kodi, paths are translated for Windows. Returns empty list if sources are not available.
+        """
+
+        try:
+            sources = kodiutils.json_rpc("Files.GetSources",
+                                         {"media": "video"})
+
+            if kodiutils.getOS() in [kodiutils.OS_WINDOWS, kodiutils.OS_XBOX]:
+                sources = list(map(lambda s: {
+                               "label": s["label"], "file": kodiutils.make_path_for_smb_share_on_windows(s["file"])}, sources))
+
+            return sources
+
+        except:
+            return []
+
     def _select_source(self, listitem):
         """
         Determines full-qualified filename in filesystem for given listitem.
@@ -216,23 +850,37 @@ class Cutter:
 
     def _lookup_pvr_candidates(self, pvrFilename):
         """
-        Looksup pvr recoring or recordings by calling tvheadend API and tries to match given recording by channelname and timeframe,
-        since it is not possible to get specific recording, e.g. by using ID.
+        Looksup pvr recoring or recordings in local index of tvheadend's recordings and tries to match given recording
+        by channelname and timeframe, since it is not possible to get specific recording, e.g. by using ID.
+        Index is synced incrementally before, full syncs are run by the service.
 
         returns array of candidates, in best case just one
         """
 
-        matching_recording = []
-
         title, channelname, start = kodiutils.parse_recording_from_pvr_url(
             pvrFilename)
-        finished_recordings = tvheadend.query_hts_finished_recordings(self.setting_hts_host, self.setting_hts_http_port,
-                                                                      self.setting_hts_username, self.setting_hts_password)
-        for recording in finished_recordings["entries"]:
-            if recording["channelname"] == channelname and abs(recording["start_real"] - start) <= _TIMEFRAME:
-                matching_recording += [recording]
 
-        return matching_recording
+        with self.metrics.stage("tvheadend_lookup"):
+            self.sync_recordings_index()
+            return self.recordingsIndex.lookup(channelname, start, _TIMEFRAME)
+
+    def sync_recordings_index(self, full=False):
+        """
+        Syncs local index of tvheadend's recordings. Index stays as it is if tvheadend isn't available.
+        """
+
+        import socket
+        from myutils import tvheadend
+
+        if self._tvheadend == None:
+            self._tvheadend = tvheadend.TvheadendClient(self.setting_hts_host, self.setting_hts_http_port,
+                                                        self.setting_hts_username, self.setting_hts_password)
+
+        try:
+            self.recordingsIndex.sync(self._tvheadend, full=full)
+        except (IOError, OSError, socket.error) as e:
+            xbmc.log("tvheadend not available, using local index: %s" % e,
+                     xbmc.LOGWARNING)
 
     def _display_recordings_selection(self, recordings):
         """
@@ -282,57 +930,184 @@ class Cutter:
         shared_location = os.sep.join(shared_location)
         return shared_location
 
-    def _select_bookmarks(self, listitem, ffprobe_json):
+    def _select_bookmarks(self, bookmarks, filename, ffprobe_json):
 
-        bookmarks = kodiutils.select_bookmarks(listitem.getfilename())
         markers = None
 
+        breaks = None
+        if self.setting_detect_breaks == DETECT_BREAKS_ALWAYS or self.setting_detect_breaks == DETECT_BREAKS_NO_BOOKMARKS and len(bookmarks) == 0:
+            with self.metrics.stage("detect_breaks"):
+                breaks = self._detect_breaks(filename, ffprobe_json)
+            bookmarks = self._add_break_bookmarks(
+                filename, ffprobe_json, bookmarks, breaks)
+
         if len(bookmarks) > 0:
 
-            markers = self._show_bookmark_selection(bookmarks)
+            markers = self._show_bookmark_selection(
+                bookmarks, breaks, filename=filename)
             return bookmarks, markers
 
         else:
 
             return bookmarks, None
 
-    def _show_bookmark_selection(self, bookmarks):
+    def _detect_breaks(self, filename, ffprobe_json):
+
+        from myutils import breakdetect
+
+        progress = xbmcgui.DialogProgressBG()
+        progress.create(getMsg(32001), getMsg(32136))
+
+        def _callback(level):
+            progress.update(level, message="%s ..." % getMsg(32136))
+
+        progress_group = ffmpegutils.ProgressGroup(
+            _callback, 0, 100, float(ffprobe_json["format"]["duration"]))
+
+        try:
+            signals = breakdetect.analyze(self.ffmpegUtils, filename, ffprobe_json,
+                                          progress=progress_group,
+                                          cache=self.fileCache,
+                                          metrics=self.metrics)
+        except IOError as e:
+            xbmc.log("break detection failed: %s" % e, xbmc.LOGWARNING)
+            return []
+        finally:
+            progress.close()
+
+        breaks = breakdetect.detect_breaks(signals)
+        xbmc.log("proposed commercial breaks: %s" % breaks, xbmc.LOGNOTICE)
+
+        return breaks
+
+    def _add_break_bookmarks(self, filename, ffprobe_json, bookmarks, breaks):
+        """
+        Adds start and end of each break as bookmark. These bookmarks have no id since they are not stored in database.
+        """
+
+        if len(bookmarks) > 0:
+            total = bookmarks[0]["totalTimeInSeconds"]
+        else:
+            total = float(ffprobe_json["format"]["duration"])
+
+        strPath, strFilename = kodiutils.split_path(filename)
+        existing = [b["timeInSeconds"] for b in bookmarks]
+
+        for t in sorted(set([t for b in breaks for t in b])):
+            if len([e for e in existing if abs(e - t) < BREAK_TOLERANCE]) > 0 or t <= 0 or t >= total:
+                continue
+
+            bookmarks += [
+                {
+                    "idBookmark": None,
+                    "timeInSeconds": t,
+                    "timeInStr": kodiutils.seconds_to_time_str(t),
+                    "totalTimeInSeconds": total,
+                    "totalTimeInStr": kodiutils.seconds_to_time_str(total),
+                    "thumbNailImage": "",
+                    "strPath": strPath,
+                    "strFilename": strFilename
+                }
+            ]
+
+        return sorted(bookmarks, key=lambda b: b["timeInSeconds"])
+
+    def _show_bookmark_selection(self, bookmarks, breaks=None, filename=None):
 
         last_secs = 0
         selection = []
+        preselect = []
+        starts = []
 
         for i in range(len(bookmarks) + 1):
             startStr = bookmarks[i]["timeInStr"] if i < len(
                 bookmarks) else bookmarks[i - 1]["totalTimeInStr"]
             start = bookmarks[i]["timeInSeconds"] if i < len(
                 bookmarks) else bookmarks[i - 1]["totalTimeInSeconds"]
-            selection += ["%s ... %s  |  %s %s" % (kodiutils.seconds_to_time_str(last_secs),
-                                                   startStr,
-                                                   getMsg(32115),
-                                                   kodiutils.seconds_to_time_str(start - last_secs))]
+            s = "%s ... %s  |  %s %s" % (kodiutils.seconds_to_time_str(last_secs),
+                                         startStr,
+                                         getMsg(32115),
+                                         kodiutils.seconds_to_time_str(start - last_secs))
+
+            # segments within detected breaks are marked, all others are preselected
+            if breaks != None:
+                if len([b for b in breaks if b[0] - BREAK_TOLERANCE <= last_secs and start <= b[1] + BREAK_TOLERANCE]) > 0:
+                    s += "  |  %s" % getMsg(32137)
+                else:
+                    preselect += [i]
+
+            selection += [s]
+            starts += [last_secs]
             last_secs = start
 
-        return xbmcgui.Dialog().multiselect(getMsg(32116), selection)
+        kwargs = {}
+        if breaks != None:
+            kwargs["preselect"] = preselect
+
+        if filename != None and self.setting_bookmark_previews:
+            thumbnails = self._get_chapter_previews(
+                filename, bookmarks, starts)
+            items = []
+            for s, thumbnail in zip(selection, thumbnails):
+                item = xbmcgui.ListItem(label=s)
+                if thumbnail != None:
+                    item.setArt({"thumb": thumbnail})
+                items += [item]
+
+            return xbmcgui.Dialog().multiselect(getMsg(32116), items, useDetails=True, **kwargs)
+
+        return xbmcgui.Dialog().multiselect(getMsg(32116), selection, **kwargs)
+
+    def _get_chapter_previews(self, filename, bookmarks, starts):
+        """
+        Returns path of a frame at the start of each chapter or None. Thumbnails that Kodi has stored
+        for bookmarks are taken as they are, all other frames are extracted by ffmpeg and cached.
+        """
+
+        from myutils import thumbnails
+
+        thumbnail_paths = [None] * len(starts)
+        missing = []
+        for i, start in enumerate(starts):
+            # chapter i starts at bookmark i - 1, bookmarks of detected breaks have no thumbnail
+            if i > 0 and bookmarks[i - 1]["thumbNailImage"]:
+                thumbnail = xbmc.translatePath(
+                    bookmarks[i - 1]["thumbNailImage"])
+                if os.path.isfile(thumbnail):
+                    thumbnail_paths[i] = thumbnail
+                    continue
+
+            missing += [i]
 
-    def _select_target_directory(self, filename):
+        if len(missing) == 0:
+            return thumbnail_paths
+
+        progress = xbmcgui.DialogProgressBG()
+        progress.create(getMsg(32001), getMsg(32153))
+
+        def _callback(level):
+            progress.update(level, message="%s ..." % getMsg(32153))
+
+        try:
+            with self.metrics.stage("chapter_previews"):
+                previews = thumbnails.previews(self.ffmpegUtils, thumbnails.ThumbnailCache(self._profile),
+                                               filename, [starts[i] for i in missing], progress=_callback)
+        finally:
+            progress.close()
+
+        for i in missing:
+            thumbnail_paths[i] = previews[starts[i]]
+
+        return thumbnail_paths
+
+    def _select_target_directory(self, filename, sources):
 
         sources = [
             {
                 "file": os.path.dirname(filename),
                 "label": getMsg(32014)
             }
-        ]
-
-        try:
-            sources += kodiutils.json_rpc("Files.GetSources",
-                                          {"media": "video"})
-
-            if kodiutils.getOS() in [kodiutils.OS_WINDOWS, kodiutils.OS_XBOX]:
-                sources = list(map(lambda s: {
-                               "label": s["label"], "file": kodiutils.make_path_for_smb_share_on_windows(s["file"])}, sources))
-
-        except:
-            pass
+        ] + sources
 
         selection = ["%s" % (s["label"])
                      for s in sources if not kodiutils.is_remote_share(s["file"])]
@@ -429,7 +1204,216 @@ class Cutter:
 
         return False
 
-    def _encode(self, filename, target_directory, ffprobe_json, streams, bookmarks, markers, progress):
+    def _get_video_stream(self, ffprobe_json):
+
+        for stream in ffprobe_json["streams"]:
+            if stream["codec_type"] == "video":
+                return stream
+
+        return None
+
+    def _get_video_height(self, ffprobe_json):
+
+        stream = self._get_video_stream(ffprobe_json)
+        if stream != None and "height" in stream:
+            return int(stream["height"])
+
+        return None
+
+    def _get_keyframe_index(self, filename, ffprobe_json, build=False):
+        """
+        Returns keyframe index of given file if it has been cached before. Building the index requires
+        to read the whole file once, so it is only done if build is True and setting allows it.
+        """
+
+        if not self.setting_keyframe_index:
+            return None
+
+        if self._keyframe_indexes.get(filename) == None:
+            start_time = float(ffprobe_json["format"].get("start_time", 0))
+            self._keyframe_indexes[filename] = self.keyframeIndexCache.load(self.ffmpegUtils, filename,
+                                                                            start_time=start_time,
+                                                                            build=build)
+
+        return self._keyframe_indexes[filename]
+
+    def _is_encoding(self, ffprobe_json):
+
+        return self.setting_video == 2 or self.setting_video == 1 and self._needs_encoding(
+            ffprobe_json, self.setting_encoder_profile.codec_name)
+
+    def _get_encoder_profile(self, ffprobe_json):
+
+        profile = self.setting_encoder_profile.for_height(
+            self._get_video_height(ffprobe_json))
+        if self._preset != None:
+            profile.preset = self._preset
+
+        return profile
+
+    def _get_video_filters(self, filename, ffprobe_json):
+        """
+        Returns filters that are applied to video when it is encoded. A sampled analysis decides if video
+        is deinterlaced and if black borders are cropped. Without analysis or if it fails video is deinterlaced.
+        """
+
+        if not self.setting_content_analysis:
+            return ["yadif"]
+
+        if self._video_filters.get(filename) == None:
+            from myutils import contentanalysis
+
+            try:
+                with self.metrics.stage("content_analysis"):
+                    analysis = contentanalysis.analyze(self.ffmpegUtils, filename, ffprobe_json,
+                                                       cache=self.fileCache, metrics=self.metrics)
+            except IOError as e:
+                # failed analysis isn't repeated for each segment
+                xbmc.log("content analysis failed: %s" % e, xbmc.LOGWARNING)
+                self._video_filters[filename] = ["yadif"]
+                return self._video_filters[filename]
+
+            self._video_filters[filename] = contentanalysis.video_filters(
+                analysis, self._get_video_stream(ffprobe_json) or {})
+            xbmc.log("video filters for %s: %s" % (filename, self._video_filters[filename]),
+                     xbmc.LOGNOTICE)
+
+        return self._video_filters[filename]
+
+    def _is_deinterlacing(self, filename, ffprobe_json):
+        """
+        Returns True if video is deinterlaced when it is encoded
+        """
+
+        return self._is_encoding(ffprobe_json) and len(
+            [f for f in self._get_video_filters(filename, ffprobe_json) if f.startswith("yadif")]) > 0
+
+    def _throughput_params(self, filename, ffprobe_json):
+        """
+        Returns encoder, height, preset and deinterlacing as keyed by throughput model
+        """
+
+        height = self._get_video_height(ffprobe_json)
+        if self.setting_video == VIDEO_SMART_RENDERING or not self._is_encoding(ffprobe_json):
+            return throughput.COPY, height, None, False
+
+        profile = self._get_encoder_profile(ffprobe_json)
+        return profile.encoder, height, profile.preset, self._is_deinterlacing(filename, ffprobe_json)
+
+    def _select_deadline_preset(self, throughput_model, filename, ffprobe_json, cuts):
+        """
+        Returns slowest preset up to the one of encoder profile that finishes job before deadline of settings.
+        Returns None if preset of encoder profile applies.
+        """
+
+        if self.setting_deadline == None or self.setting_video == VIDEO_SMART_RENDERING \
+                or not self._is_encoding(ffprobe_json):
+            return None
+
+        encoder, height, preset, deinterlace = self._throughput_params(
+            filename, ffprobe_json)
+        available = kodiutils.seconds_until(self.setting_deadline)
+        selected = throughput_model.select_preset(self._get_total_duration(ffprobe_json, cuts), available,
+                                                  encoder, height, preset, deinterlace)
+        if selected == None or selected == preset:
+            return None
+
+        xbmc.log("preset %s instead of %s in order to finish within %i seconds" %
+                 (selected, preset, available), xbmc.LOGNOTICE)
+        return selected
+
+    def _observe_throughput(self, filename, ffprobe_json, cuts, processes):
+        """
+        Records speed of encode stage in throughput model. Time in which ffmpeg has been paused during
+        playback doesn't count.
+        """
+
+        duration = self._get_total_duration(ffprobe_json, cuts)
+        stages = [s for s in self.metrics.record["stages"]
+                  if s["name"] == "encode"]
+        if duration < MIN_OBSERVED_DURATION or len(stages) == 0:
+            return
+
+        # workers are paused at the same time
+        workers = self.metrics.record.get("workers") or 1
+        paused = sum([p.get("paused", 0) for p in processes]) / float(workers)
+        wall = stages[-1]["wall"] - paused
+        if wall <= 0:
+            return
+
+        throughput.ThroughputModel(self._profile).observe(duration / wall,
+                                                          *self._throughput_params(filename, ffprobe_json))
+
+    def _get_total_duration(self, ffprobe_json, cuts):
+
+        if len(cuts) > 0:
+            return sum(list(map(lambda c: c["end"] - c["start"], cuts)))
+        else:
+            return float(ffprobe_json["format"]["duration"])
+
+    def _validate_segment(self, segment, expected_duration):
+        """
+        Checks that segment is readable and not truncated, e.g. by a crash of ffmpeg or a power loss
+        """
+
+        if not os.path.isfile(segment) or os.path.getsize(segment) == 0:
+            xbmc.log("segment %s is missing or empty" % segment, xbmc.LOGERROR)
+            return False
+
+        duration = self.ffmpegUtils.probe_duration(segment)
+        if duration == None or duration < expected_duration - SEGMENT_DURATION_SLACK:
+            xbmc.log("segment %s has duration %s, expected %.3f" %
+                     (segment, duration, expected_duration), xbmc.LOGERROR)
+            return False
+
+        return True
+
+    def _segment_definition(self, filename, start, end, streams, encoding):
+        """
+        Returns what defines a segment in the job's manifest, i.e. source, range, streams and encoding. ffmpeg
+        parameters that are derived from them, e.g. seeking depending on a cached keyframe index or threads
+        depending on workers, are left out so that a continued job finds its segments again.
+        """
+
+        return {"source": filename, "start": start, "end": end, "streams": streams, "encoding": encoding}
+
+    def _exec_segment(self, segment, params, duration, progress, manifest=None, definition=None):
+        """
+        Runs ffmpeg for a single segment and validates its output. Valid segments are recorded in manifest
+        by their definition, invalid ones are removed.
+
+        Returns True if segment has been created
+        """
+
+        if self.ffmpegUtils.exec_ffmpeg(params, progress=progress, metrics=self.metrics) \
+                and self._validate_segment(segment, duration):
+            if manifest != None:
+                manifest.set_done(segment, definition, duration)
+            return True
+
+        if manifest != None:
+            manifest.discard(segment)
+        elif os.path.isfile(segment):
+            os.remove(segment)
+
+        return False
+
+    def _await_segments(self, pool, tasks, segments):
+
+        try:
+            results = [task.result() for task in tasks]
+        finally:
+            # after an unexpected error queued segments mustn't start ffmpeg in the background
+            for task in tasks:
+                task.cancel()
+            pool.shutdown()
+
+        failed = len([r for r in results if not r])
+        if failed > 0:
+            raise IOError("%i of %i segments failed, finished segments are kept for next run" %
+                          (failed, len(segments)))
+
+    def _encode(self, filename, target_directory, ffprobe_json, streams, cuts, progress, manifest=None):
 
         PROGRESS_START_LEVEL = 0
         PROGRESS_MAX_LEVEL = 80
@@ -443,42 +1427,76 @@ class Cutter:
         else:
             extension = self.setting_container
 
-        # determine cuts
-        cuts = self._calculate_real_cuts(bookmarks, markers)
         total_cuts = max(1, len(cuts))
 
         # ffmpeg filter and codec settings
         codecs = ["-c", "copy", "-c:a", "copy"]
-        if self.setting_video == 2 or self.setting_video == 1 and self._needs_encoding(ffprobe_json, "h264"):
-            codecs += ["-fflags", "+igndts",
-                       "-vf", "yadif",
-                       "-c:v", "libx264",
-                       "-preset", self.setting_x264_preset,
-                       "-tune", self.setting_x264_tune]
+        if self._is_encoding(ffprobe_json):
+            if not self._is_encoder_supported():
+                raise IOError("encoder %s not supported by ffmpeg" %
+                              self.setting_encoder_profile.encoder)
+
+            profile = self._get_encoder_profile(ffprobe_json)
+            encoding = [getattr(profile, f) for f in ["encoder", "preset", "tune", "crf", "bitrate", "lookahead"]]
+            cores = self.ffmpegUtils.cores()
+            workers = self.setting_workers or ffmpegutils.auto_workers(
+                self._get_video_height(ffprobe_json), total_cuts, cores)
+            codecs += ["-fflags", "+igndts"]
+            codecs += profile.filter_params(
+                self._get_video_filters(filename, ffprobe_json))
+            codecs += profile.video_params(
+                ffmpegutils.threads_per_worker(workers, cores))
         else:
+            # stream copy is limited by I/O, parallel reads do not help
+            workers = 1
+            encoding = "copy"
             codecs += ["-c:v", "copy"]
 
+        self.metrics.set("workers", workers)
+
         # duration for progress
-        processed_duration = 0
-        if len(cuts) > 0:
-            total_duration = sum(
-                list(map(lambda c: c["end"] - c["start"], cuts)))
-        else:
-            total_duration = float(ffprobe_json["format"]["duration"])
+        total_duration = self._get_total_duration(ffprobe_json, cuts)
+
+        # progress, segments are counted by threads of worker pool
+        finished = [0]
+        finished_lock = threading.Lock()
+
+        def _count_finished():
+            with finished_lock:
+                finished[0] += 1
+
+        def _callback(level):
+            progress.update(level, message="%s %i %s %i ..." % (
+                getMsg(32121), min(finished[0] + workers, total_cuts), getMsg(32122), total_cuts))
+
+        progress_group = ffmpegutils.ProgressGroup(
+            _callback, PROGRESS_START_LEVEL, PROGRESS_MAX_LEVEL, total_duration)
+
+        def _exec(segment_name, params, segment_duration, ffmpeg_progress, definition):
+            rv = self._exec_segment(segment_name, params, segment_duration, ffmpeg_progress,
+                                    manifest=manifest, definition=definition)
+            _count_finished()
+            return rv
+
+        index = self._get_keyframe_index(filename, ffprobe_json)
 
         # process segments
+        pool = workerpool.WorkerPool(workers)
+        tasks = []
+        processed_duration = 0
         for counter in range(total_cuts):
 
-            # inpput file
-            params = ["-i", filename]
-
-            # cuts
+            # input file and cuts
             if len(cuts) > 0:
                 cut = cuts[counter]
-                params += ["-ss", str(cut["start"]), "-to", str(cut["end"])]
+                params = self.ffmpegUtils.seek_params(filename, cut["start"], cut["end"],
+                                                      mode=self.setting_seek, index=index)
                 segment_duration = cut["end"] - cut["start"]
+                definition = self._segment_definition(filename, cut["start"], cut["end"], streams, encoding)
             else:
+                params = self.ffmpegUtils.seek_params(filename)
                 segment_duration = total_duration
+                definition = self._segment_definition(filename, None, None, streams, encoding)
 
             # codecs
             params += codecs
@@ -492,25 +1510,255 @@ class Cutter:
                 target_directory, "%s.%03d%s" % (basename, counter + 1, extension))
             params += [segment_name]
 
-            # progress
-            def _callback(level):
-                progress.update(level, message="%s %i %s %i ..." % (
-                    getMsg(32121), counter + 1, getMsg(32122), total_cuts))
-
-            current_start_level = PROGRESS_START_LEVEL + processed_duration / \
-                float(total_duration) * \
-                (PROGRESS_MAX_LEVEL - PROGRESS_START_LEVEL)
-            ffmpeg_progress = ffmpegutils.Progress(
-                _callback, current_start_level, PROGRESS_MAX_LEVEL, total_duration)
-
-            # call ffmpeg
-            self.ffmpegUtils.exec_ffmpeg(params, progress=ffmpeg_progress)
+            # call ffmpeg unless segment has been finished by an interrupted run
+            segment_progress = progress_group.part(counter, segment_duration)
+            if manifest != None and manifest.is_done(segment_name, definition):
+                xbmc.log("segment %s has already been finished" %
+                         segment_name, xbmc.LOGNOTICE)
+                _count_finished()
+                segment_progress.update(segment_duration)
+            else:
+                tasks += [pool.submit(_exec, segment_name, params, segment_duration,
+                                      segment_progress, definition)]
 
             segments += [segment_name]
             processed_duration += segment_duration
 
+        self._await_segments(pool, tasks, segments)
+
         return segments, processed_duration
 
+    def _plan_smart_rendering(self, filename, ffprobe_json, cuts):
+        """
+        Splits each cut into parts. Partial GOPs at the edges of a cut are encoded, everything in between
+        from first to last keyframe within the cut is stream-copied.
+
+        returns array of parts with fields start, end and encode
+        """
+
+        start_time = float(ffprobe_json["format"].get("start_time", 0))
+        index = self._get_keyframe_index(filename, ffprobe_json, build=True)
+        parts = []
+
+        for cut in cuts:
+            if index != None:
+                keyframes = index.keyframes_between(cut["start"], cut["end"])
+            else:
+                keyframes = self.ffmpegUtils.probe_keyframes(filename, cut["start"], cut["end"],
+                                                             start_time=start_time)
+            if len(keyframes) < 2:
+                parts += [{"start": cut["start"],
+                           "end": cut["end"], "encode": True}]
+                continue
+
+            first = keyframes[0]
+            last = keyframes[-1]
+            if first - cut["start"] > SMART_RENDERING_TOLERANCE:
+                parts += [{"start": cut["start"], "end": first, "encode": True}]
+
+            parts += [{"start": first, "end": last, "encode": False}]
+
+            if cut["end"] - last > SMART_RENDERING_TOLERANCE:
+                parts += [{"start": last, "end": cut["end"], "encode": True}]
+
+        return parts
+
+    def _encode_smart(self, filename, target_directory, ffprobe_json, streams, cuts, progress, manifest=None):
+        """
+        Smart rendering: Frame-accurate cuts by encoding only the GOPs at cut boundaries with parameters
+        matching the source stream. Parts are written as MPEG-TS so that they can be spliced by concat protocol.
+        """
+
+        PROGRESS_START_LEVEL = 0
+        PROGRESS_MAX_LEVEL = 80
+
+        video_stream = self._get_video_stream(ffprobe_json)
+        encoder_params = self.ffmpegUtils.matching_encoder_params(
+            video_stream) if video_stream != None else None
+        if len(cuts) == 0 or encoder_params == None:
+            xbmc.log("smart rendering not possible, copy instead", xbmc.LOGNOTICE)
+            return self._encode(filename=filename,
+                                target_directory=target_directory,
+                                ffprobe_json=ffprobe_json,
+                                streams=streams,
+                                cuts=cuts,
+                                progress=progress,
+                                manifest=manifest)
+
+        basename = os.path.basename(os.path.splitext(filename)[0])
+        parts = self._plan_smart_rendering(filename, ffprobe_json, cuts)
+
+        cores = self.ffmpegUtils.cores()
+        workers = self.setting_workers or ffmpegutils.auto_workers(
+            self._get_video_height(ffprobe_json), len(parts), cores)
+        threads = ffmpegutils.threads_per_worker(workers, cores)
+
+        total_duration = sum(list(map(lambda p: p["end"] - p["start"], parts)))
+
+        def _callback(level):
+            progress.update(level, message="%s ..." % getMsg(32121))
+
+        progress_group = ffmpegutils.ProgressGroup(
+            _callback, PROGRESS_START_LEVEL, PROGRESS_MAX_LEVEL, total_duration)
+
+        pool = workerpool.WorkerPool(workers)
+        tasks = []
+        segments = []
+        for counter, part in enumerate(parts):
+
+            params = self.ffmpegUtils.seek_params(filename, part["start"], part["end"],
+                                                  mode=ffmpegutils.SEEK_INPUT)
+            params += ["-c", "copy"]
+            if part["encode"]:
+                params += encoder_params + ["-threads", str(threads)]
+
+            for s in streams:
+                params += ["-map", "0:%s" % s]
+
+            segment_name = os.path.join(
+                target_directory, "%s.%03d.ts" % (basename, counter + 1))
+            params += ["-f", "mpegts", segment_name]
+
+            part_duration = part["end"] - part["start"]
+            part_progress = progress_group.part(counter, part_duration)
+            definition = self._segment_definition(filename, part["start"], part["end"], streams,
+                                                  encoder_params if part["encode"] else "copy")
+            if manifest != None and manifest.is_done(segment_name, definition):
+                xbmc.log("segment %s has already been finished" %
+                         segment_name, xbmc.LOGNOTICE)
+                part_progress.update(part_duration)
+            else:
+                tasks += [pool.submit(self._exec_segment, segment_name, params, part_duration,
+                                      part_progress, manifest=manifest, definition=definition)]
+            segments += [segment_name]
+
+        self._await_segments(pool, tasks, segments)
+
+        return segments, total_duration
+
+    def _supports_single_pass(self, ffprobe_json, streams):
+        """
+        Stream copy is always possible by using concat demuxer. In case of encoding the concat filter
+        can only handle video and audio streams, e.g. no subtitles.
+        """
+
+        if not self._is_encoding(ffprobe_json):
+            return True
+
+        codec_types = dict([(s["index"], s["codec_type"])
+                            for s in ffprobe_json["streams"]])
+        unsupported = [s for s in streams if codec_types.get(
+            s) not in ["video", "audio"]]
+        if len(unsupported) > 0:
+            xbmc.log("streams %s cannot be passed through concat filter, split into segments instead" % unsupported,
+                     xbmc.LOGNOTICE)
+            return False
+
+        return True
+
+    def _encode_single_pass(self, filename, joined_filename, ffprobe_json, streams, cuts, progress):
+        """
+        Creates target file in one ffmpeg run without any intermediate segments
+
+        - stream copy: concat demuxer with inpoint / outpoint for each cut
+        - encoding: one seeked input per cut that are joined by concat filter
+        """
+
+        PROGRESS_START_LEVEL = 0
+        PROGRESS_MAX_LEVEL = 98
+
+        total_duration = self._get_total_duration(ffprobe_json, cuts)
+
+        def _callback(level):
+            progress.update(level, message="%s ..." % getMsg(32121))
+
+        ffmpeg_progress = ffmpegutils.Progress(
+            _callback, PROGRESS_START_LEVEL, PROGRESS_MAX_LEVEL, total_duration)
+
+        encoding = self._is_encoding(ffprobe_json)
+        if encoding and not self._is_encoder_supported():
+            raise IOError("encoder %s not supported by ffmpeg" %
+                          self.setting_encoder_profile.encoder)
+
+        profile = self._get_encoder_profile(ffprobe_json)
+        threads = ffmpegutils.threads_per_worker(
+            1, self.ffmpegUtils.cores())
+        concat_list = None
+
+        try:
+            if len(cuts) == 0:
+                params = self.ffmpegUtils.seek_params(filename)
+                params += ["-c", "copy", "-c:a", "copy"]
+                if encoding:
+                    params += ["-fflags", "+igndts"]
+                    params += profile.filter_params(
+                        self._get_video_filters(filename, ffprobe_json))
+                    params += profile.video_params(threads)
+                else:
+                    params += ["-c:v", "copy"]
+
+                for s in streams:
+                    params += ["-map", "0:%s" % s]
+
+            elif not encoding:
+                concat_list = self.ffmpegUtils.write_concat_list(
+                    filename, cuts, start_time=float(ffprobe_json["format"].get("start_time", 0)))
+                params = ["-f", "concat", "-safe", "0", "-i", concat_list,
+                          "-c", "copy"]
+                for s in streams:
+                    params += ["-map", "0:%s" % s]
+
+            else:
+                params = []
+                for cut in cuts:
+                    params += self.ffmpegUtils.input_range_params(
+                        filename, cut["start"], cut["end"])
+
+                params += profile.filter_params([], complex=True)
+                params += self._get_concat_filter_params(
+                    ffprobe_json, streams, len(cuts), self._get_video_filters(filename, ffprobe_json))
+                params += profile.video_params(threads)
+
+            params += [joined_filename]
+            if not self.ffmpegUtils.exec_ffmpeg(params, progress=ffmpeg_progress,
+                                                metrics=self.metrics):
+                raise IOError("ffmpeg failed to create %s" % joined_filename)
+
+        finally:
+            if concat_list != None and os.path.isfile(concat_list):
+                os.remove(concat_list)
+
+    def _get_concat_filter_params(self, ffprobe_json, streams, inputs, filters):
+
+        by_index = dict([(s["index"], s) for s in ffprobe_json["streams"]])
+        video = [s for s in streams if by_index[s]["codec_type"] == "video"]
+        audio = [s for s in streams if by_index[s]["codec_type"] == "audio"]
+
+        graph = "".join(["[%i:%s]" % (i, s)
+                         for i in range(inputs) for s in video + audio])
+        graph += "concat=n=%i:v=%i:a=%i" % (inputs, len(video), len(audio))
+        graph += "".join(["[v%i]" % i for i in range(len(video))])
+        graph += "".join(["[a%i]" % i for i in range(len(audio))])
+        for i in range(len(video)):
+            graph += ";[v%i]%s[vout%i]" % (i,
+                                            ",".join(filters) if len(filters) > 0 else "null", i)
+
+        params = ["-filter_complex", graph]
+        for i in range(len(video)):
+            params += ["-map", "[vout%i]" % i]
+
+        for i, s in enumerate(audio):
+            stream = by_index[s]
+            params += ["-map", "[a%i]" % i,
+                       "-c:a:%i" % i, ffmpegutils.AUDIO_ENCODERS.get(stream["codec_name"], "aac")]
+            if "bit_rate" in stream:
+                params += ["-b:a:%i" % i, str(stream["bit_rate"])]
+            if "tags" in stream and "language" in stream["tags"]:
+                params += ["-metadata:s:a:%i" % i,
+                           "language=%s" % stream["tags"]["language"]]
+
+        return params
+
     def _calculate_real_cuts(self, bookmarks, markers):
 
         real_cuts = []
@@ -560,19 +1808,18 @@ class Cutter:
         splitext = os.path.splitext(filename)
         extension = splitext[1]
 
-        renamed_filename = recording["disp_title"].encode(
-            kodiutils.getpreferredencoding())
+        renamed_filename = kodiutils.encode_path(recording["disp_title"])
 
         if self.setting_recording_rename_subtitle and recording["disp_subtitle"] and recording["disp_subtitle"] != recording["disp_title"]:
-            renamed_filename += " - %s" % recording["disp_subtitle"].encode(
-                kodiutils.getpreferredencoding())
+            renamed_filename += " - %s" % kodiutils.encode_path(
+                recording["disp_subtitle"])
 
         if self.setting_recording_rename_timestamp:
             timeStr = time.strftime(time.strftime(
                 "%Y-%m-%d %H-%M", time.localtime(recording["start"])))
             renamed_filename += " (%s)" % timeStr
 
-        renamed_filename += extension.encode(kodiutils.getpreferredencoding())
+        renamed_filename += kodiutils.encode_path(extension)
         renamed_filename = kodiutils.makeLegalFilename(renamed_filename)
 
         if self.setting_recording_rename_directory and "directory" in recording and recording["directory"]:
@@ -580,17 +1827,13 @@ class Cutter:
                 directory, os.path.sep, kodiutils.makeLegalFilename(
                     recording["directory"]))
         else:
-            target_directory = directory.encode(
-                kodiutils.getpreferredencoding())
+            target_directory = kodiutils.encode_path(directory)
 
         xbmc.log(renamed_filename, xbmc.LOGNOTICE)
 
         return renamed_filename, target_directory
 
-    def _join(self, filename, segments, dirname, duration, progress):
-
-        PROGRESS_START_LEVEL = 80
-        PROGRESS_MAX_LEVEL = 98
+    def _get_joined_filename(self, filename, dirname):
 
         splitext = os.path.splitext(filename)
         basename = os.path.basename(splitext[0])
@@ -602,10 +1845,16 @@ class Cutter:
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
-        joined_filename = os.path.join(
-            dirname, "%s%s%s" % (basename, ".cut", extension))
+        return os.path.join(dirname, "%s%s%s" % (basename, ".cut", extension))
+
+    def _join(self, filename, segments, dirname, duration, progress):
+
+        PROGRESS_START_LEVEL = 80
+        PROGRESS_MAX_LEVEL = 98
+
+        joined_filename = self._get_joined_filename(filename, dirname)
 
-        if len(segments) == 1:
+        if len(segments) == 1 and os.path.splitext(segments[0])[1] == os.path.splitext(joined_filename)[1]:
 
             progress.update(90, getMsg(32111))
             os.rename(segments[0], joined_filename)
@@ -621,7 +1870,11 @@ class Cutter:
 
             concat = "concat:%s" % "|".join(segments)
             params = ["-i", concat, "-c", "copy", "-map", "0", joined_filename]
-            self.ffmpegUtils.exec_ffmpeg(params, progress=ffmpeg_progress)
+            if not self.ffmpegUtils.exec_ffmpeg(params, progress=ffmpeg_progress,
+                                                metrics=self.metrics):
+                # segments are kept so that joining can be retried
+                raise IOError("ffmpeg failed to join segments into %s" %
+                              joined_filename)
 
         return joined_filename
 
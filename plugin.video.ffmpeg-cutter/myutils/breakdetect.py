@@ -0,0 +1,239 @@
+# coding=utf-8
+
+import re
+
+import xbmc
+from myutils import ffmpegutils, workerpool
+
+# recordings are analyzed in chunks of this duration in parallel, chunks overlap a little so that
+# signals at chunk boundaries are not lost
+CHUNK_DURATION = 600
+CHUNK_OVERLAP = 5
+
+# video is scaled down before filters are applied
+ANALYSIS_WIDTH = 192
+
+BLACK_MIN_DURATION = 0.08
+BLACK_PIXEL_THRESHOLD = 0.10
+SILENCE_NOISE = "-50dB"
+SILENCE_MIN_DURATION = 0.2
+SCENE_THRESHOLD = 0.4
+
+# black frames and silence belong to the same separator if they are not further apart
+MAX_SEPARATOR_DISTANCE = 1.0
+
+# a commercial break is a sequence of at least MIN_SPOTS spots between separators, each spot
+# is not longer than MAX_SPOT_DURATION
+MAX_SPOT_DURATION = 90
+MIN_SPOTS = 3
+
+# sequences with one spot less are accepted if scenes change much more often than on average
+SCENE_RATE_FACTOR = 1.5
+
+# increase if signals or their parameters change, cached results of former versions are ignored
+ANALYSIS_VERSION = 1
+
+_BLACK_PATTERN = re.compile(
+    r"black_start:\s*(-?[0-9.]+)\s+black_end:\s*(-?[0-9.]+)")
+_SILENCE_START_PATTERN = re.compile(r"silence_start:\s*(-?[0-9.]+)")
+_SILENCE_END_PATTERN = re.compile(r"silence_end:\s*(-?[0-9.]+)")
+_SCENE_PATTERN = re.compile(r"\[Parsed_showinfo.*\spts_time:\s*(-?[0-9.]+)")
+
+
+def _merge_intervals(intervals):
+
+    merged = []
+    for start, end in sorted(intervals):
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1] = [merged[-1][0], max(merged[-1][1], end)]
+        else:
+            merged += [[start, end]]
+
+    return merged
+
+
+def analyze_chunk(ffmpegUtils, filename, start, duration, has_audio=True, threads=None, progress=None,
+                  metrics=None):
+    """
+    Runs blackdetect, silencedetect and scene change detection on a part of the file. Video is decoded
+    at low resolution and without non-reference frames.
+
+    Returns dict with lists of black and silence intervals and scene changes in seconds relative to start of file
+    """
+
+    signals = {"black": [], "silence": [], "scenes": []}
+    silence_start = [None]
+
+    def _on_line(line):
+
+        m = _BLACK_PATTERN.search(line)
+        if m:
+            signals["black"] += [[start + float(m.group(1)),
+                                  start + float(m.group(2))]]
+            return
+
+        m = _SILENCE_START_PATTERN.search(line)
+        if m:
+            silence_start[0] = start + max(0, float(m.group(1)))
+            return
+
+        m = _SILENCE_END_PATTERN.search(line)
+        if m and silence_start[0] != None:
+            signals["silence"] += [[silence_start[0],
+                                    start + float(m.group(1))]]
+            silence_start[0] = None
+            return
+
+        m = _SCENE_PATTERN.search(line)
+        if m:
+            signals["scenes"] += [start + float(m.group(1))]
+
+    params = ["-skip_frame:v", "noref"]
+    if threads != None:
+        params += ["-threads", str(threads)]
+
+    params += ["-ss", "%.3f" % start, "-t", "%.3f" % duration, "-i", filename,
+               "-map", "0:v:0",
+               "-vf", "scale=%i:-2:flags=fast_bilinear,blackdetect=d=%s:pix_th=%s,select='gt(scene,%s)',showinfo" % (
+                   ANALYSIS_WIDTH, BLACK_MIN_DURATION, BLACK_PIXEL_THRESHOLD, SCENE_THRESHOLD)]
+
+    if has_audio:
+        params += ["-map", "0:a:0",
+                   "-af", "silencedetect=n=%s:d=%s" % (SILENCE_NOISE, SILENCE_MIN_DURATION)]
+
+    params += ["-f", "null", "-"]
+
+    # results of an incomplete analysis must not be cached
+    if not ffmpegUtils.exec_ffmpeg(params, progress=progress, metrics=metrics,
+                                   log_listener=_on_line, pausable=False):
+        raise IOError("analysis of %s failed at %.3f" % (filename, start))
+
+    # silence that lasts until end of chunk
+    if silence_start[0] != None:
+        signals["silence"] += [[silence_start[0], start + duration]]
+
+    return signals
+
+
+def analyze(ffmpegUtils, filename, ffprobe_json, workers=None, progress=None, cache=None, metrics=None):
+    """
+    Analyzes whole file in parallel chunks. Results are taken from cache if file hasn't been changed since.
+
+    progress : ProgressGroup whose parts are updated by chunks
+
+    Returns dict with lists of black and silence intervals and scene changes
+    """
+
+    kind = "breakdetect:%i" % ANALYSIS_VERSION
+    if cache != None:
+        signals = cache.get(filename, kind)
+        if signals != None:
+            return signals
+
+    duration = float(ffprobe_json["format"]["duration"])
+    has_audio = len([s for s in ffprobe_json["streams"]
+                     if s["codec_type"] == "audio"]) > 0
+
+    chunks = []
+    start = 0
+    while start < duration:
+        chunks += [(start, min(CHUNK_DURATION + CHUNK_OVERLAP, duration - start))]
+        start += CHUNK_DURATION
+
+    cores = ffmpegUtils.cores()
+    workers = workers or min(len(chunks), cores)
+    threads = ffmpegutils.threads_per_worker(workers, cores)
+
+    pool = workerpool.WorkerPool(workers)
+    tasks = []
+    for i, (start, length) in enumerate(chunks):
+        tasks += [pool.submit(analyze_chunk, ffmpegUtils, filename, start, length,
+                              has_audio=has_audio, threads=threads,
+                              progress=progress.part(
+                                  i, length) if progress != None else None,
+                              metrics=metrics)]
+
+    try:
+        results = [task.result() for task in tasks]
+    finally:
+        pool.shutdown()
+
+    scenes = sorted(set([round(t, 1)
+                         for r in results for t in r["scenes"]]))
+    signals = {
+        "duration": duration,
+        "black": _merge_intervals([i for r in results for i in r["black"]]),
+        "silence": _merge_intervals([i for r in results for i in r["silence"]]),
+        "scenes": scenes
+    }
+
+    xbmc.log("detected %i black intervals, %i silences and %i scene changes in %s" % (
+        len(signals["black"]), len(signals["silence"]), len(signals["scenes"]), filename), xbmc.LOGNOTICE)
+
+    if cache != None:
+        cache.put(filename, kind, signals)
+
+    return signals
+
+
+def find_separators(signals):
+    """
+    Returns points in time where black frames and silence coincide. If there is no audio or no silence
+    at all black frames are used alone.
+    """
+
+    separators = []
+    silence = signals["silence"]
+    for black_start, black_end in signals["black"]:
+
+        if len(silence) == 0:
+            separators += [(black_start + black_end) / 2.0]
+            continue
+
+        for silence_start, silence_end in silence:
+            if silence_start - MAX_SEPARATOR_DISTANCE <= black_end and black_start <= silence_end + MAX_SEPARATOR_DISTANCE:
+                separators += [(max(black_start, silence_start) +
+                                min(black_end, silence_end)) / 2.0]
+                break
+
+    return sorted(separators)
+
+
+def _scene_rate(scenes, start, end):
+
+    if end <= start:
+        return 0
+
+    return len([t for t in scenes if start <= t <= end]) / float(end - start)
+
+
+def detect_breaks(signals):
+    """
+    Proposes commercial breaks, i.e. sequences of short spots between separators.
+
+    Returns list of pairs of start and end in seconds
+    """
+
+    separators = find_separators(signals)
+    duration = signals["duration"]
+    average_scene_rate = _scene_rate(signals["scenes"], 0, duration)
+
+    breaks = []
+
+    def _close(run):
+        spots = len(run) - 1
+        if spots >= MIN_SPOTS or spots == MIN_SPOTS - 1 and spots > 0 and _scene_rate(
+                signals["scenes"], run[0], run[-1]) > average_scene_rate * SCENE_RATE_FACTOR:
+            breaks.append((run[0], run[-1]))
+
+    run = []
+    for t in separators:
+        if len(run) > 0 and t - run[-1] > MAX_SPOT_DURATION:
+            _close(run)
+            run = []
+        run += [t]
+
+    if len(run) > 0:
+        _close(run)
+
+    return breaks
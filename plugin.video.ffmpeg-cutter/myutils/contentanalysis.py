@@ -0,0 +1,156 @@
+# coding=utf-8
+
+import re
+
+import xbmc
+from myutils import ffmpegutils, workerpool
+
+# a few short windows spread over the recording are analyzed in parallel
+SAMPLES = 4
+SAMPLE_DURATION = 5
+
+# share of interlaced frames of all detected frames above which the whole video is deinterlaced,
+# between both values only frames that idet detects as interlaced are deinterlaced, e.g. for
+# progressive shows with interlaced commercials
+INTERLACED_RATIO = 0.8
+MIXED_RATIO = 0.05
+
+# borders are only cropped if they are at least that large in total (in pixels)
+MIN_CROP = 16
+
+# increase if filters or their parameters change, cached results of former versions are ignored
+ANALYSIS_VERSION = 1
+
+_IDET_PATTERN = re.compile(
+    r"Multi frame detection:\s*TFF:\s*([0-9]+)\s*BFF:\s*([0-9]+)\s*Progressive:\s*([0-9]+)")
+_CROP_PATTERN = re.compile(r"crop=(-?[0-9]+):(-?[0-9]+):(-?[0-9]+):(-?[0-9]+)")
+
+
+def analyze_window(ffmpegUtils, filename, start, duration, threads=None, metrics=None):
+    """
+    Runs idet and cropdetect on a part of the file.
+
+    Returns dict with counts of top field first, bottom field first and progressive frames and the
+    area that isn't black as list of width, height, x and y or None
+    """
+
+    result = {"tff": 0, "bff": 0, "progressive": 0, "crop": None}
+
+    def _on_line(line):
+
+        m = _IDET_PATTERN.search(line)
+        if m:
+            result["tff"], result["bff"], result["progressive"] = [
+                int(v) for v in m.groups()]
+            return
+
+        # cropdetect doesn't reset, i.e. its last line covers all frames of the window
+        m = _CROP_PATTERN.search(line)
+        if m:
+            result["crop"] = [int(v) for v in m.groups()]
+
+    params = []
+    if threads != None:
+        params += ["-threads", str(threads)]
+
+    params += ["-ss", "%.3f" % start, "-t", "%.3f" % duration, "-i", filename,
+               "-map", "0:v:0",
+               "-vf", "idet,cropdetect=round=2:reset=0",
+               "-f", "null", "-"]
+
+    if not ffmpegUtils.exec_ffmpeg(params, metrics=metrics, log_listener=_on_line,
+                                   pausable=False):
+        raise IOError("content analysis of %s failed at %.3f" %
+                      (filename, start))
+
+    if result["crop"] != None and (result["crop"][0] <= 0 or result["crop"][1] <= 0):
+        # window is completely black
+        result["crop"] = None
+
+    return result
+
+
+def analyze(ffmpegUtils, filename, ffprobe_json, cache=None, metrics=None):
+    """
+    Samples some windows of the file in parallel. Results are taken from cache if file hasn't been changed since.
+
+    Returns dict with counts of frames by field order and the area that isn't black in any window
+    """
+
+    kind = "contentanalysis:%i" % ANALYSIS_VERSION
+    if cache != None:
+        analysis = cache.get(filename, kind)
+        if analysis != None:
+            return analysis
+
+    duration = float(ffprobe_json["format"]["duration"])
+    windows = [(duration * (i + 1) / (SAMPLES + 1), min(SAMPLE_DURATION, duration))
+               for i in range(SAMPLES)] if duration > SAMPLES * SAMPLE_DURATION else [(0, duration)]
+
+    cores = ffmpegUtils.cores()
+    workers = min(len(windows), cores)
+    threads = ffmpegutils.threads_per_worker(workers, cores)
+
+    pool = workerpool.WorkerPool(workers)
+    tasks = [pool.submit(analyze_window, ffmpegUtils, filename, start, length,
+                         threads=threads, metrics=metrics) for start, length in windows]
+
+    try:
+        results = [task.result() for task in tasks]
+    finally:
+        pool.shutdown()
+
+    analysis = {
+        "tff": sum([r["tff"] for r in results]),
+        "bff": sum([r["bff"] for r in results]),
+        "progressive": sum([r["progressive"] for r in results]),
+        "crop": None
+    }
+
+    # union of the non-black areas of all windows
+    areas = [r["crop"] for r in results if r["crop"] != None]
+    if len(areas) > 0:
+        x = min([a[2] for a in areas])
+        y = min([a[3] for a in areas])
+        analysis["crop"] = [max([a[2] + a[0] for a in areas]) - x,
+                            max([a[3] + a[1] for a in areas]) - y, x, y]
+
+    xbmc.log("content analysis of %s: %s" %
+             (filename, analysis), xbmc.LOGNOTICE)
+
+    if cache != None:
+        cache.put(filename, kind, analysis)
+
+    return analysis
+
+
+def video_filters(analysis, stream):
+    """
+    Returns filters for deinterlacing and cropping of video stream according to analysis. Streams that
+    are coded as progressive frames are not deinterlaced at all, idet only decides about streams that
+    are coded as fields since they often carry progressive content, too.
+    """
+
+    filters = []
+
+    interlaced = analysis["tff"] + analysis["bff"]
+    detected = interlaced + analysis["progressive"]
+    ratio = interlaced / float(detected) if detected > 0 else 0
+    parity = "tff" if analysis["tff"] >= analysis["bff"] else "bff"
+
+    if stream.get("field_order") != "progressive":
+        if detected == 0:
+            # nothing detected, deinterlace as if there were no analysis
+            filters += ["yadif"]
+        elif ratio >= INTERLACED_RATIO:
+            filters += ["yadif=parity=%s" % parity]
+        elif ratio >= MIXED_RATIO:
+            # idet marks frames so that yadif leaves progressive ones untouched
+            filters += ["idet", "yadif=parity=%s:deint=interlaced" % parity]
+
+    crop = analysis["crop"]
+    if crop != None and "width" in stream and "height" in stream \
+            and int(stream["width"]) - crop[0] + int(stream["height"]) - crop[1] >= MIN_CROP:
+        filters += ["crop=%i:%i:%i:%i" % tuple(crop)]
+
+    return filters
@@ -1,16 +1,159 @@
 # coding=utf-8
 
+import collections
 import json
-import kodiutils
+import os
 import re
-import subprocess
+import signal
+import tempfile
+import threading
+import time
 import xbmc
+from myutils import kodiutils
+from myutils.metrics import read_proc_io, wait_with_rusage
 
 SW_HIDE = 0
 STARTF_USESHOWWINDOW = 1
 
-FFMPEG_PROGRESS_PATTERN = re.compile(
-    r"frame=\s*(\d+)\s+fps=\s*([0-9\.]+)\s+q=([0-9\.-]+) [A-Z]?size=\s*([0-9]+[A-Za-z]+) time=([0-9:\.]+) bitrate=([^ ]+) speed=\s*([0-9\.]+)x")
+SEEK_OUTPUT = 0
+SEEK_INPUT = 1
+SEEK_INPUT_ACCURATE = 2
+
+# seconds that are decoded in front of the cut in order to seek frame-accurate
+SEEK_ACCURATE_MARGIN = 10
+
+# encoders for audio streams that must be re-encoded since they pass a filter
+AUDIO_ENCODERS = {
+    "aac": "aac",
+    "ac3": "ac3",
+    "eac3": "eac3",
+    "mp2": "mp2",
+    "mp3": "libmp3lame",
+    "opus": "libopus",
+    "vorbis": "libvorbis"
+}
+
+# sections and fields of ffprobe's output that are used by cutter
+INSPECT_ENTRIES = ":".join(["format=duration,start_time,size,bit_rate",
+                            "stream=index,codec_type,codec_name,codec_long_name,profile,level,pix_fmt,field_order,"
+                            "width,height,display_aspect_ratio,channels,channel_layout,bit_rate",
+                            "stream_disposition=visual_impaired,hearing_impaired",
+                            "stream_tags=language"])
+
+# encoders that are able to produce streams matching the source in case of smart rendering
+SMART_RENDERING_ENCODERS = {
+    "h264": "libx264",
+    "hevc": "libx265",
+    "mpeg2video": "mpeg2video"
+}
+
+# speed presets from fastest to slowest, names of x264 are used for all encoders
+PRESETS = ["ultrafast", "superfast", "veryfast", "faster",
+           "fast", "medium", "slow", "slower", "veryslow", "placebo"]
+
+TUNES = [None, "film", "animation", "grain", "stillimage",
+         "psnr", "ssim", "fastdecode", "zerolatency"]
+
+# video encoders of encoder profiles, presets are mapped to the encoder's own scale
+VIDEO_ENCODERS = {
+    "libx264": {
+        "codec_name": "h264",
+        "presets": PRESETS,
+        "tunes": ["film", "animation", "grain", "stillimage", "psnr", "ssim", "fastdecode", "zerolatency"]
+    },
+    "libx265": {
+        "codec_name": "hevc",
+        "presets": PRESETS,
+        "tunes": ["animation", "grain", "psnr", "ssim", "fastdecode", "zerolatency"]
+    },
+    "libsvtav1": {
+        "codec_name": "av1",
+        "presets": ["12", "11", "10", "9", "8", "6", "5", "4", "2", "1"],
+        "tunes": []
+    },
+    "libaom-av1": {
+        "codec_name": "av1",
+        "presets": ["8", "8", "7", "6", "5", "4", "3", "2", "1", "0"],
+        "tunes": ["psnr", "ssim"]
+    }
+}
+
+# minimum interval between updates of progress bar in seconds
+PROGRESS_INTERVAL = 0.5
+
+# number of lines of ffmpeg's stderr that are kept for error reporting
+STDERR_LINES = 50
+
+# interval in seconds in which running ffmpeg processes are checked for cancellation and stalls
+SUPERVISE_INTERVAL = 0.2
+
+# seconds to wait for ffmpeg after it has been asked to quit and after it has been terminated
+QUIT_TIMEOUT = 0.5
+TERMINATE_TIMEOUT = 0.3
+
+# ffmpeg is stopped if it hasn't reported progress for this number of seconds
+STALL_TIMEOUT = 120
+
+# interval in seconds in which Kodi's player is asked if something is playing
+PLAYBACK_INTERVAL = 1
+
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = 1
+PRIORITY_IDLE = 2
+
+# niceness and arguments of ionice per priority (Linux)
+NICENESS = [None, 10, 19]
+IONICE = [None, ["-c", "2", "-n", "7"], ["-c", "3"]]
+
+# process creation flags per priority (Windows)
+PRIORITY_CLASSES = [0, 0x00004000, 0x00000040]
+
+# list of cores as expected by taskset, e.g. 2-3 or 0,2
+_AFFINITY_PATTERN = re.compile(r"^[0-9]+(-[0-9]+)?(,[0-9]+(-[0-9]+)?)*$")
+
+
+def _to_float(value):
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ProgressEvent:
+    """
+    Progress reported by ffmpeg's machine-readable output (-progress). Values that ffmpeg reports as N/A are None.
+
+    - frame : int
+    - fps : float
+    - out_time : float, seconds of output that have been written
+    - speed : float, factor compared to realtime
+    - total_size : int, bytes of output that have been written
+    - bitrate : str
+    - finished : bool
+    """
+
+    def __init__(self, values):
+
+        self.frame = _to_int(values.get("frame"))
+        self.fps = _to_float(values.get("fps"))
+        self.total_size = _to_int(values.get("total_size"))
+        self.bitrate = values.get("bitrate")
+        self.speed = _to_float(values.get("speed", "").rstrip("x"))
+        self.finished = values.get("progress") == "end"
+
+        # out_time_ms is in microseconds, too
+        out_time_us = _to_int(values.get("out_time_us",
+                                         values.get("out_time_ms")))
+        self.out_time = out_time_us / 1000000.0 if out_time_us != None and out_time_us >= 0 else None
 
 
 class Progress:
@@ -25,77 +168,839 @@ class Progress:
         self.low = _low
         self.high = _high
         self.total = float(_total)
+        self._level = None
+        self._updated = 0
 
     def update(self, current):
 
+        if self.total <= 0:
+            return
+
+        current = min(max(current, 0), self.total)
         level = int(self.low + current / self.total * (self.high - self.low))
+
+        # each update crosses into Kodi's GUI, so skip unchanged levels and limit rate
+        now = time.time()
+        if level == self._level or now - self._updated < PROGRESS_INTERVAL:
+            return
+
+        self._level = level
+        self._updated = now
         self.callback(level)
 
 
+class ProgressGroup:
+    """
+    Merges progress of several concurrently running ffmpeg processes into a single callback
+    """
+
+    callback = None
+    low = None
+    high = None
+    total = None
+
+    def __init__(self, _callback, _low, _high, _total):
+        self.callback = _callback
+        self.low = _low
+        self.high = _high
+        self.total = float(_total)
+        self._current = {}
+        self._level = None
+        self._updated = 0
+        self._lock = threading.Lock()
+
+    def part(self, key, duration):
+        """
+        Returns progress object for one ffmpeg process that covers the given duration
+        """
+
+        return _ProgressPart(self, key, duration)
+
+    def _update(self, key, current):
+
+        if self.total <= 0:
+            return
+
+        with self._lock:
+            self._current[key] = current
+            level = int(self.low + sum(self._current.values()) /
+                        self.total * (self.high - self.low))
+
+            now = time.time()
+            if level == self._level or now - self._updated < PROGRESS_INTERVAL:
+                return
+
+            self._level = level
+            self._updated = now
+            self.callback(level)
+
+
+class _ProgressPart:
+
+    def __init__(self, group, key, duration):
+        self.group = group
+        self.key = key
+        self.total = float(duration)
+
+    def update(self, current):
+
+        self.group._update(self.key, min(max(current, 0), self.total))
+
+
+class _Supervisor:
+    """
+    Watches a running ffmpeg process in a separate thread and stops it if the job has been cancelled,
+    Kodi is shutting down or ffmpeg hasn't reported any progress for a while.
+
+    ffmpeg is asked to quit first ('q' on stdin) so that it finishes its output, if it doesn't react
+    it is terminated and killed at last.
+    """
+
+    reason = None
+
+    # seconds the process has been paused during playback
+    paused = 0
+
+    def __init__(self, process, is_cancelled, stall_timeout, is_playing=None):
+
+        self._process = process
+        self._is_cancelled = is_cancelled
+        self._stall_timeout = stall_timeout
+        self._is_playing = is_playing
+        self._active = time.time()
+        self._paused_at = None
+        self._playback_checked = 0
+        self._exited = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def alive(self):
+
+        self._active = time.time()
+
+    def exited(self):
+        """
+        Must be called after process has been reaped
+        """
+
+        self._exited.set()
+        self._thread.join()
+        if self._paused_at != None:
+            self.paused += time.time() - self._paused_at
+
+    def _run(self):
+
+        while not self._exited.wait(SUPERVISE_INTERVAL):
+            if self._is_cancelled():
+                self.reason = "cancelled"
+                self._stop()
+                return
+
+            if self._is_playing != None and time.time() - self._playback_checked >= PLAYBACK_INTERVAL:
+                self._playback_checked = time.time()
+                self._pause(self._is_playing())
+
+            if self._paused_at == None and self._stall_timeout and time.time() - self._active > self._stall_timeout:
+                self.reason = "no progress for %i seconds" % self._stall_timeout
+                self._stop()
+                return
+
+    def _pause(self, pause):
+        """
+        Stops (SIGSTOP) or continues (SIGCONT) process so that it doesn't compete with playback
+        """
+
+        if pause == (self._paused_at != None):
+            return
+
+        # os.kill instead of send_signal since the latter may reap the process
+        self._signal(lambda: os.kill(self._process.pid,
+                                     signal.SIGSTOP if pause else signal.SIGCONT))
+        if pause:
+            self._paused_at = time.time()
+            xbmc.log("pause ffmpeg (pid %i) during playback" %
+                     self._process.pid, xbmc.LOGNOTICE)
+        else:
+            self.paused += time.time() - self._paused_at
+            self._paused_at = None
+            self._active = time.time()
+            xbmc.log("resume ffmpeg (pid %i), paused for %.0fs in total" %
+                     (self._process.pid, self.paused), xbmc.LOGNOTICE)
+
+    def abort(self, reason):
+        """
+        Stops process from the thread that has started it, e.g. if reading its output has failed, and reaps it
+        """
+
+        self.reason = reason
+        self._stop(wait=self._wait_for_process)
+        self._process.wait()
+        self.exited()
+
+    def _wait_for_process(self, timeout):
+
+        deadline = time.time() + timeout
+        while self._process.poll() == None:
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+
+        return True
+
+    def _stop(self, wait=None):
+
+        # the supervising thread must not reap the process, the thread that waits for it does
+        wait = wait or self._exited.wait
+
+        xbmc.log("stop ffmpeg (pid %i), %s" %
+                 (self._process.pid, self.reason), xbmc.LOGWARNING)
+
+        # a stopped process neither quits nor terminates
+        self._pause(False)
+
+        try:
+            self._process.stdin.write("q")
+            self._process.stdin.flush()
+        except (IOError, OSError, ValueError):
+            pass
+
+        if wait(QUIT_TIMEOUT):
+            return
+
+        self._signal(self._process.terminate)
+        if wait(TERMINATE_TIMEOUT):
+            return
+
+        self._signal(self._process.kill)
+
+    def _signal(self, send):
+
+        try:
+            send()
+        except OSError:
+            # process has exited in the meantime
+            pass
+
+
+def _find_executable(name):
+
+    for path in os.environ.get("PATH", "").split(os.pathsep):
+        candidate = os.path.join(path, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+
+    return None
+
+
+def affinity_cores(affinity):
+    """
+    Returns number of cores of a list like 2-3 or 0,2
+    """
+
+    cores = 0
+    for part in affinity.split(","):
+        first, _, last = part.partition("-")
+        cores += int(last or first) - int(first) + 1
+
+    return max(1, cores)
+
+
+def cpu_count():
+
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except:
+        return 1
+
+
+def auto_workers(height, segments, cores=None):
+    """
+    Determines number of parallel encoder processes.
+
+    libx264 does not scale linearly with the number of threads, especially for SD content.
+    That's why each process gets a number of cores depending on resolution.
+    """
+
+    if cores == None:
+        cores = cpu_count()
+
+    if height == None or height <= 576:
+        cores_per_process = 4
+    elif height <= 720:
+        cores_per_process = 6
+    else:
+        cores_per_process = 8
+
+    return max(1, min(segments, cores // cores_per_process))
+
+
+def threads_per_worker(workers, cores=None):
+
+    if cores == None:
+        cores = cpu_count()
+
+    return max(1, cores // max(1, workers))
+
+
+class EncoderProfile:
+    """
+    Describes how video is encoded: encoder, speed preset, tune, rate control, threads and lookahead
+    of the encoder and number of threads of the filter chain.
+
+    Overrides are applied to videos up to a given height, e.g. in order to encode SD channels
+    with other settings than HD channels. They are pairs of max. height and dict of fields, e.g.
+
+    [(576, {"preset": "veryfast", "crf": 20})]
+    """
+
+    FIELDS = ["encoder", "preset", "tune", "crf", "bitrate",
+              "threads", "lookahead", "filter_threads"]
+
+    def __init__(self, encoder="libx264", preset="medium", tune=None, crf=None, bitrate=None,
+                 threads=None, lookahead=None, filter_threads=None, overrides=None):
+
+        self.encoder = encoder
+        self.preset = preset
+        self.tune = tune
+        self.crf = crf
+        self.bitrate = bitrate
+        self.threads = threads
+        self.lookahead = lookahead
+        self.filter_threads = filter_threads
+        self.overrides = sorted(overrides or [], key=lambda o: o[0])
+
+    @property
+    def codec_name(self):
+
+        return VIDEO_ENCODERS[self.encoder]["codec_name"]
+
+    def for_height(self, height):
+        """
+        Returns profile with overrides applied that match the given height of the video
+        """
+
+        fields = dict([(f, getattr(self, f)) for f in self.FIELDS])
+        for max_height, values in self.overrides:
+            if height != None and height <= max_height:
+                fields.update(values)
+                break
+
+        return EncoderProfile(**fields)
+
+    def validate(self, encoders):
+        """
+        Checks if encoder is in given list of available encoders, see FFMpegUtils.list_encoders()
+        """
+
+        return self.encoder in VIDEO_ENCODERS and self.encoder in encoders
+
+    def filter_params(self, filters, complex=False):
+        """
+        Builds parameters for a simple filter chain or thread parameters for a complex filter graph
+        """
+
+        params = []
+        if self.filter_threads != None:
+            params += ["-filter_complex_threads" if complex else "-filter_threads",
+                       str(self.filter_threads)]
+
+        if len(filters) > 0 and not complex:
+            params += ["-vf", ",".join(filters)]
+
+        return params
+
+    def video_params(self, threads=None):
+        """
+        Builds encoder parameters. Threads of profile take precedence over given threads.
+        """
+
+        encoder = VIDEO_ENCODERS[self.encoder]
+        threads = self.threads or threads
+        params = ["-c:v", self.encoder]
+
+        if self.preset in PRESETS:
+            preset = encoder["presets"][PRESETS.index(self.preset)]
+            params += ["-cpu-used" if self.encoder ==
+                       "libaom-av1" else "-preset", preset]
+
+        if self.tune != None:
+            if self.tune in encoder["tunes"]:
+                params += ["-tune", self.tune]
+            else:
+                xbmc.log("tune %s not supported by %s" %
+                         (self.tune, self.encoder), xbmc.LOGNOTICE)
+
+        if self.crf != None:
+            params += ["-crf", str(self.crf)]
+            if self.encoder == "libaom-av1":
+                # constant quality mode of libaom requires bitrate 0
+                params += ["-b:v", "0"]
+
+        elif self.bitrate != None:
+            params += ["-b:v", "%ik" % self.bitrate,
+                       "-maxrate", "%ik" % (self.bitrate * 3 // 2),
+                       "-bufsize", "%ik" % (self.bitrate * 2)]
+
+        x265_params = []
+        if self.lookahead != None:
+            if self.encoder == "libx264":
+                params += ["-rc-lookahead", str(self.lookahead)]
+            elif self.encoder == "libx265":
+                x265_params += ["rc-lookahead=%i" % self.lookahead]
+            elif self.encoder == "libsvtav1":
+                params += ["-svtav1-params", "lookahead=%i" % self.lookahead]
+            elif self.encoder == "libaom-av1":
+                params += ["-lag-in-frames", str(self.lookahead)]
+
+        if threads != None:
+            if self.encoder == "libx265":
+                # libx265 uses a thread pool instead of ffmpeg's thread count
+                x265_params += ["pools=%i" % threads]
+            else:
+                params += ["-threads", str(threads)]
+
+        if self.encoder == "libaom-av1":
+            params += ["-row-mt", "1"]
+
+        if len(x265_params) > 0:
+            params += ["-x265-params", ":".join(x265_params)]
+
+        return params
+
+
 class FFMpegUtils:
 
-    X264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster",
-                    "fast", "medium", "slow", "slower", "veryslow", "placebo"]
-    X264_TUNES = ["film", "animation", "grain", "stillimage",
-                  "psnr", "ssim", "fastdecode", "zerolatency"]
+    # available encoders by ffmpeg executable
+    _encoders = {}
 
     _ffmpeg_executable = None
     _ffprobe_executable = None
 
     _si = None
+    _creationflags = 0
+    _launcher = []
+    _cores = None
+    _cache = None
+    _cancel = None
+    _monitor = None
+    _player = None
+    _stall_timeout = None
 
-    def __init__(self, ffmpeg_executable="ffmpeg", ffprobe_executable="ffprobe"):
+    def __init__(self, ffmpeg_executable="ffmpeg", ffprobe_executable="ffprobe", cache=None,
+                 stall_timeout=STALL_TIMEOUT, priority=PRIORITY_NORMAL, affinity=None, pause_on_playback=False):
+        """
+        priority : PRIORITY_NORMAL, PRIORITY_LOW or PRIORITY_IDLE, i.e. nice and ionice class of ffmpeg
+        affinity : str, cores that ffmpeg is bound to, e.g. 2-3 (taskset)
+        pause_on_playback : bool, ffmpeg is paused while Kodi's player is playing
+        """
+
+        self._cache = cache
+        self._cancel = threading.Event()
+        self._monitor = xbmc.Monitor()
+        self._stall_timeout = stall_timeout
 
         _os = kodiutils.getOS()
         if (_os == kodiutils.OS_WINDOWS or _os == kodiutils.OS_XBOX):
+            import subprocess
             self._si = subprocess.STARTUPINFO()
             self._si.dwFlags = STARTF_USESHOWWINDOW
             self._si.wShowWindow = SW_HIDE
+            self._creationflags = PRIORITY_CLASSES[priority]
 
             if ffmpeg_executable == "ffmpeg":
                 ffmpeg_executable = "%s.exe" % ffmpeg_executable
             if ffprobe_executable == "ffprobe":
                 ffprobe_executable = "%s.exe" % ffprobe_executable
 
+        else:
+            self._launcher = self._build_launcher(priority, affinity)
+            if pause_on_playback:
+                self._player = xbmc.Player()
+
         self._ffmpeg_executable = ffmpeg_executable
         self._ffprobe_executable = ffprobe_executable
 
-    def exec_ffmpeg(self, params, progress=None):
+    def _build_launcher(self, priority, affinity):
+        """
+        Builds command prefix that starts ffmpeg with lower CPU and I/O priority and bound to some cores.
+        Tools that are not available, e.g. ionice on some embedded systems, are skipped.
+        """
+
+        launcher = []
+        if priority != PRIORITY_NORMAL:
+            if _find_executable("ionice"):
+                launcher += ["ionice"] + IONICE[priority]
+            if _find_executable("nice"):
+                launcher += ["nice", "-n", str(NICENESS[priority])]
+
+        if affinity:
+            if not _AFFINITY_PATTERN.match(affinity):
+                xbmc.log("invalid list of cores %s ignored" %
+                         affinity, xbmc.LOGWARNING)
+            elif _find_executable("taskset"):
+                launcher += ["taskset", "-c", affinity]
+                self._cores = affinity_cores(affinity)
+            else:
+                xbmc.log("taskset not available, ffmpeg is not bound to cores %s" %
+                         affinity, xbmc.LOGWARNING)
+
+        return launcher
+
+    def cores(self):
+        """
+        Returns number of cores that ffmpeg may use
+        """
+
+        return self._cores or cpu_count()
+
+    def cancel(self):
+        """
+        Stops running ffmpeg processes of this instance and refuses to start new ones
+        """
+
+        self._cancel.set()
+
+    def is_cancelled(self):
+
+        return self._cancel.is_set() or self._monitor.abortRequested()
 
-        call = [self._ffmpeg_executable, "-hide_banner", "-y"]
+    def exec_ffmpeg(self, params, progress=None, listener=None, metrics=None, log_listener=None, pausable=True):
+        """
+        Runs ffmpeg and reads its machine-readable progress from stdout. stderr is read in a separate thread
+        and its last lines are kept in order to report errors.
+
+        The process is supervised, i.e. it is stopped if cancel() has been called, Kodi is shutting down or
+        ffmpeg stalls. Output of a failed or stopped process is removed.
+
+        progress : object with method update(seconds), e.g. Progress
+        listener : function that is called with each ProgressEvent
+        metrics : JobMetrics that collects resource usage of the process
+        log_listener : function that is called with each line of stderr, e.g. for output of detection filters
+        pausable : bool, process may be paused during playback, i.e. nobody is waiting for it
+
+        Returns True if ffmpeg has succeeded
+        """
+
+        if self.is_cancelled():
+            xbmc.log("ffmpeg not started for %s, cancelled" %
+                     params[-1], xbmc.LOGNOTICE)
+            return False
+
+        call = self._launcher + [self._ffmpeg_executable, "-hide_banner", "-y",
+                                 "-nostats", "-progress", "pipe:1"]
         call += params
 
         xbmc.log(" ".join(call), xbmc.LOGNOTICE)
+        import subprocess
+        started = time.time()
         p = subprocess.Popen(call,
+                             stdin=subprocess.PIPE,
                              stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT,
+                             stderr=subprocess.PIPE,
                              universal_newlines=True,
-                             startupinfo=self._si)
+                             startupinfo=self._si,
+                             creationflags=self._creationflags)
+        supervisor = _Supervisor(p, self.is_cancelled, self._stall_timeout,
+                                 is_playing=self._player.isPlaying if pausable and self._player != None else None)
 
-        prev_line = None
-        for line in iter(p.stdout.readline, ""):
-            if not line:
-                break
+        stderr = collections.deque(maxlen=STDERR_LINES)
+
+        def _read_stderr():
+            for line in iter(p.stderr.readline, ""):
+                stderr.append(line.rstrip())
+                if log_listener != None:
+                    log_listener(line)
+
+        stderr_thread = threading.Thread(target=_read_stderr)
+        stderr_thread.daemon = True
+        stderr_thread.start()
+
+        values = {}
+        last_event = None
+        io = None
+        reaped = False
+        try:
+            for line in iter(p.stdout.readline, ""):
+                key, sep, value = line.strip().partition("=")
+                if not sep:
+                    continue
+
+                values[key] = value
+                if key != "progress":
+                    continue
+
+                event = ProgressEvent(values)
+                values = {}
+                last_event = event
+                supervisor.alive()
+
+                if metrics != None:
+                    io = read_proc_io(p.pid) or io
 
-            prev_line = line
-            if progress != None:
-                progress_secs = self._parse_time_to_secs(line)
-                if progress_secs != None:
-                    progress.update(progress_secs)
+                if listener != None:
+                    listener(event)
+
+                if progress != None and event.out_time != None:
+                    progress.update(event.out_time)
+
+            return_code, rusage = wait_with_rusage(p)
+            reaped = True
+        finally:
+            if not reaped:
+                # a callback has failed, ffmpeg mustn't keep running unobserved
+                supervisor.abort("reading progress failed")
+                stderr_thread.join()
+                p.stdin.close()
+                self._remove_output(params)
+
+        supervisor.exited()
+        stderr_thread.join()
+        p.stdin.close()
+
+        if metrics != None:
+            metrics.add_process(self._process_metrics(params, time.time() - started,
+                                                      return_code, rusage, io, last_event,
+                                                      paused=supervisor.paused))
+
+        if supervisor.reason != None:
+            xbmc.log("ffmpeg stopped for %s, %s" %
+                     (params[-1], supervisor.reason), xbmc.LOGWARNING)
+            self._remove_output(params)
+            return False
 
-        return_code = p.poll()
         if (return_code != 0):
-            xbmc.log(prev_line, xbmc.LOGERROR)
+            xbmc.log("ffmpeg failed with exit code %i:\n%s" % (return_code, "\n".join(stderr)),
+                     xbmc.LOGERROR)
+            self._remove_output(params)
             return False
 
         return True
 
+    def _remove_output(self, params):
+
+        output = params[-1]
+        if output != "-" and os.path.isfile(output):
+            os.remove(output)
+
+    def _process_metrics(self, params, wall, return_code, rusage, io, event, paused=0):
+
+        record = {
+            "output": os.path.basename(params[-1]),
+            "wall": wall,
+            "return_code": return_code
+        }
+
+        if paused > 0:
+            record["paused"] = paused
+            wall -= paused
+
+        if rusage != None:
+            record["cpu"] = rusage.ru_utime + rusage.ru_stime
+            record["max_rss"] = rusage.ru_maxrss
+
+        if io != None:
+            record["bytes_read"], record["bytes_written"] = io
+
+        if event != None:
+            record["speed"] = event.speed
+            record["out_time"] = event.out_time
+            record["total_size"] = event.total_size
+            if event.out_time != None and wall > 0:
+                record["speed_effective"] = event.out_time / wall
+
+        return record
+
+    def seek_params(self, filename, start=None, end=None, mode=SEEK_INPUT_ACCURATE, index=None):
+        """
+        Builds input parameters in order to read the range from start to end (in seconds) of given file
+
+        - SEEK_OUTPUT: seeks after opening the input, i.e. ffmpeg reads file from its very beginning
+        - SEEK_INPUT: seeks to keyframe before start by using input seeking
+        - SEEK_INPUT_ACCURATE: seeks by using input seeking to position shortly before start and then frame-accurate
+
+        In all modes timestamps of the output start at zero. If a keyframe index is given accurate seeking
+        jumps to the keyframe in front of start so that only a part of a single GOP is decoded.
+        """
+
+        if start == None or end == None:
+            return ["-i", filename]
+
+        duration = end - start
+
+        if mode == SEEK_OUTPUT:
+            return ["-i", filename, "-ss", str(start), "-to", str(end)]
+
+        elif mode == SEEK_INPUT:
+            return ["-ss", str(start), "-i", filename, "-t", str(duration)]
+
+        else:
+            pre_seek = index.keyframe_before(
+                start) if index != None else None
+            if pre_seek == None:
+                pre_seek = max(0, start - SEEK_ACCURATE_MARGIN)
+
+            return ["-ss", str(pre_seek), "-i", filename,
+                    "-ss", str(start - pre_seek), "-t", str(duration)]
+
+    def input_range_params(self, filename, start, end):
+        """
+        Builds input parameters that limit reading of given file to the range from start to end (in seconds).
+
+        In contrast to seek_params() all options apply to the input so that several ranges can be used as inputs
+        of a single ffmpeg call.
+        """
+
+        return ["-ss", str(start), "-t", str(end - start), "-i", filename]
+
+    def write_concat_list(self, filename, cuts, start_time=0):
+        """
+        Writes list for ffmpeg's concat demuxer with inpoint and outpoint for each cut to a temporary file.
+        The demuxer reads them as absolute timestamps, so the start time of the file, e.g. of MPEG-TS
+        recordings, is added to cuts that are relative to the start of the file.
+
+        Returns name of temporary file, caller must remove it.
+        """
+
+        fd, concat_list = tempfile.mkstemp(suffix=".ffconcat")
+        quoted = "'%s'" % filename.replace("'", "'\\''")
+        with os.fdopen(fd, "w") as f:
+            f.write("ffconcat version 1.0\n")
+            for cut in cuts:
+                f.write("file %s\n" % quoted)
+                f.write("inpoint %s\n" % (start_time + cut["start"]))
+                f.write("outpoint %s\n" % (start_time + cut["end"]))
+
+        return concat_list
+
+    def probe_keyframes(self, filename, start, end, start_time=0):
+        """
+        Determines timestamps of keyframes of first video stream in the range from start to end (in seconds)
+
+        Packets are read without decoding. Since ffprobe's read intervals are absolute timestamps
+        the start time of the file, e.g. of MPEG-TS recordings, is added and removed again.
+
+        Returns sorted list of timestamps in seconds relative to start time
+        """
+
+        params = ["-select_streams", "v:0",
+                  "-show_entries", "packet=pts_time,flags",
+                  "-read_intervals", "%f%%%f" % (start_time + start, start_time + end),
+                  "-of", "csv=p=0", filename]
+        out = self.exec_ffprobe(params)
+
+        keyframes = []
+        for line in out.splitlines():
+            fields = line.strip().split(",")
+            if len(fields) < 2 or "K" not in fields[1]:
+                continue
+
+            try:
+                t = float(fields[0]) - start_time
+            except ValueError:
+                continue
+
+            if start <= t <= end:
+                keyframes += [t]
+
+        keyframes.sort()
+        return keyframes
+
+    def matching_encoder_params(self, stream):
+        """
+        Builds encoder parameters for a video stream that can be spliced with stream copied parts of the given stream
+
+        Returns None if codec of stream is not supported
+        """
+
+        codec_name = stream.get("codec_name")
+        if codec_name not in SMART_RENDERING_ENCODERS:
+            return None
+
+        encoder = SMART_RENDERING_ENCODERS[codec_name]
+        params = ["-c:v", encoder]
+
+        if "pix_fmt" in stream:
+            params += ["-pix_fmt", stream["pix_fmt"]]
+
+        profile = stream.get("profile", "").lower().replace(
+            "constrained ", "")
+        if encoder == "libx264" and profile in ["baseline", "main", "high", "high10", "high422", "high444"]:
+            params += ["-profile:v", profile]
+        elif encoder == "libx265" and profile in ["main", "main10"]:
+            params += ["-profile:v", profile]
+
+        level = stream.get("level")
+        if encoder == "libx264" and level not in [None, -99]:
+            params += ["-level", "%.1f" % (int(level) / 10.0)]
+
+        if "bit_rate" in stream:
+            params += ["-b:v", str(stream["bit_rate"]),
+                       "-maxrate", str(stream["bit_rate"]),
+                       "-bufsize", str(int(stream["bit_rate"]) * 2)]
+        elif encoder != "mpeg2video":
+            params += ["-crf", "18"]
+        else:
+            params += ["-q:v", "2"]
+
+        field_order = stream.get("field_order", "progressive")
+        if field_order in ["tt", "tb", "bb", "bt"]:
+            tff = field_order in ["tt", "tb"]
+            params += ["-flags", "+ilme+ildct"]
+            if encoder == "libx264":
+                params += ["-x264opts", "tff=1" if tff else "bff=1"]
+            elif encoder == "mpeg2video":
+                params += ["-top", "1" if tff else "0"]
+
+        return params
+
+    def list_encoders(self):
+        """
+        Returns names of encoders that are supported by ffmpeg executable. The list is cached as long as
+        the executable doesn't change, so that ffmpeg isn't asked again for each job.
+        """
+
+        if self._ffmpeg_executable in FFMpegUtils._encoders:
+            return FFMpegUtils._encoders[self._ffmpeg_executable]
+
+        executable = self._ffmpeg_executable if os.path.isabs(
+            self._ffmpeg_executable) else _find_executable(self._ffmpeg_executable)
+        encoders = self._cache.get(executable, "encoders") \
+            if self._cache != None and executable != None else None
+
+        if encoders == None:
+            import subprocess
+            try:
+                out = subprocess.Popen([self._ffmpeg_executable, "-hide_banner", "-encoders"],
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       universal_newlines=True,
+                                       startupinfo=self._si).communicate()[0]
+            except OSError as e:
+                xbmc.log("ffmpeg not executable: %s" % e, xbmc.LOGERROR)
+                return []
+
+            # e.g. " V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC"
+            encoders = []
+            for line in out.splitlines():
+                fields = line.split()
+                if len(fields) >= 2 and len(fields[0]) == 6 and fields[0][0] in "VAS" and fields[1] != "=":
+                    encoders += [fields[1]]
+
+            if self._cache != None and executable != None and len(encoders) > 0:
+                self._cache.put(executable, "encoders", encoders)
+
+        FFMpegUtils._encoders[self._ffmpeg_executable] = encoders
+        return encoders
+
     def exec_ffprobe(self, params):
 
         call = [self._ffprobe_executable, "-v", "quiet"]
         call += params
 
         xbmc.log(" ".join(call), xbmc.LOGNOTICE)
+        import subprocess
         p = subprocess.Popen(call,
                              stdout=subprocess.PIPE,
                              stderr=subprocess.PIPE,
@@ -107,22 +1012,74 @@ class FFMpegUtils:
             xbmc.log(err, xbmc.LOGERROR)
             raise OSError(err)
 
-        return out.decode(kodiutils.getpreferredencoding())
+        # output is already decoded by universal_newlines in Python 3
+        if isinstance(out, bytes) and bytes is str:
+            out = out.decode(kodiutils.getpreferredencoding())
 
-    def inspect_media(self, filename):
+        return out
 
-        params = ["-print_format", "json",
-                  "-show_format", "-show_streams", filename]
-        out = self.exec_ffprobe(params)
-        return json.loads(out, encoding=kodiutils.getpreferredencoding())
+    def iter_ffprobe(self, params):
+        """
+        Runs ffprobe and yields lines of its output while it is running, e.g. for large packet lists
+        """
+
+        call = [self._ffprobe_executable, "-v", "quiet"]
+        call += params
+
+        xbmc.log(" ".join(call), xbmc.LOGNOTICE)
+        import subprocess
+        p = subprocess.Popen(call,
+                             stdout=subprocess.PIPE,
+                             universal_newlines=True,
+                             startupinfo=self._si)
+
+        try:
+            for line in iter(p.stdout.readline, ""):
+                yield line
+        finally:
+            p.stdout.close()
+            if p.poll() == None:
+                p.kill()
+            p.wait()
 
-    def _parse_time_to_secs(self, line):
+    def probe_duration(self, filename):
+        """
+        Returns duration of media file in seconds or None if it is not readable, e.g. a truncated segment
+        """
 
-        match = FFMPEG_PROGRESS_PATTERN.match(line)
-        if not match:
+        try:
+            out = self.exec_ffprobe(["-print_format", "json",
+                                     "-show_entries", "format=duration", filename])
+            return _to_float(json.loads(out).get("format", {}).get("duration"))
+        except (OSError, ValueError) as e:
+            xbmc.log("duration of %s not readable: %s" %
+                     (filename, e), xbmc.LOGWARNING)
             return None
 
-        time_str = match.groups()[4]
-        ms = sum([f * e for f, e in zip([3600, 60, 1],
-                                        map(float, time_str.split(':')))])
-        return ms
+    def inspect_media(self, filename, entries=None):
+        """
+        Inspects media file by ffprobe. Results are taken from cache if file hasn't been changed since.
+
+        entries limits ffprobe's output to the given sections and fields (syntax of -show_entries)
+        """
+
+        kind = "ffprobe:%s" % (entries or "all")
+        if self._cache != None:
+            ffprobe_json = self._cache.get(filename, kind)
+            if ffprobe_json != None:
+                return ffprobe_json
+
+        params = ["-print_format", "json"]
+        if entries != None:
+            params += ["-show_entries", entries]
+        else:
+            params += ["-show_format", "-show_streams"]
+
+        params += [filename]
+        out = self.exec_ffprobe(params)
+        ffprobe_json = json.loads(out)
+
+        if self._cache != None:
+            self._cache.put(filename, kind, ffprobe_json)
+
+        return ffprobe_json
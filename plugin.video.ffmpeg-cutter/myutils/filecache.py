@@ -0,0 +1,112 @@
+# coding=utf-8
+
+import json
+import os
+import sqlite3
+import time
+
+import xbmc
+from myutils.mediaindex import CACHE_DB
+
+MAX_BYTES = 5 * 1024 * 1024
+
+
+class FileCache:
+    """
+    Persistent LRU cache for results that are derived from a file, e.g. ffprobe's output.
+
+    Entries are keyed by path, size, mtime of the file and a kind so that several results per file can be cached.
+    Values must be serializable as json. If total size of all values exceeds max_bytes least recently used
+    entries are evicted.
+    """
+
+    _db_file = None
+    _max_bytes = None
+
+    def __init__(self, profile_dir, max_bytes=MAX_BYTES):
+
+        self._db_file = os.path.join(profile_dir, CACHE_DB)
+        self._max_bytes = max_bytes
+
+    def _connect(self):
+
+        conn = sqlite3.connect(self._db_file, timeout=10)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_cache (
+                path TEXT,
+                kind TEXT,
+                size INTEGER,
+                mtime REAL,
+                value TEXT,
+                bytes INTEGER,
+                atime REAL,
+                PRIMARY KEY (path, kind)
+            );
+            """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS file_cache_atime ON file_cache (atime);")
+        return conn
+
+    def get(self, filename, kind):
+        """
+        Returns cached value or None if there is no value or file has changed since
+        """
+
+        try:
+            stat = os.stat(filename)
+            conn = self._connect()
+            try:
+                with conn:
+                    row = conn.execute("""
+                        SELECT value FROM file_cache
+                        WHERE path = ? AND kind = ? AND size = ? AND mtime = ?;
+                        """, (filename, kind, stat.st_size, stat.st_mtime)).fetchone()
+                    if row == None:
+                        return None
+
+                    conn.execute("UPDATE file_cache SET atime = ? WHERE path = ? AND kind = ?;",
+                                 (time.time(), filename, kind))
+            finally:
+                conn.close()
+
+        except (OSError, sqlite3.Error) as e:
+            xbmc.log("cache not readable: %s" % e, xbmc.LOGWARNING)
+            return None
+
+        return json.loads(row[0])
+
+    def put(self, filename, kind, value):
+
+        data = json.dumps(value)
+        try:
+            stat = os.stat(filename)
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("""
+                        INSERT OR REPLACE INTO file_cache (path, kind, size, mtime, value, bytes, atime)
+                        VALUES (?, ?, ?, ?, ?, ?, ?);
+                        """, (filename, kind, stat.st_size, stat.st_mtime, data, len(data), time.time()))
+                    self._evict(conn)
+            finally:
+                conn.close()
+
+        except (OSError, sqlite3.Error) as e:
+            xbmc.log("cache not writable: %s" % e, xbmc.LOGWARNING)
+
+    def _evict(self, conn):
+
+        total = conn.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM file_cache;").fetchone()[0]
+        if total <= self._max_bytes:
+            return
+
+        rows = conn.execute(
+            "SELECT path, kind, bytes FROM file_cache ORDER BY atime;").fetchall()
+        for path, kind, size in rows:
+            if total <= self._max_bytes:
+                break
+
+            conn.execute(
+                "DELETE FROM file_cache WHERE path = ? AND kind = ?;", (path, kind))
+            total -= size
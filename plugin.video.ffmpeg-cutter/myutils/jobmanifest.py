@@ -0,0 +1,208 @@
+# coding=utf-8
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import xbmc
+
+MANIFESTS_DIR = "manifests"
+
+STATE_DONE = "done"
+
+# manifests of jobs that haven't been resumed for this time are removed together with their segments
+KEEP_UNFINISHED = 7 * 86400
+
+
+def job_key(job):
+    """
+    Returns key of a job that doesn't change if the same job is started again, i.e. same source, cuts,
+    streams and target directory
+    """
+
+    identity = json.dumps([job["filename"], [[c["start"], c["end"]] for c in job["cuts"]],
+                           job["streams"], job["target_directory"]])
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+
+
+def params_hash(params):
+    """
+    Returns hash of parameters that define a segment. It doesn't depend on whether they are str or unicode
+    in Python 2.
+    """
+
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _source_signature(filename):
+
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime]
+
+
+class JobManifest:
+    """
+    Checkpoints of a cut job in addon profile. For each segment the ffmpeg parameters and the size of
+    the validated output are recorded so that an interrupted job can be continued with the first
+    incomplete segment.
+
+    Segments only count as finished if source file, parameters and size of segment are unchanged.
+    """
+
+    _filename = None
+    _lock = None
+    _manifest = None
+
+    def __init__(self, profile_dir, job):
+
+        manifests_dir = os.path.join(profile_dir, MANIFESTS_DIR)
+        if not os.path.exists(manifests_dir):
+            os.makedirs(manifests_dir)
+
+        self.key = job_key(job)
+        self._filename = os.path.join(manifests_dir, "%s.json" % self.key)
+        self._lock = threading.Lock()
+
+        source = _source_signature(job["filename"])
+        self._manifest = self._load()
+        if self._manifest == None or self._manifest["source"] != source:
+            if self._manifest != None:
+                xbmc.log("source of job %s has changed, start from scratch" %
+                         self.key, xbmc.LOGNOTICE)
+                _remove_segments(self._manifest)
+
+            self._manifest = {
+                "key": self.key,
+                "filename": job["filename"],
+                "source": source,
+                "segments": {}
+            }
+
+    def _load(self):
+
+        if not os.path.isfile(self._filename):
+            return None
+
+        try:
+            with open(self._filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            xbmc.log("manifest %s not readable: %s" %
+                     (self._filename, e), xbmc.LOGWARNING)
+            return None
+
+    def _save(self):
+
+        self._manifest["updated"] = time.time()
+        tmp_filename = "%s.tmp" % self._filename
+        with open(tmp_filename, "w") as f:
+            json.dump(self._manifest, f)
+
+        if os.path.exists(self._filename):
+            # os.rename does not replace existing files on Windows
+            os.remove(self._filename)
+
+        os.rename(tmp_filename, self._filename)
+
+    def set_work_directory(self, work_directory):
+
+        with self._lock:
+            self._manifest["work_directory"] = work_directory
+            self._save()
+
+    def is_done(self, segment, params):
+        """
+        Returns True if segment has been created before with the same defining parameters and is still there
+        """
+
+        with self._lock:
+            entry = self._manifest["segments"].get(segment)
+
+        return entry != None and entry["state"] == STATE_DONE and entry.get("params_hash") == params_hash(params) \
+            and os.path.isfile(segment) and os.path.getsize(segment) == entry["size"]
+
+    def set_done(self, segment, params, duration):
+
+        with self._lock:
+            self._manifest["segments"][segment] = {
+                "params_hash": params_hash(params),
+                "duration": duration,
+                "size": os.path.getsize(segment),
+                "state": STATE_DONE
+            }
+            self._save()
+
+    def discard(self, segment):
+        """
+        Forgets segment and removes its possibly incomplete output
+        """
+
+        with self._lock:
+            if segment in self._manifest["segments"]:
+                del self._manifest["segments"][segment]
+                self._save()
+
+        if os.path.isfile(segment):
+            os.remove(segment)
+
+    def finished_size(self):
+
+        with self._lock:
+            return sum([entry["size"] for segment, entry in self._manifest["segments"].items()
+                        if entry["state"] == STATE_DONE and os.path.isfile(segment)])
+
+    def remove(self):
+        """
+        Removes manifest after job has been completed. Segments have already been cleaned up by cutter.
+        """
+
+        if os.path.isfile(self._filename):
+            os.remove(self._filename)
+
+    def clear(self):
+        """
+        Removes finished segments and manifest, e.g. after job has been cancelled
+        """
+
+        with self._lock:
+            _remove_segments(self._manifest)
+
+        self.remove()
+
+
+def _remove_segments(manifest):
+
+    for segment in manifest["segments"]:
+        if os.path.isfile(segment):
+            os.remove(segment)
+
+    work_directory = manifest.get("work_directory")
+    if work_directory != None and os.path.isdir(work_directory) and len(os.listdir(work_directory)) == 0:
+        os.rmdir(work_directory)
+
+
+def purge(profile_dir, max_age=KEEP_UNFINISHED):
+    """
+    Removes manifests and segments of jobs that haven't been continued for a long time
+    """
+
+    manifests_dir = os.path.join(profile_dir, MANIFESTS_DIR)
+    if not os.path.isdir(manifests_dir):
+        return
+
+    for entry in os.listdir(manifests_dir):
+        filename = os.path.join(manifests_dir, entry)
+        if not entry.endswith(".json") or time.time() - os.path.getmtime(filename) <= max_age:
+            continue
+
+        try:
+            with open(filename) as f:
+                _remove_segments(json.load(f))
+        except (IOError, OSError, ValueError) as e:
+            xbmc.log("manifest %s not removable: %s" %
+                     (filename, e), xbmc.LOGWARNING)
+
+        xbmc.log("removed stale manifest %s" % entry, xbmc.LOGNOTICE)
+        os.remove(filename)
@@ -0,0 +1,149 @@
+# coding=utf-8
+
+import json
+import os
+import time
+
+import xbmc
+import xbmcgui
+from myutils import kodiutils
+
+JOBS_DIR = "jobs"
+
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+STATE_CANCELLED = "cancelled"
+
+# window property by which the context menu asks the service to cancel a running job
+CANCEL_PROPERTY = "ffmpeg-cutter.cancel.%s"
+
+# finished jobs are kept for a while in order to be able to look at them
+KEEP_FINISHED = 7 * 86400
+
+
+class JobQueue:
+    """
+    Persistent queue of cut jobs in addon profile. Each job is stored in its own json file so that
+    the context menu can add jobs while the service is processing others.
+
+    Files are written to a temporary file first and renamed afterwards so that readers never see partial jobs.
+    """
+
+    _jobs_dir = None
+
+    def __init__(self, profile_dir):
+
+        self._jobs_dir = os.path.join(profile_dir, JOBS_DIR)
+        if not os.path.exists(self._jobs_dir):
+            os.makedirs(self._jobs_dir)
+
+    def add(self, job):
+
+        # uuid imports subprocess via ctypes in Python 2, so it's loaded when a job is queued only
+        import uuid
+
+        job = dict(job)
+        job["id"] = "%013i-%s" % (time.time() * 1000, uuid.uuid4().hex[:8])
+        job["state"] = STATE_QUEUED
+        job["created"] = time.time()
+        self.update(job)
+
+        xbmc.log("queued job %s for %s" %
+                 (job["id"], job["filename"]), xbmc.LOGNOTICE)
+        return job
+
+    def update(self, job):
+
+        filename = os.path.join(self._jobs_dir, "%s.json" % job["id"])
+        tmp_filename = "%s.tmp" % filename
+        with open(tmp_filename, "w") as f:
+            json.dump(job, f)
+
+        if os.path.exists(filename):
+            # os.rename does not replace existing files on Windows
+            os.remove(filename)
+
+        os.rename(tmp_filename, filename)
+
+    def jobs(self, state=None):
+        """
+        Returns jobs in order of creation, optionally only jobs with given state
+        """
+
+        jobs = []
+        for entry in sorted(os.listdir(self._jobs_dir)):
+            if not entry.endswith(".json"):
+                continue
+
+            try:
+                with open(os.path.join(self._jobs_dir, entry)) as f:
+                    job = json.load(f)
+            except (IOError, OSError, ValueError) as e:
+                xbmc.log("job %s not readable: %s" %
+                         (entry, e), xbmc.LOGWARNING)
+                continue
+
+            if state == None or job["state"] == state:
+                jobs += [job]
+
+        return jobs
+
+    def set_state(self, job, state, error=None):
+
+        job["state"] = state
+        job["%s_at" % state] = time.time()
+        if error != None:
+            job["error"] = error
+
+        self.update(job)
+
+    def recover(self):
+        """
+        Requeues jobs that were running when Kodi was closed and removes old finished jobs
+        """
+
+        for job in self.jobs():
+            if job["state"] == STATE_RUNNING:
+                xbmc.log("requeue interrupted job %s" %
+                         job["id"], xbmc.LOGNOTICE)
+                self.set_state(job, STATE_QUEUED)
+
+            elif job["state"] in [STATE_DONE, STATE_FAILED, STATE_CANCELLED] and time.time() - job.get("%s_at" % job["state"], 0) > KEEP_FINISHED:
+                self.remove(job)
+
+    def find(self, filename, states=[STATE_QUEUED, STATE_RUNNING]):
+        """
+        Returns jobs of the given source file that are in one of the given states
+        """
+
+        return [job for job in self.jobs() if job["filename"] == filename and job["state"] in states]
+
+    def cancel(self, job):
+        """
+        Cancels queued job immediately. Running jobs are cancelled by the service that polls is_cancel_requested().
+        """
+
+        if job["state"] == STATE_QUEUED:
+            self.set_state(job, STATE_CANCELLED)
+        else:
+            xbmcgui.Window(kodiutils.HOME_WINDOW).setProperty(
+                CANCEL_PROPERTY % job["id"], "true")
+
+        xbmc.log("cancel job %s" % job["id"], xbmc.LOGNOTICE)
+
+    def is_cancel_requested(self, job):
+
+        return xbmcgui.Window(kodiutils.HOME_WINDOW).getProperty(CANCEL_PROPERTY % job["id"]) == "true"
+
+    def clear_cancel_request(self, job):
+
+        xbmcgui.Window(kodiutils.HOME_WINDOW).clearProperty(
+            CANCEL_PROPERTY % job["id"])
+
+    def remove(self, job):
+
+        filename = os.path.join(self._jobs_dir, "%s.json" % job["id"])
+        if os.path.isfile(filename):
+            os.remove(filename)
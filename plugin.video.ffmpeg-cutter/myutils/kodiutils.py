@@ -5,12 +5,13 @@ import json
 import locale
 import os
 import re
-import sqlite3
 import string
+import threading
 import time
-import urllib
 
 import xbmc
+import xbmcaddon
+import xbmcgui
 
 OS_WINDOWS = "windows"
 OS_ANDROID = "android"
@@ -19,8 +20,18 @@ OS_XBOX = "xbox"
 OS_IOS = "ios"
 OS_DARWIN = "darwin"
 
+ADDON_ID = "plugin.video.ffmpeg-cutter"
+HOME_WINDOW = 10000
+
+DB_BUSY_TIMEOUT = 10
+
 REMOTE_SHARE_PATTERN = re.compile(r"^(smb|ftp|ftps|http|https|nfs):.+", re.IGNORECASE)
 
+_db_files = {}
+
+# detected operating system, None means unknown
+_platform = {}
+
 ENCODING = locale.getpreferredencoding()
 if (ENCODING == None):
     ENCODING = 'UTF-8'
@@ -30,13 +41,42 @@ def getpreferredencoding():
     return ENCODING
 
 
+def encode_path(s):
+    """
+    Encodes unicode by preferred encoding for file functions of Python 2. In Python 3 paths remain str.
+    """
+
+    if str is bytes and not isinstance(s, str):
+        return s.encode(getpreferredencoding())
+
+    return s
+
+
 def getOS():
     """
     Determines current operations system (OS) on which Kode is running. 
 
+    Result is cached in this interpreter and in a property of Kodi's home window since it doesn't change
+    while Kodi is running.
+
     return values are: "linux", "android", "windows", "xbox", "ios", "darwin"
     """
 
+    if "os" in _platform:
+        return _platform["os"]
+
+    prop = "%s.os" % ADDON_ID
+    _os = xbmcgui.Window(HOME_WINDOW).getProperty(prop)
+    if not _os:
+        _os = _detect_os() or "unknown"
+        xbmcgui.Window(HOME_WINDOW).setProperty(prop, _os)
+
+    _platform["os"] = _os if _os != "unknown" else None
+    return _platform["os"]
+
+
+def _detect_os():
+
     if xbmc.getCondVisibility("system.platform.android"):
 
         return OS_ANDROID
@@ -57,6 +97,7 @@ def getOS():
 
         return OS_IOS
     else:
+        import platform
         try:
             if platform.system() == "Darwin":
 
@@ -76,30 +117,116 @@ def getOS():
     return None
 
 
+class AddonSettings:
+    """
+    Settings of an addon that are read on first access and kept afterwards. The addon object is created
+    on first access as well so that settings of an addon that is not needed, e.g. pvr.hts for files,
+    cost nothing.
+    """
+
+    _addon_id = None
+    _addon = None
+
+    def __init__(self, addon_id=None):
+
+        self._addon_id = addon_id
+        self._values = {}
+
+    def getSetting(self, key):
+
+        if key not in self._values:
+            if self._addon == None:
+                self._addon = xbmcaddon.Addon(
+                    id=self._addon_id) if self._addon_id else xbmcaddon.Addon()
+            self._values[key] = self._addon.getSetting(key)
+
+        return self._values[key]
+
+
+def get_addon_profile():
+    """
+    Returns directory of addon's profile, i.e. userdata for this addon. Directory is created if it doesn't exist.
+    """
+
+    profile = xbmc.translatePath(xbmcaddon.Addon().getAddonInfo("profile"))
+    if not os.path.exists(profile):
+        os.makedirs(profile)
+
+    return profile
+
+
 def _lookup_db(dbName):
+    """
+    Determines database file with highest version, e.g. MyVideos116.db
+
+    Result is cached in this interpreter and in a property of Kodi's home window so that subsequent
+    invocations of the addon do not need to list the database directory again.
+    """
+
+    prop = "%s.db.%s" % (ADDON_ID, dbName)
+    db_file = _db_files.get(dbName) or xbmcgui.Window(
+        HOME_WINDOW).getProperty(prop)
+    if db_file and os.path.isfile(db_file):
+        _db_files[dbName] = db_file
+        return db_file
 
     database_dir = xbmc.translatePath("special://database")
-    entries = os.listdir(database_dir)
-    entries.sort()
-    entries.reverse()
-    for entry in entries:
-        if entry.startswith(dbName) and entry.endswith(".db"):
-            return "%s%s" % (database_dir, entry)
+    pattern = re.compile("^%s([0-9]+)\\.db$" % re.escape(dbName))
+    candidates = []
+    for entry in os.listdir(database_dir):
+        m = pattern.match(entry)
+        if m:
+            candidates += [(int(m.group(1)), entry)]
 
-    return None
+    if len(candidates) == 0:
+        return None
+
+    db_file = os.path.join(database_dir, max(candidates)[1])
+    _db_files[dbName] = db_file
+    xbmcgui.Window(HOME_WINDOW).setProperty(prop, db_file)
 
+    return db_file
 
-def _connect_db(db_file):
+
+def _connect_db(db_file, readonly=False):
+    """
+    Connects to database. Read-only connections are opened by URI if supported, i.e. Python 3.4+.
+
+    Since Kodi itself may hold locks on its databases a busy timeout is set.
+    """
+
+    import sqlite3
+    try:
+        from urllib import pathname2url
+    except ImportError:
+        from urllib.request import pathname2url
 
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
+        if readonly:
+            try:
+                conn = sqlite3.connect("file:%s?mode=ro" % pathname2url(db_file),
+                                       timeout=DB_BUSY_TIMEOUT, uri=True)
+            except TypeError:
+                conn = sqlite3.connect(db_file, timeout=DB_BUSY_TIMEOUT)
+        else:
+            conn = sqlite3.connect(db_file, timeout=DB_BUSY_TIMEOUT)
+
     except sqlite3.Error as e:
-        xbmc.log(e, xbmc.LOGERROR)
+        xbmc.log(str(e), xbmc.LOGERROR)
 
     return conn
 
 
+def split_path(strFilename):
+    """
+    Splits filename into path including trailing separator and name like Kodi does when it stores files in database
+    """
+
+    i = max(strFilename.rfind("/"), strFilename.rfind("\\"))
+    return strFilename[:i + 1], strFilename[i + 1:]
+
+
 def select_bookmarks(strFilename):
     """
     Selects bookmarks from video database for the given filename
@@ -121,22 +248,26 @@ def select_bookmarks(strFilename):
     if dbFile is None:
         return bookmarks
 
-    conn = _connect_db(dbFile)
+    conn = _connect_db(dbFile, readonly=True)
     if conn is None:
         return bookmarks
 
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT b.idBookmark, b.timeInSeconds, b.totalTimeInSeconds, b.thumbNailImage, p.strPath, f.strFilename
-        FROM bookmark b
-        INNER JOIN files f ON (f.idFile=b.idFile)
-        INNER JOIN path p ON (f.idPath=p.idPath)
-        WHERE p.strPath || f.strFilename = ?
-        AND b.thumbNailImage <> ''
-        ORDER BY b.timeInSeconds;
-        """, (strFilename,))
-
-    rows = cur.fetchall()
+    # path and filename are compared separately so that indexes on path and files can be used
+    strPath, strName = split_path(strFilename)
+    try:
+        rows = conn.execute("""
+            SELECT b.idBookmark, b.timeInSeconds, b.totalTimeInSeconds, b.thumbNailImage, p.strPath, f.strFilename
+            FROM path p
+            INNER JOIN files f ON (f.idPath=p.idPath)
+            INNER JOIN bookmark b ON (b.idFile=f.idFile)
+            WHERE p.strPath = ?
+            AND f.strFilename = ?
+            AND b.thumbNailImage <> ''
+            ORDER BY b.timeInSeconds;
+            """, (strPath, strName)).fetchall()
+    finally:
+        conn.close()
+
     for row in rows:
         bookmarks += [
             {
@@ -154,15 +285,31 @@ def select_bookmarks(strFilename):
     return bookmarks
 
 
+def _remove_thumbnails(thumbnails):
+
+    for thumbnail in thumbnails:
+        try:
+            thumbnail = xbmc.translatePath(thumbnail)
+            if os.path.isfile(thumbnail):
+                os.remove(thumbnail)
+        except OSError as e:
+            xbmc.log(str(e), xbmc.LOGWARNING)
+
+
 def delete_bookmarks(bookmarks):
     """
-    Deletes bookmarks
+    Deletes bookmarks in a single transaction. Thumbnails of bookmarks are removed afterwards in background.
 
     bookmarks parameter is an object with the following fields:
     - idBookmark : int
     - ...
     """
 
+    # bookmarks that have been proposed by break detection are not stored in database
+    bookmarks = [b for b in bookmarks if b["idBookmark"] != None]
+    if len(bookmarks) == 0:
+        return bookmarks
+
     dbFile = _lookup_db("MyVideos")
     if dbFile is None:
         return bookmarks
@@ -171,15 +318,16 @@ def delete_bookmarks(bookmarks):
     if conn is None:
         return bookmarks
 
-    cur = conn.cursor()
-    for bookmark in bookmarks:
-        cur.execute("DELETE FROM bookmark WHERE idBookmark = ?;",
-                    (bookmark["idBookmark"],))
-        thumbnail = xbmc.translatePath(bookmark["thumbNailImage"])
-        if os.path.isfile(thumbnail):
-            os.remove(thumbnail)
+    try:
+        with conn:
+            conn.executemany("DELETE FROM bookmark WHERE idBookmark = ?;",
+                             [(bookmark["idBookmark"],) for bookmark in bookmarks])
+    finally:
+        conn.close()
 
-    conn.commit()
+    thread = threading.Thread(target=_remove_thumbnails,
+                              args=([bookmark["thumbNailImage"] for bookmark in bookmarks],))
+    thread.start()
 
 
 def parse_recording_from_pvr_url(pvrFilename):
@@ -190,7 +338,12 @@ def parse_recording_from_pvr_url(pvrFilename):
     - start time
     """
 
-    pvrFilename = urllib.unquote(pvrFilename)
+    try:
+        from urllib import unquote
+    except ImportError:
+        from urllib.parse import unquote
+
+    pvrFilename = unquote(pvrFilename)
 
     pattern = re.compile(
         "^pvr://recordings/tv/active/(.*/)*(.+), TV \((.+)\), (19[0-9][0-9]|20[0-9][0-9])([0-9][0-9])([0-9][0-9])_([0-9][0-9])([0-9][0-9])([0-9][0-9]), (.+)\.pvr$", flags=re.S)
@@ -217,6 +370,21 @@ def seconds_to_time_str(secs):
     return time.strftime('%H:%M:%S', time.gmtime(secs))
 
 
+def seconds_until(time_of_day):
+    """
+    Returns seconds until next occurrence of given local time of day, e.g. "06:00"
+    """
+
+    hours, minutes = [int(v) for v in time_of_day.split(":")[:2]]
+    now = datetime.datetime.now()
+    deadline = now.replace(hour=hours, minute=minutes,
+                           second=0, microsecond=0)
+    if deadline <= now:
+        deadline += datetime.timedelta(days=1)
+
+    return (deadline - now).total_seconds()
+
+
 def json_rpc(jsonmethod, params=None):
 
     kodi_json = {}
@@ -235,7 +403,7 @@ def json_rpc(jsonmethod, params=None):
     result = None
     if 'result' in json_object:
         if isinstance(json_object['result'], dict):
-            for key, value in json_object['result'].iteritems():
+            for key, value in json_object['result'].items():
                 if not key == "limits":
                     result = value
                     break
@@ -264,4 +432,34 @@ def make_path_for_smb_share_on_windows(path):
     if getOS() in [OS_WINDOWS, OS_XBOX]:
         path = path.replace("smb://", os.path.sep * 2).replace("/", os.path.sep)
 
-    return path
\ No newline at end of file
+    return path
+
+
+def get_free_space(path):
+    """
+    Determines free space in bytes on filesystem of given path. If path doesn't exist yet its nearest existing parent is used.
+
+    Returns None if free space cannot be determined
+    """
+
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+
+    try:
+        if hasattr(os, "statvfs"):
+            st = os.statvfs(path)
+            return st.f_bavail * st.f_frsize
+
+        import ctypes
+        free = ctypes.c_ulonglong(0)
+        if ctypes.windll.kernel32.GetDiskFreeSpaceExW(ctypes.c_wchar_p(path), None, None, ctypes.pointer(free)):
+            return free.value
+
+    except Exception as e:
+        xbmc.log("free space of %s not determinable: %s" %
+                 (path, e), xbmc.LOGWARNING)
+
+    return None
@@ -0,0 +1,263 @@
+# coding=utf-8
+
+import array
+import bisect
+import os
+import sqlite3
+import time
+
+import xbmc
+
+CACHE_DB = "cache.db"
+
+# about 16 bytes per keyframe, i.e. a few hundred kilobytes for a long recording
+MAX_BYTES = 10 * 1024 * 1024
+
+
+def _to_blob(a):
+
+    return sqlite3.Binary(a.tobytes() if hasattr(a, "tobytes") else a.tostring())
+
+
+def _from_blob(blob):
+
+    a = array.array("d")
+    data = bytes(blob)
+    if hasattr(a, "frombytes"):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+
+    return a
+
+
+class KeyframeIndex:
+    """
+    Index of keyframes of first video stream of a media file. Timestamps of keyframes (in seconds relative
+    to start of file) and their byte positions are kept in arrays sorted by timestamp. Positions of other
+    packets are not kept, offsets in between keyframes are interpolated.
+
+    Byte positions are stored as doubles since 64bit integer arrays are not available in Python 2. Unknown
+    positions are -1.
+    """
+
+    keyframes = None
+    offsets = None
+
+    def __init__(self, keyframes=None, offsets=None):
+
+        self.keyframes = keyframes if keyframes != None else array.array("d")
+        self.offsets = offsets if offsets != None else array.array("d")
+
+    def __len__(self):
+
+        return len(self.keyframes)
+
+    def keyframe_before(self, t):
+        """
+        Returns timestamp of nearest keyframe at or before t or None
+        """
+
+        i = bisect.bisect_right(self.keyframes, t) - 1
+        return self.keyframes[i] if i >= 0 else None
+
+    def keyframe_after(self, t):
+        """
+        Returns timestamp of nearest keyframe at or after t or None
+        """
+
+        i = bisect.bisect_left(self.keyframes, t)
+        return self.keyframes[i] if i < len(self.keyframes) else None
+
+    def keyframes_between(self, start, end):
+
+        lo = bisect.bisect_left(self.keyframes, start)
+        hi = bisect.bisect_right(self.keyframes, end)
+        return list(self.keyframes[lo:hi])
+
+    def offset_for(self, t):
+        """
+        Returns estimated byte offset at t, i.e. interpolated between the keyframes around t. Returns 0 if
+        t is before first keyframe with known position.
+        """
+
+        i = bisect.bisect_right(self.keyframes, t) - 1
+        while i >= 0 and self.offsets[i] < 0:
+            i -= 1
+
+        if i < 0:
+            return 0
+
+        j = i + 1
+        while j < len(self.offsets) and self.offsets[j] < 0:
+            j += 1
+
+        if j == len(self.offsets) or self.keyframes[j] <= self.keyframes[i]:
+            return int(self.offsets[i])
+
+        fraction = (t - self.keyframes[i]) / \
+            (self.keyframes[j] - self.keyframes[i])
+        return int(self.offsets[i] + min(1, fraction) * (self.offsets[j] - self.offsets[i]))
+
+
+def build_index(ffmpegUtils, filename, start_time=0):
+    """
+    Scans all video packets of first video stream once without decoding and keeps keyframes only.
+
+    Packets of MPEG-TS are in decoding order. Keyframes are usually in presentation order anyway, so
+    arrays are filled directly and only sorted if they are not.
+    """
+
+    params = ["-select_streams", "v:0",
+              "-show_entries", "packet=pts_time,pos,flags",
+              "-of", "csv=p=0", filename]
+
+    keyframes = array.array("d")
+    offsets = array.array("d")
+    ordered = True
+    for line in ffmpegUtils.iter_ffprobe(params):
+        fields = line.strip().split(",")
+        if len(fields) < 3 or "K" not in fields[2]:
+            continue
+
+        try:
+            pts = float(fields[0]) - start_time
+        except ValueError:
+            continue
+
+        try:
+            pos = float(fields[1])
+        except ValueError:
+            pos = -1.0
+
+        if len(keyframes) > 0 and pts < keyframes[-1]:
+            ordered = False
+
+        keyframes.append(pts)
+        offsets.append(pos)
+
+    if not ordered:
+        order = sorted(range(len(keyframes)), key=keyframes.__getitem__)
+        keyframes = array.array("d", [keyframes[i] for i in order])
+        offsets = array.array("d", [offsets[i] for i in order])
+
+    return KeyframeIndex(keyframes, offsets)
+
+
+class KeyframeIndexCache:
+    """
+    Persistent LRU cache of keyframe indexes in sqlite database of addon profile.
+
+    Entries are keyed by path, size and mtime so that modified files are indexed again. If total size of all
+    indexes exceeds max_bytes least recently used indexes are evicted.
+    """
+
+    _db_file = None
+    _max_bytes = None
+
+    def __init__(self, profile_dir, max_bytes=MAX_BYTES):
+
+        self._db_file = os.path.join(profile_dir, CACHE_DB)
+        self._max_bytes = max_bytes
+
+    def _connect(self):
+
+        conn = sqlite3.connect(self._db_file, timeout=10)
+
+        # indexes of former versions kept all packets, they are dropped and built again when needed
+        columns = [row[1] for row in conn.execute(
+            "PRAGMA table_info(keyframe_index);").fetchall()]
+        if len(columns) > 0 and "atime" not in columns:
+            with conn:
+                conn.execute("DROP TABLE keyframe_index;")
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS keyframe_index (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime REAL,
+                keyframes BLOB,
+                offsets BLOB,
+                bytes INTEGER,
+                atime REAL
+            );
+            """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS keyframe_index_atime ON keyframe_index (atime);")
+        return conn
+
+    def get(self, filename):
+
+        stat = os.stat(filename)
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute("""
+                    SELECT keyframes, offsets FROM keyframe_index
+                    WHERE path = ? AND size = ? AND mtime = ?;
+                    """, (filename, stat.st_size, stat.st_mtime)).fetchone()
+                if row == None:
+                    return None
+
+                conn.execute("UPDATE keyframe_index SET atime = ? WHERE path = ?;",
+                             (time.time(), filename))
+        finally:
+            conn.close()
+
+        return KeyframeIndex(_from_blob(row[0]), _from_blob(row[1]))
+
+    def put(self, filename, index):
+
+        stat = os.stat(filename)
+        keyframes = _to_blob(index.keyframes)
+        offsets = _to_blob(index.offsets)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO keyframe_index (path, size, mtime, keyframes, offsets, bytes, atime)
+                    VALUES (?, ?, ?, ?, ?, ?, ?);
+                    """, (filename, stat.st_size, stat.st_mtime, keyframes, offsets,
+                          len(keyframes) + len(offsets), time.time()))
+                self._evict(conn)
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+
+        total = conn.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM keyframe_index;").fetchone()[0]
+        if total <= self._max_bytes:
+            return
+
+        rows = conn.execute(
+            "SELECT path, bytes FROM keyframe_index ORDER BY atime;").fetchall()
+        for path, size in rows:
+            if total <= self._max_bytes:
+                break
+
+            conn.execute(
+                "DELETE FROM keyframe_index WHERE path = ?;", (path,))
+            total -= size
+
+    def load(self, ffmpegUtils, filename, start_time=0, build=True):
+        """
+        Returns cached index of given file. If there is none and build is True the index is built and cached.
+        """
+
+        try:
+            index = self.get(filename)
+        except (OSError, sqlite3.Error) as e:
+            xbmc.log("keyframe index not readable: %s" % e, xbmc.LOGWARNING)
+            index = None
+
+        if index != None or not build:
+            return index
+
+        index = build_index(ffmpegUtils, filename, start_time)
+        try:
+            self.put(filename, index)
+        except (OSError, sqlite3.Error) as e:
+            xbmc.log("keyframe index not writable: %s" % e, xbmc.LOGWARNING)
+
+        return index
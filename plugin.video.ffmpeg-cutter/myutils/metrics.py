@@ -0,0 +1,123 @@
+# coding=utf-8
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+import xbmc
+
+METRICS_FILE = "metrics.jsonl"
+
+# metrics file is rotated if it exceeds this size
+MAX_METRICS_BYTES = 5 * 1024 * 1024
+
+
+def read_proc_io(pid):
+    """
+    Reads I/O counters of a process from /proc (Linux only). rchar and wchar also count I/O on network shares.
+
+    Returns tuple of bytes read and written or None
+    """
+
+    try:
+        with open("/proc/%i/io" % pid) as f:
+            values = dict([line.split(":", 1) for line in f if ":" in line])
+        return int(values["rchar"]), int(values["wchar"])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def wait_with_rusage(p):
+    """
+    Waits for child process and collects its resource usage if supported by platform (wait4)
+
+    Returns tuple of return code and resource usage or None
+    """
+
+    if not hasattr(os, "wait4"):
+        return p.wait(), None
+
+    try:
+        _, status, rusage = os.wait4(p.pid, 0)
+    except OSError:
+        # child has already been reaped
+        return p.wait(), None
+
+    if os.WIFSIGNALED(status):
+        p.returncode = -os.WTERMSIG(status)
+    else:
+        p.returncode = os.WEXITSTATUS(status)
+
+    return p.returncode, rusage
+
+
+class JobMetrics:
+    """
+    Collects wall time per stage of a cut job and resource usage of each ffmpeg child process.
+
+    Records are appended as json lines to metrics file in addon profile.
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self.record = {
+            "started": time.time(),
+            "stages": [],
+            "processes": []
+        }
+
+    def set(self, key, value):
+
+        with self._lock:
+            self.record[key] = value
+
+    @contextlib.contextmanager
+    def stage(self, name):
+
+        started = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.record["stages"] += [{"name": name,
+                                           "wall": time.time() - started}]
+
+    def add_process(self, process):
+
+        with self._lock:
+            self.record["processes"] += [process]
+
+    def write(self, profile_dir):
+
+        self.record["finished"] = time.time()
+        filename = os.path.join(profile_dir, METRICS_FILE)
+
+        try:
+            if os.path.isfile(filename) and os.path.getsize(filename) > MAX_METRICS_BYTES:
+                backup = "%s.1" % filename
+                if os.path.isfile(backup):
+                    os.remove(backup)
+                os.rename(filename, backup)
+
+            with self._lock:
+                line = json.dumps(self.record)
+
+            with open(filename, "a") as f:
+                f.write(line + "\n")
+
+        except (IOError, OSError) as e:
+            xbmc.log("metrics not writable: %s" % e, xbmc.LOGWARNING)
+
+    def summary(self):
+
+        lines = ["%s: %.1fs" % (stage["name"], stage["wall"])
+                 for stage in self.record["stages"]]
+        for process in self.record["processes"]:
+            lines += ["ffmpeg %s: %.1fs wall, %.1fs cpu, %s KB max rss, speed %s" % (
+                process.get("output"), process["wall"], process.get("cpu", 0) or 0,
+                process.get("max_rss"), process.get("speed"))]
+
+        return "\n".join(lines)
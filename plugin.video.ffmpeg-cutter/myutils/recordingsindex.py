@@ -0,0 +1,156 @@
+# coding=utf-8
+
+import json
+import os
+import sqlite3
+import time
+
+import xbmc
+
+RECORDINGS_DB = "recordings.db"
+
+# entries that have finished shortly before last sync are fetched again
+SYNC_OVERLAP = 3600
+
+# entries of recordings that have been deleted or edited in tvheadend are corrected by a full sync that the
+# service runs once a day
+FULL_SYNC_INTERVAL = 86400
+
+
+class RecordingsIndex:
+    """
+    Local index of tvheadend's finished recordings in sqlite database of addon profile.
+
+    The index is synced incrementally, i.e. only recordings that have finished since the last sync are fetched.
+    tvheadend doesn't expose modification times of recordings, so recordings that have been renamed or deleted
+    after they have been synced stay as they are until the next full sync. Lookups by channel and start time are
+    range queries on an index.
+    """
+
+    _db_file = None
+
+    def __init__(self, profile_dir):
+
+        self._db_file = os.path.join(profile_dir, RECORDINGS_DB)
+
+    def _connect(self):
+
+        conn = sqlite3.connect(self._db_file, timeout=10)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS recordings (
+                uuid TEXT PRIMARY KEY,
+                channelname TEXT,
+                start_real REAL,
+                stop_real REAL,
+                entry TEXT
+            );
+            """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS recordings_channel_start
+            ON recordings (channelname, start_real);
+            """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync (
+                key TEXT PRIMARY KEY,
+                value REAL
+            );
+            """)
+        return conn
+
+    def _get_sync_value(self, conn, key):
+
+        row = conn.execute(
+            "SELECT value FROM sync WHERE key = ?;", (key,)).fetchone()
+        return row[0] if row != None else None
+
+    def needs_full_sync(self):
+
+        conn = self._connect()
+        try:
+            last_full_sync = self._get_sync_value(conn, "full_sync") or 0
+        finally:
+            conn.close()
+
+        return time.time() - last_full_sync > FULL_SYNC_INTERVAL
+
+    def sync(self, client, full=False):
+        """
+        Fetches recordings that have finished since last sync from tvheadend by using given TvheadendClient.
+        A full sync fetches all recordings and removes those that don't exist anymore, it takes a while for
+        a long history and is therefore left to the service.
+        """
+
+        conn = self._connect()
+        try:
+            filters = []
+            if not full:
+                last_stop = self._get_sync_value(conn, "stop_real") or 0
+                filters += [{"field": "stop_real", "type": "numeric",
+                             "value": int(last_stop - SYNC_OVERLAP), "comparison": "gt"}]
+
+            synced = 0
+            max_stop = self._get_sync_value(conn, "stop_real") or 0
+            now = time.time()
+
+            with conn:
+                if full:
+                    conn.execute(
+                        "CREATE TEMP TABLE IF NOT EXISTS seen (uuid TEXT PRIMARY KEY);")
+                    conn.execute("DELETE FROM seen;")
+
+                for entry in client.query_finished_recordings(filters=filters, sort="stop_real"):
+                    conn.execute("""
+                        INSERT OR REPLACE INTO recordings (uuid, channelname, start_real, stop_real, entry)
+                        VALUES (?, ?, ?, ?, ?);
+                        """, (entry["uuid"], entry["channelname"], entry["start_real"], entry["stop_real"],
+                              json.dumps(entry)))
+                    if full:
+                        conn.execute(
+                            "INSERT OR IGNORE INTO seen (uuid) VALUES (?);", (entry["uuid"],))
+
+                    max_stop = max(max_stop, entry["stop_real"])
+                    synced += 1
+
+                if full:
+                    conn.execute(
+                        "DELETE FROM recordings WHERE uuid NOT IN (SELECT uuid FROM seen);")
+                    conn.execute(
+                        "INSERT OR REPLACE INTO sync (key, value) VALUES ('full_sync', ?);", (now,))
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync (key, value) VALUES ('stop_real', ?);", (max_stop,))
+
+        finally:
+            conn.close()
+
+        xbmc.log("synced %i recordings from tvheadend (full sync: %s)" % (synced, full),
+                 xbmc.LOGNOTICE)
+        return synced
+
+    def lookup(self, channelname, start, timeframe):
+        """
+        Returns recordings of given channel that have been started within timeframe (in seconds) around start
+        """
+
+        conn = self._connect()
+        try:
+            rows = conn.execute("""
+                SELECT entry FROM recordings
+                WHERE channelname = ? AND start_real BETWEEN ? AND ?
+                ORDER BY start_real;
+                """, (channelname, start - timeframe, start + timeframe)).fetchall()
+        finally:
+            conn.close()
+
+        return [json.loads(row[0]) for row in rows]
+
+    def get(self, uuid):
+
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT entry FROM recordings WHERE uuid = ?;", (uuid,)).fetchone()
+        finally:
+            conn.close()
+
+        return json.loads(row[0]) if row != None else None
@@ -0,0 +1,157 @@
+# coding=utf-8
+
+import json
+import os
+import time
+
+import xbmc
+from myutils.ffmpegutils import PRESETS
+
+THROUGHPUT_FILE = "throughput.json"
+
+# encoder name of stream-copied jobs
+COPY = "copy"
+
+# weight of a new observation in the moving average of speed
+SMOOTHING = 0.3
+
+# typical speed of presets relative to medium, used to transfer observations to presets that haven't been used yet
+PRESET_SPEED = {
+    "ultrafast": 6.0,
+    "superfast": 4.5,
+    "veryfast": 3.0,
+    "faster": 1.6,
+    "fast": 1.25,
+    "medium": 1.0,
+    "slow": 0.65,
+    "slower": 0.35,
+    "veryslow": 0.18,
+    "placebo": 0.05
+}
+
+
+def model_key(encoder, height, preset=None, deinterlace=False):
+
+    if encoder == COPY:
+        return "%s|%s" % (COPY, height)
+
+    return "%s|%s|%s|%s" % (encoder, height, preset, "yadif" if deinterlace else "progressive")
+
+
+class ThroughputModel:
+    """
+    Speed factors of past jobs, i.e. seconds of video processed per second, by encoder, height of video,
+    preset and deinterlacing. Speed of parallel workers is summed up, so that the duration of a job
+    is its kept duration divided by speed.
+
+    Model is stored as json file in addon profile.
+    """
+
+    _filename = None
+    _model = None
+
+    def __init__(self, profile_dir):
+
+        self._filename = os.path.join(profile_dir, THROUGHPUT_FILE)
+        self._model = self._load()
+
+    def _load(self):
+
+        if not os.path.isfile(self._filename):
+            return {}
+
+        try:
+            with open(self._filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            xbmc.log("throughput model %s not readable: %s" %
+                     (self._filename, e), xbmc.LOGWARNING)
+            return {}
+
+    def _save(self):
+
+        tmp_filename = "%s.tmp" % self._filename
+        try:
+            with open(tmp_filename, "w") as f:
+                json.dump(self._model, f)
+
+            if os.path.exists(self._filename):
+                # os.rename does not replace existing files on Windows
+                os.remove(self._filename)
+
+            os.rename(tmp_filename, self._filename)
+
+        except (IOError, OSError) as e:
+            xbmc.log("throughput model not writable: %s" % e, xbmc.LOGWARNING)
+
+    def observe(self, speed, encoder, height, preset=None, deinterlace=False):
+
+        key = model_key(encoder, height, preset, deinterlace)
+
+        # re-read since jobs may finish in other processes
+        self._model = self._load()
+        entry = self._model.get(key)
+        if entry == None:
+            entry = {"speed": speed, "samples": 0}
+        else:
+            entry["speed"] = (1 - SMOOTHING) * entry["speed"] + SMOOTHING * speed
+
+        entry["samples"] += 1
+        entry["updated"] = time.time()
+        self._model[key] = entry
+        self._save()
+
+        xbmc.log("observed speed %.2f for %s, estimated %.2f" %
+                 (speed, key, entry["speed"]), xbmc.LOGNOTICE)
+
+    def speed(self, encoder, height, preset=None, deinterlace=False):
+        """
+        Returns estimated speed or None if nothing comparable has been observed yet. If the preset hasn't
+        been used yet speed is derived from the most used other preset.
+        """
+
+        entry = self._model.get(model_key(
+            encoder, height, preset, deinterlace))
+        if entry != None:
+            return entry["speed"]
+
+        if encoder == COPY or preset not in PRESET_SPEED:
+            return None
+
+        others = [(self._model[key]["samples"], p) for p, key in [(p, model_key(encoder, height, p, deinterlace))
+                                                                  for p in PRESETS] if key in self._model]
+        if len(others) == 0:
+            return None
+
+        samples, other = max(others)
+        return self._model[model_key(encoder, height, other, deinterlace)]["speed"] \
+            * PRESET_SPEED[preset] / PRESET_SPEED[other]
+
+    def estimate(self, duration, encoder, height, preset=None, deinterlace=False):
+        """
+        Returns estimated seconds that are needed to process duration seconds of video or None
+        """
+
+        speed = self.speed(encoder, height, preset, deinterlace)
+        if speed == None or speed <= 0:
+            return None
+
+        return duration / speed
+
+    def select_preset(self, duration, available, encoder, height, max_preset, deinterlace=False):
+        """
+        Returns slowest preset up to max_preset that processes duration seconds of video within available
+        seconds. Returns fastest preset if none finishes in time or None if there are no observations.
+        """
+
+        candidates = PRESETS[:PRESETS.index(max_preset) + 1]
+        for preset in reversed(candidates):
+            estimated = self.estimate(
+                duration, encoder, height, preset, deinterlace)
+            if estimated == None:
+                return None
+
+            if estimated <= available:
+                return preset
+
+        return candidates[0]
@@ -0,0 +1,163 @@
+# coding=utf-8
+
+import hashlib
+import json
+import os
+import threading
+
+import xbmc
+from myutils import ffmpegutils, workerpool
+
+THUMBNAILS_DIR = "thumbnails"
+
+MAX_BYTES = 20 * 1024 * 1024
+
+THUMBNAIL_WIDTH = 320
+THUMBNAIL_QUALITY = 5
+
+# extractions run in parallel, each of them is short and decodes a single GOP only
+MAX_WORKERS = 4
+
+
+class ThumbnailCache:
+    """
+    Persistent cache of preview frames in addon profile.
+
+    Frames are jpeg files that are keyed by path, size, mtime of the video and the point in time. If total
+    size exceeds max_bytes least recently used frames are evicted, i.e. mtime of a file is its access time.
+    """
+
+    _directory = None
+    _max_bytes = None
+    _lock = None
+
+    def __init__(self, profile_dir, max_bytes=MAX_BYTES):
+
+        self._directory = os.path.join(profile_dir, THUMBNAILS_DIR)
+        if not os.path.exists(self._directory):
+            os.makedirs(self._directory)
+
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path_for(self, filename, t):
+
+        # json escapes non-ASCII characters, i.e. byte strings of Python 2 are hashed as well
+        stat = os.stat(filename)
+        identity = json.dumps([filename, stat.st_size, stat.st_mtime, "%.3f" % t])
+        return os.path.join(self._directory, "%s.jpg" % hashlib.sha1(identity.encode("utf-8")).hexdigest())
+
+    def get(self, filename, t):
+        """
+        Returns path of cached frame or None
+        """
+
+        path = self.path_for(filename, t)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return path
+
+    def create(self, ffmpegUtils, filename, t, threads=None):
+        """
+        Extracts frame at t seconds after start of file. Returns path of frame or None if extraction failed.
+        """
+
+        path = self.path_for(filename, t)
+        tmp_path = "%s.tmp" % path
+
+        # input seeking jumps to the keyframe before t and only decodes the rest of its GOP
+        params = []
+        if threads != None:
+            params += ["-threads", str(threads)]
+
+        params += ["-ss", "%.3f" % t, "-i", filename,
+                   "-map", "0:v:0", "-frames:v", "1",
+                   "-vf", "scale=%i:-2" % THUMBNAIL_WIDTH,
+                   "-q:v", str(THUMBNAIL_QUALITY),
+                   "-f", "mjpeg", tmp_path]
+
+        if not ffmpegUtils.exec_ffmpeg(params, pausable=False) or not os.path.isfile(tmp_path):
+            xbmc.log("no thumbnail for %s at %.3f" %
+                     (filename, t), xbmc.LOGWARNING)
+            return None
+
+        if os.path.exists(path):
+            # os.rename does not replace existing files on Windows
+            os.remove(path)
+
+        os.rename(tmp_path, path)
+        return path
+
+    def evict(self):
+
+        with self._lock:
+            entries = []
+            for entry in os.listdir(self._directory):
+                path = os.path.join(self._directory, entry)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                entries += [(stat.st_mtime, stat.st_size, path)]
+
+            total = sum([size for mtime, size, path in entries])
+            for mtime, size, path in sorted(entries):
+                if total <= self._max_bytes:
+                    break
+
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError as e:
+                    xbmc.log("thumbnail %s not removable: %s" %
+                             (path, e), xbmc.LOGWARNING)
+
+
+def previews(ffmpegUtils, cache, filename, times, workers=None, progress=None):
+    """
+    Returns dict with path of frame or None for each point in time. Missing frames are extracted in parallel.
+
+    progress : function that is called with percentage of extracted frames
+    """
+
+    result = {}
+    missing = []
+    for t in times:
+        result[t] = cache.get(filename, t)
+        if result[t] == None:
+            missing += [t]
+
+    if len(missing) == 0:
+        return result
+
+    cores = ffmpegUtils.cores()
+    workers = workers or min(len(missing), MAX_WORKERS, cores)
+    threads = ffmpegutils.threads_per_worker(workers, cores)
+
+    pool = workerpool.WorkerPool(workers)
+    tasks = [(t, pool.submit(cache.create, ffmpegUtils, filename, t, threads=threads))
+             for t in missing]
+
+    try:
+        for i, (t, task) in enumerate(tasks):
+            try:
+                result[t] = task.result()
+            except (IOError, OSError) as e:
+                xbmc.log("no thumbnail for %s at %.3f: %s" %
+                         (filename, t, e), xbmc.LOGWARNING)
+
+            if progress != None:
+                progress(100 * (i + 1) // len(tasks))
+    finally:
+        pool.shutdown()
+
+    cache.evict()
+
+    return result
@@ -1,16 +1,229 @@
 # coding=utf-8
 
+import base64
+import codecs
+import hashlib
 import json
-import urllib2
-from myutils import kodiutils
+import os
+import socket
 
-def query_hts_finished_recordings(host, http_port, username, password):
+try:
+    import httplib
+    from urllib import urlencode
+    from urllib2 import parse_http_list, parse_keqv_list
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlencode
+    from urllib.request import parse_http_list, parse_keqv_list
 
-    url = "http://%s:%s/api/dvr/entry/grid_finished?limit=%i" % (
-        host, http_port, 999999)
+import xbmc
 
-    ressource = urllib2.urlopen(url)
-    data = ressource.read()
-    ressource.close()
+GRID_FINISHED = "/api/dvr/entry/grid_finished"
+
+# columns of finished recordings that are required by cutter
+FINISHED_RECORDINGS_COLUMNS = ["uuid", "channelname", "start", "start_real", "stop_real",
+                               "disp_title", "disp_subtitle", "filename", "directory"]
+
+CHUNK_SIZE = 16384
+
+
+def iter_json_array(response, key="entries", chunk_size=CHUNK_SIZE):
+    """
+    Parses json response incrementally and yields elements of the array with the given key one by one,
+    so that the whole response is never held in memory.
+
+    Expects that the array is the first member of the response like in tvheadend's grids.
+    """
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    token = '"%s"' % key
+    buf = ""
+    eof = False
+    in_array = False
+
+    while True:
+
+        if not in_array:
+            i = buf.find(token)
+            j = buf.find("[", i + len(token)) if i >= 0 else -1
+            if j >= 0:
+                buf = buf[j + 1:]
+                in_array = True
+                continue
+
+        else:
+            buf = buf.lstrip(" \t\r\n,")
+            if buf.startswith("]"):
+                return
+
+            if buf:
+                try:
+                    obj, end = decoder.raw_decode(buf)
+                    buf = buf[end:]
+                    yield obj
+                    continue
+                except ValueError:
+                    if eof:
+                        raise
+
+        if eof:
+            return
+
+        chunk = response.read(chunk_size)
+        if not chunk:
+            eof = True
+            buf += text_decoder.decode(b"", final=True)
+        else:
+            buf += text_decoder.decode(chunk)
+
+
+class TvheadendClient:
+    """
+    Client for tvheadend's HTTP API that keeps an authenticated keep-alive connection.
+
+    Supports HTTP basic and digest authentication depending on tvheadend's challenge.
+    """
+
+    def __init__(self, host, http_port, username=None, password=None, timeout=30):
+
+        self._host = host
+        self._http_port = http_port
+        self._username = username
+        self._password = password
+        self._timeout = timeout
+        self._conn = None
+        self._auth_required = False
+        self._digest = None
+        self._nonce_count = 0
+
+    def close(self):
+
+        if self._conn != None:
+            self._conn.close()
+            self._conn = None
+
+    def query_finished_recordings(self, filters=None, columns=FINISHED_RECORDINGS_COLUMNS, sort="start_real",
+                                  direction="ASC", limit=999999):
+        """
+        Queries finished recordings. Filters are passed to tvheadend in terms of its grid filter syntax, e.g.
+
+        [{"field": "start_real", "type": "numeric", "value": 1590000000, "comparison": "gt"}]
+
+        Yields entries one by one while the response is being read
+        """
+
+        params = {"start": 0, "limit": limit, "sort": sort, "dir": direction}
+        if filters:
+            params["filter"] = json.dumps(filters)
+        if columns:
+            params["list"] = ",".join(columns)
+
+        response = self._request(GRID_FINISHED, params)
+        complete = False
+        try:
+            for entry in iter_json_array(response):
+                yield entry
+
+            response.read()
+            complete = True
+
+        finally:
+            # connection can only be reused if response has been read completely
+            if not complete:
+                self.close()
+
+    def _connect(self):
+
+        if self._conn == None:
+            self._conn = httplib.HTTPConnection(self._host, int(self._http_port),
+                                                timeout=self._timeout)
+
+        return self._conn
+
+    def _request(self, path, params):
+
+        body = urlencode(params)
+
+        for attempt in range(3):
+            headers = {"Content-Type": "application/x-www-form-urlencoded",
+                       "Connection": "keep-alive"}
+            authorization = self._authorization("POST", path)
+            if authorization != None:
+                headers["Authorization"] = authorization
+
+            try:
+                conn = self._connect()
+                conn.request("POST", path, body, headers)
+                response = conn.getresponse()
+
+            except (httplib.HTTPException, socket.error) as e:
+                # keep-alive connection may have been closed by server in the meantime
+                xbmc.log("tvheadend connection lost: %s" % e, xbmc.LOGWARNING)
+                self.close()
+                if attempt > 0:
+                    raise IOError("tvheadend not reachable: %s" % e)
+                continue
+
+            if response.status == 401 and self._username:
+                response.read()
+                self._challenge(response.getheader("WWW-Authenticate", ""))
+                continue
+
+            if response.status != 200:
+                response.read()
+                raise IOError("tvheadend responded %i %s for %s" %
+                              (response.status, response.reason, path))
+
+            return response
+
+        raise IOError("tvheadend authentication failed for %s" % path)
+
+    def _challenge(self, header):
+
+        if header.lower().startswith("digest"):
+            self._digest = parse_keqv_list(parse_http_list(header[7:]))
+            self._nonce_count = 0
+        else:
+            self._digest = None
+
+        self._auth_required = True
+
+    def _authorization(self, method, uri):
+
+        if not self._username or not self._auth_required:
+            return None
+
+        if self._digest == None:
+            credentials = "%s:%s" % (self._username, self._password or "")
+            return "Basic %s" % base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+
+        def _md5(s):
+            return hashlib.md5(s.encode("utf-8")).hexdigest()
+
+        realm = self._digest.get("realm", "")
+        nonce = self._digest.get("nonce", "")
+        qop = self._digest.get("qop")
+        opaque = self._digest.get("opaque")
+
+        ha1 = _md5("%s:%s:%s" % (self._username, realm, self._password or ""))
+        ha2 = _md5("%s:%s" % (method, uri))
+
+        header = 'Digest username="%s", realm="%s", nonce="%s", uri="%s"' % (
+            self._username, realm, nonce, uri)
+
+        if qop != None:
+            self._nonce_count += 1
+            nc = "%08x" % self._nonce_count
+            cnonce = hashlib.md5(os.urandom(16)).hexdigest()[:16]
+            response = _md5("%s:%s:%s:%s:auth:%s" % (ha1, nonce, nc, cnonce, ha2))
+            header += ', qop=auth, nc=%s, cnonce="%s"' % (nc, cnonce)
+        else:
+            response = _md5("%s:%s:%s" % (ha1, nonce, ha2))
+
+        header += ', response="%s"' % response
+        if opaque != None:
+            header += ', opaque="%s"' % opaque
+
+        return header
 
-    return json.loads(data, encoding=kodiutils.getpreferredencoding())
\ No newline at end of file
@@ -0,0 +1,132 @@
+# coding=utf-8
+
+import sys
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class CancelledError(Exception):
+    """
+    Raised by Task.result() if task has been cancelled before it has been started
+    """
+
+
+class Task:
+    """
+    Handle of a function that has been submitted to a WorkerPool
+    """
+
+    def __init__(self, func, args, kwargs):
+
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        self._result = None
+        self._error = None
+
+    def run(self):
+
+        with self._lock:
+            if self._done.is_set():
+                # cancelled
+                return
+
+            self._started = True
+
+        try:
+            self._result = self._func(*self._args, **self._kwargs)
+        except:
+            self._error = sys.exc_info()[1]
+        finally:
+            self._done.set()
+
+    def done(self):
+
+        return self._done.is_set()
+
+    def cancel(self):
+        """
+        Prevents task from running if it hasn't been started yet. Returns True if task has been cancelled.
+        """
+
+        with self._lock:
+            if self._started or self._done.is_set():
+                return False
+
+            self._error = CancelledError()
+            self._done.set()
+            return True
+
+    def result(self, timeout=None):
+        """
+        Waits until task has finished and returns its result. Exceptions raised by task are re-raised.
+        """
+
+        self._done.wait(timeout)
+        if self._error != None:
+            raise self._error
+
+        return self._result
+
+
+class WorkerPool:
+    """
+    Small pool of daemon threads. Threads are started lazily up to the given number of workers.
+
+    There is no dependency to multiprocessing since it is not available on all platforms where Kodi runs.
+    Functions that are submitted usually wait for child processes or I/O, so that the GIL does not matter.
+    """
+
+    def __init__(self, workers):
+
+        self.workers = max(1, workers)
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+
+        task = Task(func, args, kwargs)
+        with self._lock:
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+        self._queue.put(task)
+        return task
+
+    def map(self, func, iterable):
+
+        tasks = [self.submit(func, item) for item in iterable]
+        return [task.result() for task in tasks]
+
+    def shutdown(self, wait=True):
+
+        with self._lock:
+            threads = self._threads
+            self._threads = []
+
+        for _ in threads:
+            self._queue.put(None)
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _work(self):
+
+        while True:
+            task = self._queue.get()
+            if task == None:
+                break
+
+            task.run()
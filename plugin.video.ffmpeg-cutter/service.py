@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import traceback
+
+import xbmc
+import xbmcaddon
+import xbmcgui
+from myutils import jobmanifest, jobqueue, kodiutils
+
+import cutter
+
+POLL_INTERVAL = 10
+
+# running jobs are checked for cancel requests more often than the queue is polled
+CANCEL_INTERVAL = 1
+
+# seconds to wait for each running job on shutdown so that its ffmpeg processes are reaped
+SHUTDOWN_TIMEOUT = 2
+
+addon = xbmcaddon.Addon()
+getMsg = addon.getLocalizedString
+
+
+class CutterService(xbmc.Monitor):
+    """
+    Runs queued cut jobs in background. Jobs are started only if the box is idle, i.e. nobody has
+    pressed a key for a while and nothing is playing.
+    """
+
+    def __init__(self):
+
+        xbmc.Monitor.__init__(self)
+        self._queue = jobqueue.JobQueue(kodiutils.get_addon_profile())
+        self._running = {}
+        self._prefetched = set()
+        self._recordings_sync = None
+
+    def run(self):
+
+        self._migrate_settings()
+        self._queue.recover()
+        jobmanifest.purge(kodiutils.get_addon_profile())
+        self._check_encoder()
+
+        polled = 0
+        while not self.abortRequested():
+
+            self._reap()
+            self._check_cancel_requests()
+            if time.time() - polled >= POLL_INTERVAL:
+                self._schedule()
+                self._sync_recordings()
+                polled = time.time()
+
+            if self.waitForAbort(CANCEL_INTERVAL):
+                break
+
+        self._shutdown()
+
+    def _migrate_settings(self):
+        """
+        Takes over x264 settings of former versions once. Their list of tunes didn't have 'None' as first entry.
+        """
+
+        settings = xbmcaddon.Addon()
+        preset = settings.getSetting("x264_preset")
+        tune = settings.getSetting("x264_tune")
+        if preset == "" and tune == "":
+            return
+
+        if preset != "":
+            settings.setSetting("encoder_preset", preset)
+
+        if tune != "":
+            settings.setSetting("encoder_tune", str(int(tune) + 1))
+
+        settings.setSetting("x264_preset", "")
+        settings.setSetting("x264_tune", "")
+        xbmc.log("x264 settings migrated to encoder settings", xbmc.LOGNOTICE)
+
+    def _check_encoder(self):
+
+        settings = xbmcaddon.Addon()
+        if settings.getSetting("video") == "0":
+            return
+
+        try:
+            cutter.Cutter().check_encoder()
+        except Exception as e:
+            xbmc.log("encoder check failed: %s" % e, xbmc.LOGWARNING)
+
+    def _reap(self):
+
+        for job_id, (job, thread, _cutter) in list(self._running.items()):
+            if not thread.is_alive():
+                del self._running[job_id]
+
+    def _check_cancel_requests(self):
+
+        for job, thread, _cutter in self._running.values():
+            if self._queue.is_cancel_requested(job):
+                _cutter.ffmpegUtils.cancel()
+
+    def _shutdown(self):
+        """
+        Stops ffmpeg processes of running jobs and waits a moment so that they are reaped
+        """
+
+        for job, thread, _cutter in self._running.values():
+            _cutter.ffmpegUtils.cancel()
+
+        for job, thread, _cutter in self._running.values():
+            thread.join(SHUTDOWN_TIMEOUT)
+
+    def _is_idle(self):
+
+        settings = xbmcaddon.Addon()
+        if settings.getSetting("queue_when_idle") != "true":
+            return True
+
+        idle_time = int(settings.getSetting("queue_idle_time") or 0) * 60
+        return xbmc.getGlobalIdleTime() >= idle_time and not xbmc.Player().isPlaying()
+
+    def _schedule(self):
+
+        concurrency = int(xbmcaddon.Addon().getSetting(
+            "queue_concurrency") or 0) + 1
+        queued = [job for job in self._queue.jobs(jobqueue.STATE_QUEUED)
+                  if job["id"] not in self._running]
+
+        while len(queued) > 0 and len(self._running) < concurrency and self._is_idle():
+            job = queued.pop(0)
+            self._queue.set_state(job, jobqueue.STATE_RUNNING)
+
+            _cutter = cutter.Cutter()
+            thread = threading.Thread(
+                target=self._process, args=(job, _cutter))
+            thread.start()
+            self._running[job["id"]] = (job, thread, _cutter)
+
+        # overlap probe and index of next job with encoding of current ones
+        if len(self._running) > 0 and len(queued) > 0 and queued[0]["id"] not in self._prefetched:
+            self._prefetched.add(queued[0]["id"])
+            thread = threading.Thread(target=self._prefetch, args=(queued[0],))
+            thread.daemon = True
+            thread.start()
+
+    def _sync_recordings(self):
+        """
+        Runs full sync of the index of tvheadend's recordings in background once a day, so that the context
+        menu only has to fetch recent recordings
+        """
+
+        if self._recordings_sync != None and self._recordings_sync.is_alive():
+            return
+
+        if not xbmc.getCondVisibility("System.HasAddon(pvr.hts)") or not self._is_idle():
+            return
+
+        _cutter = cutter.Cutter()
+        if not _cutter.recordingsIndex.needs_full_sync():
+            return
+
+        def _sync():
+            try:
+                _cutter.sync_recordings_index(full=True)
+            except Exception:
+                xbmc.log(traceback.format_exc(), xbmc.LOGERROR)
+
+        self._recordings_sync = threading.Thread(target=_sync)
+        self._recordings_sync.daemon = True
+        self._recordings_sync.start()
+
+    def _process(self, job, _cutter):
+
+        try:
+            _cutter.process(job)
+            self._queue.set_state(job, jobqueue.STATE_DONE)
+
+        except Exception as e:
+            if self.abortRequested():
+                # job stays in state running and is requeued at next start
+                xbmc.log("job %s interrupted by shutdown" %
+                         job["id"], xbmc.LOGNOTICE)
+                return
+
+            if _cutter.ffmpegUtils.is_cancelled():
+                _cutter.discard(job)
+                self._queue.set_state(job, jobqueue.STATE_CANCELLED)
+                self._queue.clear_cancel_request(job)
+                xbmcgui.Dialog().notification(getMsg(32001), getMsg(32145),
+                                              xbmcgui.NOTIFICATION_INFO)
+                return
+
+            xbmc.log(traceback.format_exc(), xbmc.LOGERROR)
+            self._queue.set_state(job, jobqueue.STATE_FAILED, error=str(e))
+            xbmcgui.Dialog().notification(getMsg(32001), getMsg(32130),
+                                          xbmcgui.NOTIFICATION_ERROR)
+
+    def _prefetch(self, job):
+
+        try:
+            cutter.Cutter().prefetch(job)
+        except Exception as e:
+            xbmc.log("prefetch of job %s failed: %s" %
+                     (job["id"], e), xbmc.LOGWARNING)
+
+
+if __name__ == '__main__':
+    CutterService().run()
@@ -0,0 +1,65 @@
+# coding=utf-8
+"""
+Tests of the preview frame cache outside Kodi, Kodi's modules are replaced by the stand-ins in kodistubs.
+
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT_DIR, "kodistubs"),
+                os.path.join(ROOT_DIR, "plugin.video.ffmpeg-cutter")]
+
+from myutils import thumbnails
+
+
+class ThumbnailCacheTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+        self.cache = thumbnails.ThumbnailCache(
+            os.path.join(self.directory, "profile"))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.directory)
+
+    def _recording(self, name):
+
+        # byte string in Python 2 like paths of Kodi's list items, unicode in Python 3
+        filename = os.path.join(self.directory, name)
+        with open(filename, "wb") as f:
+            f.write(b"\0" * 188)
+
+        return filename
+
+    def test_path_for_non_ascii_filename(self):
+
+        filename = self._recording("M\xc3\xbcller.mkv" if str is bytes else u"M\xfcller.mkv")
+
+        path = self.cache.path_for(filename, 12.5)
+
+        self.assertEqual(path, self.cache.path_for(filename, 12.5))
+        self.assertNotEqual(path, self.cache.path_for(filename, 13.5))
+        self.assertTrue(path.endswith(".jpg"))
+
+    def test_get_non_ascii_filename(self):
+
+        filename = self._recording("M\xc3\xbcller.mkv" if str is bytes else u"M\xfcller.mkv")
+        self.assertEqual(self.cache.get(filename, 12.5), None)
+
+        with open(self.cache.path_for(filename, 12.5), "wb") as f:
+            f.write(b"\xff\xd8")
+
+        self.assertEqual(self.cache.get(filename, 12.5),
+                         self.cache.path_for(filename, 12.5))
+
+
+if __name__ == "__main__":
+    unittest.main()